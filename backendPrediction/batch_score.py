@@ -0,0 +1,312 @@
+"""
+Scoring offline di una coorte di pazienti, senza passare dall'API HTTP.
+
+Il manifest è lo stesso JSON di create_patient_dataset_from_json:
+{categoria: {patient_id: [percorsi dei file]}}. I pazienti vengono elaborati a
+blocchi di --chunk-size: per ogni blocco il preprocessing gira in parallelo su
+--workers processi (lo stesso pool per tutto lo scoring), il modello viene valutato con una sola chiamata predict_proba
+e le righe vengono aggiunte subito all'output. Dopo ogni blocco il checkpoint
+registra i blocchi completati: rilanciando lo stesso comando dopo un'interruzione
+lo scoring riprende dal primo blocco non completato.
+
+Esempio:
+    python batch_score.py manifest.json --model assets/catboost.cbm --output scores.csv --workers 8
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import preprocessing as pre
+import prediction as pred
+import model_registry as mr
+
+CHECKPOINT_VERSION = 1
+
+
+def manifest_chunks(data, chunk_size):
+    """
+    Divide il manifest in blocchi di chunk_size pazienti, nell'ordine del JSON.
+
+    Returns:
+        list: Manifest parziali {categoria: {patient_id: percorsi}}
+    """
+    patients = [(category, patient_id, file_paths)
+                for category, category_patients in data.items()
+                for patient_id, file_paths in category_patients.items()]
+    chunks = []
+    for start in range(0, len(patients), chunk_size):
+        chunk = {}
+        for category, patient_id, file_paths in patients[start:start + chunk_size]:
+            chunk.setdefault(category, {})[patient_id] = file_paths
+        chunks.append(chunk)
+    return chunks
+
+
+def score_chunk(chunk, loaded_model, base_dir, workers, threshold=None, executor=None):
+    """
+    Prepara e valuta un blocco di pazienti.
+
+    Lo stesso patient_id può comparire in più categorie: i risultati sono indicizzati
+    per (categoria, patient_id).
+
+    Args:
+        executor (ProcessPoolExecutor): Pool di preprocessing.patient_pool riusato tra i blocchi
+
+    Returns:
+        pd.DataFrame: Una riga per paziente del blocco (anche quelli scartati, con status
+            "skipped" e l'errore), nell'ordine del manifest
+    """
+    errors = []
+    cohort = pre.build_patient_cohort(chunk, base_dir, loaded_model.layout, workers=workers, errors=errors,
+                                      executor=executor)
+
+    classes = loaded_model.classes.tolist()
+    probability_columns = [f"probability_{cls}" for cls in classes]
+    scored = {}
+    if len(cohort):
+        probabilities = loaded_model.model.predict_proba(pred.make_pool(loaded_model, cohort.matrix()),
+                                                         thread_count=loaded_model.thread_count)
+        class_indices = pred.decide_classes(probabilities, threshold)
+        for i, key in enumerate(zip(cohort.categories, cohort.patient_ids)):
+            scored[key] = (loaded_model.classes[class_indices[i]],
+                                  probabilities[i, class_indices[i]], probabilities[i])
+
+    skipped_errors = {}
+    for error in errors:
+        if error["skipped"]:
+            skipped_errors.setdefault((error["category"], error["patient_id"]),
+                                      f"{error['file_type']}: {error['error']}")
+
+    rows = []
+    for category, patients in chunk.items():
+        for patient_id in patients:
+            row = {'patient_id': patient_id, 'category': category}
+            if (category, patient_id) in scored:
+                predicted_class, confidence, probability = scored[category, patient_id]
+                row.update({'status': 'ok', 'predicted_class': predicted_class, 'confidence': float(confidence)})
+                row.update(zip(probability_columns, probability.tolist()))
+                row['error'] = ''
+            else:
+                row.update({'status': 'skipped', 'predicted_class': None, 'confidence': np.nan})
+                row.update(dict.fromkeys(probability_columns, np.nan))
+                row['error'] = skipped_errors.get((category, patient_id),
+                                                  'Paziente scartato durante il preprocessing')
+            row['model_version'] = loaded_model.version
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+class ScoreWriter:
+    """
+    Output incrementale: un file CSV a cui vengono aggiunte le righe di ogni blocco,
+    oppure una cartella Parquet con un file per blocco.
+    """
+
+    def __init__(self, output, output_format):
+        self.output = output
+        self.output_format = output_format
+        if output_format == 'parquet':
+            # Solleva ImportError se pyarrow/fastparquet non sono installati
+            pd.io.parquet.get_engine('auto')
+            os.makedirs(output, exist_ok=True)
+
+    def position(self):
+        """Posizione di ripresa dell'output (byte del CSV scritti finora)"""
+        if self.output_format == 'csv':
+            return os.path.getsize(self.output) if os.path.exists(self.output) else 0
+        return None
+
+    def has_output(self):
+        if self.output_format == 'csv':
+            return self.position() > 0
+        return any(name.startswith('part-') for name in os.listdir(self.output))
+
+    def clear(self):
+        """Elimina l'output di uno scoring precedente"""
+        if self.output_format == 'csv':
+            self.truncate(0)
+            return
+        for name in os.listdir(self.output):
+            if name.startswith('part-') and name.endswith('.parquet'):
+                os.remove(os.path.join(self.output, name))
+
+    def truncate(self, position):
+        """Scarta quanto scritto dopo l'ultimo checkpoint (blocco interrotto a metà)"""
+        if self.output_format == 'csv' and os.path.exists(self.output):
+            with open(self.output, 'r+b') as f:
+                f.truncate(position)
+
+    def write(self, chunk_index, df):
+        if self.output_format == 'csv':
+            header = self.position() == 0
+            with open(self.output, 'a', newline='') as f:
+                df.to_csv(f, header=header, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            # Un file per blocco: riscrivere un blocco dopo un'interruzione lo sostituisce
+            df.to_parquet(os.path.join(self.output, f"part-{chunk_index:05d}.parquet"), index=False)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checkpoint(path, expected):
+    """
+    Legge il checkpoint se corrisponde allo stesso scoring (manifest, modello e parametri).
+
+    Raises:
+        ValueError: Se esiste un checkpoint di uno scoring diverso
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    mismatched = [key for key, value in expected.items() if checkpoint.get(key) != value]
+    if mismatched:
+        raise ValueError(f"Il checkpoint {path} appartiene a uno scoring diverso ({', '.join(mismatched)}): "
+                         f"usa --restart per ricominciare")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def run(manifest_path, model_path, output, base_dir='', workers=None, chunk_size=256, threshold=None,
+        output_format=None, checkpoint_path=None, restart=False):
+    """
+    Esegue lo scoring del manifest, riprendendo dal checkpoint se presente.
+
+    Returns:
+        dict: Riepilogo (pazienti valutati, scartati, blocchi, secondi)
+    """
+    output_format = output_format or ('parquet' if output.lower().endswith('.parquet') else 'csv')
+    checkpoint_path = checkpoint_path or f"{output.rstrip(os.sep)}.checkpoint.json"
+    workers = pre.PREPROCESSING_WORKERS if workers is None else workers
+
+    with open(manifest_path) as f:
+        data = json.load(f)
+    loaded_model = mr.get_model(model_path)
+    chunks = manifest_chunks(data, chunk_size)
+    writer = ScoreWriter(output, output_format)
+
+    expected = {
+        'version': CHECKPOINT_VERSION,
+        'manifest_sha256': file_digest(manifest_path),
+        'model_sha1': loaded_model.sha1,
+        'chunk_size': chunk_size,
+        'threshold': threshold,
+        'output_format': output_format,
+    }
+    checkpoint = None
+    if restart:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        writer.clear()
+    else:
+        checkpoint = load_checkpoint(checkpoint_path, expected)
+    if checkpoint is None:
+        if writer.has_output():
+            raise ValueError(f"L'output {output} esiste già senza checkpoint: usa --restart per sovrascriverlo")
+        checkpoint = {**expected, 'chunks_done': 0, 'scored': 0, 'skipped': 0, 'output_position': 0}
+    else:
+        print(f"Ripresa dal blocco {checkpoint['chunks_done'] + 1}/{len(chunks)} "
+              f"({checkpoint['scored']} pazienti già valutati)")
+        writer.truncate(checkpoint['output_position'])
+
+    started = time.time()
+    # Un solo pool di processi per tutti i blocchi: il layout viene inviato ai worker una volta
+    pending = len(chunks) > checkpoint['chunks_done']
+    pool = pre.patient_pool(workers, loaded_model.layout) if workers > 1 and pending else None
+    with pool or contextlib.nullcontext():
+        for chunk_index in range(checkpoint['chunks_done'], len(chunks)):
+            chunk_started = time.time()
+            df = score_chunk(chunks[chunk_index], loaded_model, base_dir, workers, threshold, executor=pool)
+            writer.write(chunk_index, df)
+
+            scored = int((df['status'] == 'ok').sum())
+            checkpoint.update({
+                'chunks_done': chunk_index + 1,
+                'scored': checkpoint['scored'] + scored,
+                'skipped': checkpoint['skipped'] + len(df) - scored,
+                'output_position': writer.position(),
+            })
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.time() - chunk_started
+            print(f"Blocco {chunk_index + 1}/{len(chunks)}: {scored}/{len(df)} pazienti valutati "
+                  f"in {elapsed:.1f}s ({len(df) / max(elapsed, 1e-9):.1f} pazienti/s)")
+
+    return {
+        'scored': checkpoint['scored'],
+        'skipped': checkpoint['skipped'],
+        'chunks': len(chunks),
+        'seconds': round(time.time() - started, 2),
+        'output': output,
+        'checkpoint': checkpoint_path,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scoring offline di un manifest di pazienti TCGA")
+    parser.add_argument('manifest', help="JSON {categoria: {patient_id: [percorsi dei file]}}")
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', 'assets/catboost.cbm'),
+                        help="Modello CatBoost (default MODEL_PATH o assets/catboost.cbm)")
+    parser.add_argument('--output', required=True,
+                        help="File .csv oppure cartella .parquet (un file per blocco) dei risultati")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default=None,
+                        help="Formato dell'output (default dall'estensione di --output)")
+    parser.add_argument('--base-dir', default='', help="Directory da anteporre ai percorsi relativi del manifest")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processi per il preprocessing (default PREPROCESSING_WORKERS)")
+    parser.add_argument('--chunk-size', type=int, default=256, help="Pazienti per blocco (default 256)")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Soglia di decisione per i modelli binari (default DECISION_THRESHOLD)")
+    parser.add_argument('--checkpoint', default=None, help="File di checkpoint (default <output>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="Ignora il checkpoint e ricomincia da capo")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size deve essere almeno 1")
+    if args.threshold is not None and not 0.0 <= args.threshold <= 1.0:
+        parser.error("--threshold deve essere compresa tra 0 e 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        summary = run(args.manifest, args.model, args.output, base_dir=args.base_dir, workers=args.workers,
+                      chunk_size=args.chunk_size, threshold=args.threshold, output_format=args.format,
+                      checkpoint_path=args.checkpoint, restart=args.restart)
+    except KeyboardInterrupt:
+        print("\nScoring interrotto: rilancia lo stesso comando per riprendere dall'ultimo blocco completato")
+        return 130
+    except (ValueError, ImportError, OSError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+    print(f"✅ Scoring completato: {summary['scored']} pazienti valutati, {summary['skipped']} scartati "
+          f"in {summary['seconds']}s -> {summary['output']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Benchmark dei percorsi critici di preprocessing e predizione.
+
+Genera file GDC sintetici di dimensioni realistiche (vedi synthetic.py), addestra
+un piccolo modello CatBoost locale e misura:
+- i parser process_gene_expression, process_mirna_isoform, process_mirna_aggregate;
+- la costruzione della riga di un paziente nel layout del modello (percorso delle richieste);
+- align_features_with_model e map_features_to_gene_names;
+- /predict end-to-end tramite il client di test Flask.
+
+Ogni caso gira in un processo figlio separato (fork), così che il picco di RSS
+riportato sia quello del singolo caso. Per ogni caso vengono riportati p50/p99
+della latenza, throughput e picco di RSS, confrontati con la baseline salvata.
+
+Uso (dalla cartella backendPrediction):
+    python benchmarks/bench.py                    # confronto con benchmarks/baseline.json
+    python benchmarks/bench.py --quick            # file più piccoli e meno ripetizioni
+    python benchmarks/bench.py --save-baseline    # salva i risultati come nuova baseline
+    python benchmarks/bench.py --fail-on-regression --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+# Senza cache dei file elaborati: ogni chiamata misura il parsing come alla prima richiesta
+os.environ['PARSE_CACHE_MAX_BYTES'] = '0'
+
+import synthetic  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+FULL_PARAMS = {'genes': synthetic.GENE_COUNT, 'mirnas': synthetic.MIRNA_COUNT,
+               'isoforms_per_mirna': synthetic.ISOFORMS_PER_MIRNA, 'patients': 6,
+               'model_features': 5000, 'repeat': 20}
+QUICK_PARAMS = {'genes': 5000, 'mirnas': 400, 'isoforms_per_mirna': 3, 'patients': 4,
+                'model_features': 1000, 'repeat': 5}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Nasconde le stampe e le barre di avanzamento delle funzioni misurate"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def measure(function, repeat, warmup=1):
+    """Esegue function warmup + repeat volte; restituisce le durate in secondi delle ripetizioni misurate"""
+    with quiet():
+        for _ in range(warmup):
+            function()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times, items=1, nbytes=None):
+    """Latenze p50/p99 e throughput (item/s ed eventualmente MB/s) di una serie di durate"""
+    times = np.asarray(times)
+    mean = float(times.mean())
+    summary = {
+        'runs': len(times),
+        'p50_ms': round(float(np.percentile(times, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(times, 99)) * 1000, 3),
+        'mean_ms': round(mean * 1000, 3),
+        'throughput_per_s': round(items / mean, 2),
+    }
+    if nbytes:
+        summary['mb_per_s'] = round(nbytes / mean / 1e6, 2)
+    return summary
+
+
+# --- Casi di benchmark: ognuno restituisce (durate, item per chiamata, byte letti per chiamata) ---
+
+def _patient_files(workspace):
+    category, patients = next(iter(workspace['manifest'].items()))
+    patient_id, files = next(iter(patients.items()))
+    return category, patient_id, files
+
+
+def case_process_gene_expression(workspace, repeat):
+    import preprocessing as pre
+    path = _patient_files(workspace)[2][0]
+    return measure(lambda: pre.process_gene_expression(path), repeat), 1, os.path.getsize(path)
+
+
+def case_process_mirna_isoform(workspace, repeat):
+    import preprocessing as pre
+    path = _patient_files(workspace)[2][1]
+    return measure(lambda: pre.process_mirna_isoform(path), repeat), 1, os.path.getsize(path)
+
+
+def case_process_mirna_aggregate(workspace, repeat):
+    import preprocessing as pre
+    path = _patient_files(workspace)[2][2]
+    return measure(lambda: pre.process_mirna_aggregate(path), repeat), 1, os.path.getsize(path)
+
+
+def case_patient_matrix(workspace, repeat):
+    """Riga di un paziente scritta direttamente nel layout del modello (come le richieste /predict)"""
+    import preprocessing as pre
+    import model_registry as mr
+    loaded_model = mr.get_model(workspace['model_path'])
+    pre.prepare_layout(loaded_model.layout)
+    category, patient_id, files = _patient_files(workspace)
+    data = {category: {patient_id: files}}
+    nbytes = sum(os.path.getsize(path) for path in files)
+    return measure(lambda: pre.create_patient_matrix_from_json(data, '', loaded_model.layout), repeat), 1, nbytes
+
+
+def case_align_features_with_model(workspace, repeat):
+    import preprocessing as pre
+    import prediction as pred
+    import model_registry as mr
+    loaded_model = mr.get_model(workspace['model_path'])
+    category, patient_id, files = _patient_files(workspace)
+    with quiet():
+        sample_df = pre.create_patient_dataset_from_json({category: {patient_id: files}}, '')
+    return measure(lambda: pred.align_features_with_model(sample_df, loaded_model), repeat), 1, None
+
+
+def case_map_features_to_gene_names(workspace, repeat):
+    import prediction as pred
+    import model_registry as mr
+    loaded_model = mr.get_model(workspace['model_path'])
+    top_features = loaded_model.importance_df.head(10)
+    base_dir = workspace['dir']
+    # Operazione breve: più ripetizioni per percentili stabili
+    times = measure(lambda: pred.map_features_to_gene_names(top_features, base_dir, loaded_model.layout),
+                    repeat * 10)
+    return times, len(top_features), None
+
+
+def case_predict_endpoint(workspace, repeat):
+    """POST /predict con i tre file di un paziente (upload, preprocessing, predizione, spiegazione)"""
+    os.environ['MODEL_PATH'] = workspace['model_path']
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workspace['dir'], 'uploads')
+    os.environ['JOB_DB_PATH'] = os.path.join(workspace['dir'], 'jobs.sqlite3')
+    os.chdir(workspace['dir'])
+    with quiet():
+        import flask_app
+    client = flask_app.app.test_client()
+    files = _patient_files(workspace)[2]
+    nbytes = sum(os.path.getsize(path) for path in files)
+
+    def post():
+        handles = [open(path, 'rb') for path in files]
+        try:
+            response = client.post('/predict', data={'files': [(f, os.path.basename(f.name)) for f in handles]},
+                                   content_type='multipart/form-data')
+        finally:
+            for handle in handles:
+                handle.close()
+        result = response.get_json()
+        if not result.get('success'):
+            raise RuntimeError(result.get('error'))
+
+    return measure(post, repeat), 1, nbytes
+
+
+CASES = {
+    'process_gene_expression': case_process_gene_expression,
+    'process_mirna_isoform': case_process_mirna_isoform,
+    'process_mirna_aggregate': case_process_mirna_aggregate,
+    'patient_matrix': case_patient_matrix,
+    'align_features_with_model': case_align_features_with_model,
+    'map_features_to_gene_names': case_map_features_to_gene_names,
+    'predict_endpoint': case_predict_endpoint,
+}
+
+
+def _run_case_child(name, workspace, repeat, conn):
+    try:
+        times, items, nbytes = CASES[name](workspace, repeat)
+        summary = summarize(times, items, nbytes)
+        # ru_maxrss è in KB su Linux
+        summary['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        conn.send(summary)
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+def run_case(name, workspace, repeat):
+    """Esegue un caso in un processo figlio e ne restituisce il riepilogo"""
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_child, args=(name, workspace, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    summary = parent_conn.recv()
+    process.join()
+    return summary
+
+
+def prepare_workspace(work_dir, params):
+    """
+    Genera i file sintetici e addestra il modello, riusando quelli già presenti in
+    work_dir se generati con gli stessi parametri.
+    """
+    params_path = os.path.join(work_dir, 'params.json')
+    manifest_path = os.path.join(work_dir, 'manifest.json')
+    model_path = os.path.join(work_dir, 'assets', 'catboost.cbm')
+    data_params = {key: params[key] for key in ('genes', 'mirnas', 'isoforms_per_mirna', 'patients',
+                                                'model_features')}
+    workspace = {'dir': work_dir, 'model_path': model_path}
+
+    if os.path.exists(params_path) and os.path.exists(model_path):
+        with open(params_path) as f:
+            if json.load(f) == data_params:
+                with open(manifest_path) as f:
+                    workspace['manifest'] = json.load(f)
+                return workspace
+
+    print(f"Generazione di {params['patients']} pazienti sintetici e addestramento del modello di benchmark "
+          f"su {params['model_features']} feature in {work_dir}...")
+    with quiet():
+        data = synthetic.write_workspace(work_dir, params['patients'], params['genes'], params['mirnas'],
+                                         params['isoforms_per_mirna'], params['model_features'])['manifest']
+
+    with open(manifest_path, 'w') as f:
+        json.dump(data, f)
+    with open(params_path, 'w') as f:
+        json.dump(data_params, f)
+    workspace['manifest'] = data
+    return workspace
+
+
+def compare(results, baseline, tolerance):
+    """
+    Confronta p50 e picco di RSS con la baseline.
+
+    Returns:
+        list: Casi peggiorati oltre la tolleranza
+    """
+    regressions = []
+    for name, summary in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None or 'error' in summary or 'error' in base:
+            continue
+        for metric in ('p50_ms', 'peak_rss_mb'):
+            if summary[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {base[metric]} -> {summary[metric]}")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    header = f"{'caso':<28}{'p50 ms':>10}{'p99 ms':>10}{'item/s':>10}{'MB/s':>8}{'RSS MB':>9}{'Δ p50':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, summary in results.items():
+        if 'error' in summary:
+            print(f"{name:<28}ERRORE\n{summary['error']}")
+            continue
+        delta = ''
+        base = (baseline or {}).get('results', {}).get(name)
+        if base and 'p50_ms' in base:
+            delta = f"{(summary['p50_ms'] / base['p50_ms'] - 1) * 100:+.0f}%"
+        print(f"{name:<28}{summary['p50_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['throughput_per_s']:>10.1f}"
+              f"{summary.get('mb_per_s', ''):>8}{summary['peak_rss_mb']:>9.1f}{delta:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di preprocessing e predizione")
+    parser.add_argument('--quick', action='store_true', help="File più piccoli e meno ripetizioni")
+    parser.add_argument('--repeat', type=int, default=None, help="Ripetizioni misurate per caso")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES), help="Casi da eseguire")
+    parser.add_argument('--work-dir', default=None,
+                        help="Cartella dei dati sintetici (riusati tra esecuzioni; default temporanea)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="File JSON della baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="Salva i risultati come baseline")
+    parser.add_argument('--output', default=None, help="Salva i risultati in questo file JSON")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Peggioramento relativo tollerato rispetto alla baseline (default 0.25)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Esce con codice 1 se un caso peggiora oltre la tolleranza")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = dict(QUICK_PARAMS if args.quick else FULL_PARAMS)
+    if args.repeat is not None:
+        params['repeat'] = args.repeat
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        workspace = prepare_workspace(os.path.abspath(work_dir), params)
+        results = {}
+        for name in args.cases:
+            print(f"Esecuzione {name}...")
+            results[name] = run_case(name, workspace, params['repeat'])
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'params': params,
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpu_count': os.cpu_count()},
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Il numero di ripetizioni non cambia cosa viene misurato
+        base_params = {key: value for key, value in baseline.get('params', {}).items() if key != 'repeat'}
+        if base_params != {key: value for key, value in params.items() if key != 'repeat'}:
+            print(f"⚠️  Baseline generata con parametri diversi ({baseline.get('params')}): confronto non significativo")
+            baseline = None
+
+    print()
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline salvata in {args.baseline}")
+
+    failed = any('error' in summary for summary in results.values())
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Peggioramenti oltre il {args.tolerance:.0%} rispetto alla baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            failed = failed or args.fail_on_regression
+        else:
+            print(f"\n✅ Nessun peggioramento oltre il {args.tolerance:.0%} rispetto alla baseline")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Generatori di file omici sintetici con il formato e le dimensioni dei file GDC/TCGA.
+
+- STAR augmented_star_gene_counts.tsv: riga di commento, 4 righe N_* e ~60k geni;
+- mirbase21.isoforms.quantification.txt: più isoforme per miRNA, con miRNA_region;
+- mirbase21.mirnas.quantification.txt: una riga per ognuno dei ~1900 miRNA.
+
+Gli stessi ID di geni e miRNA sono usati per tutti i pazienti (come nei file reali),
+con valori diversi per seed; il modello di benchmark viene addestrato su questi file.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Dimensioni tipiche dei file GDC
+GENE_COUNT = 60660
+MIRNA_COUNT = 1881
+ISOFORMS_PER_MIRNA = 4
+
+GENE_COLUMNS = ["gene_id", "gene_name", "gene_type", "unstranded", "stranded_first", "stranded_second",
+                "tpm_unstranded", "fpkm_unstranded", "fpkm_uq_unstranded"]
+MIRNA_REGIONS = np.asarray(["mature,MIMAT0000062", "mature,MIMAT0004481", "precursor", "stemloop",
+                            "unannotated"], dtype=object)
+
+
+def gene_ids(n_genes=GENE_COUNT):
+    return np.asarray([f"ENSG{i:011d}.{i % 20 + 1}" for i in range(n_genes)], dtype=object)
+
+
+def mirna_ids(n_mirnas=MIRNA_COUNT):
+    return np.asarray([f"hsa-mir-{i + 1}" for i in range(n_mirnas)], dtype=object)
+
+
+def write_gene_counts(path, seed=0, n_genes=GENE_COUNT):
+    """Scrive un file STAR augmented_star_gene_counts.tsv sintetico"""
+    rng = np.random.default_rng(seed)
+    counts = rng.negative_binomial(2, 0.002, size=(n_genes, 3))
+    df = pd.DataFrame({
+        "gene_id": gene_ids(n_genes),
+        "gene_name": [f"GENE{i}" for i in range(n_genes)],
+        "gene_type": "protein_coding",
+        "unstranded": counts[:, 0],
+        "stranded_first": counts[:, 1],
+        "stranded_second": counts[:, 2],
+        "tpm_unstranded": np.round(rng.gamma(0.5, 20, n_genes), 4),
+        "fpkm_unstranded": np.round(rng.gamma(0.5, 8, n_genes), 4),
+        "fpkm_uq_unstranded": np.round(rng.gamma(0.5, 15, n_genes), 4),
+    }, columns=GENE_COLUMNS)
+    summary = pd.DataFrame({
+        "gene_id": ["N_unmapped", "N_multimapping", "N_noFeature", "N_ambiguous"],
+        "unstranded": rng.integers(10 ** 5, 10 ** 7, 4),
+        "stranded_first": rng.integers(10 ** 5, 10 ** 7, 4),
+        "stranded_second": rng.integers(10 ** 5, 10 ** 7, 4),
+    }, columns=GENE_COLUMNS)
+    with open(path, 'w') as f:
+        f.write("# gene-model: GENCODE v36\n")
+        pd.concat([summary, df]).to_csv(f, sep='\t', index=False)
+    return path
+
+
+def write_mirna_isoforms(path, seed=0, n_mirnas=MIRNA_COUNT, isoforms_per_mirna=ISOFORMS_PER_MIRNA):
+    """Scrive un file mirbase21.isoforms.quantification.txt sintetico"""
+    rng = np.random.default_rng(seed)
+    # Numero di isoforme variabile per miRNA (almeno una)
+    isoform_counts = rng.poisson(isoforms_per_mirna - 1, n_mirnas) + 1
+    ids = np.repeat(mirna_ids(n_mirnas), isoform_counts)
+    n_rows = len(ids)
+    starts = rng.integers(10 ** 6, 10 ** 8, n_rows)
+    read_count = rng.negative_binomial(1, 0.05, n_rows)
+    df = pd.DataFrame({
+        "miRNA_ID": ids,
+        "isoform_coords": [f"hg38:chr1:{start}-{start + 22}:+" for start in starts],
+        "read_count": read_count,
+        "reads_per_million_miRNA_mapped": np.round(read_count * 0.5099, 6),
+        "cross-mapped": "N",
+        "miRNA_region": MIRNA_REGIONS[rng.integers(0, len(MIRNA_REGIONS), n_rows)],
+    })
+    df.to_csv(path, sep='\t', index=False)
+    return path
+
+
+def write_mirna_aggregate(path, seed=0, n_mirnas=MIRNA_COUNT):
+    """Scrive un file mirbase21.mirnas.quantification.txt sintetico"""
+    rng = np.random.default_rng(seed)
+    read_count = rng.negative_binomial(1, 0.001, n_mirnas)
+    df = pd.DataFrame({
+        "miRNA_ID": mirna_ids(n_mirnas),
+        "read_count": read_count,
+        "reads_per_million_miRNA_mapped": np.round(read_count * 0.5099, 6),
+        "cross-mapped": "N",
+    })
+    df.to_csv(path, sep='\t', index=False)
+    return path
+
+
+def write_cohort(data_dir, n_patients, n_genes=GENE_COUNT, n_mirnas=MIRNA_COUNT,
+                 isoforms_per_mirna=ISOFORMS_PER_MIRNA):
+    """
+    Scrive i tre file di n_patients pazienti sintetici.
+
+    Returns:
+        dict: Manifest {categoria: {patient_id: [percorsi]}} (categorie alternate tumor/normal)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    data = {"tumor": {}, "normal": {}}
+    for i in range(n_patients):
+        patient_id = f"TCGA-BM-{i:04d}"
+        files = [
+            write_gene_counts(os.path.join(data_dir, f"{patient_id}.rna_seq.augmented_star_gene_counts.tsv"),
+                              seed=i, n_genes=n_genes),
+            write_mirna_isoforms(os.path.join(data_dir, f"{patient_id}.mirbase21.isoforms.quantification.txt"),
+                                 seed=i, n_mirnas=n_mirnas, isoforms_per_mirna=isoforms_per_mirna),
+            write_mirna_aggregate(os.path.join(data_dir, f"{patient_id}.mirbase21.mirnas.quantification.txt"),
+                                  seed=i, n_mirnas=n_mirnas),
+        ]
+        data["tumor" if i % 2 else "normal"][patient_id] = files
+    return data
+
+
+def train_model(cohort_df, labels, model_path, n_features=5000, iterations=50, seed=0):
+    """
+    Addestra un piccolo modello CatBoost su un sottoinsieme delle colonne della coorte.
+
+    Le feature miRNA_region sono categoriche, come nel modello di produzione; il
+    sottoinsieme rende l'addestramento rapido mantenendo il costo dell'allineamento
+    di un sample completo su un layout più piccolo.
+    """
+    from catboost import CatBoostClassifier
+
+    rng = np.random.default_rng(seed)
+    columns = cohort_df.columns.to_numpy()
+    n_features = min(n_features, len(columns))
+    selected = np.sort(rng.choice(len(columns), n_features, replace=False))
+    df = cohort_df.iloc[:, selected].copy()
+    cat_features = [i for i, name in enumerate(df.columns) if name.endswith("|miRNA_region")]
+    for name in df.columns[cat_features]:
+        df[name] = df[name].fillna("missing").astype(str)
+
+    model = CatBoostClassifier(iterations=iterations, depth=4, random_seed=seed, verbose=0,
+                               cat_features=cat_features, allow_writing_files=False)
+    model.fit(df, labels)
+    model.save_model(model_path)
+    return model_path
+
+
+def write_workspace(work_dir, n_patients, n_genes=GENE_COUNT, n_mirnas=MIRNA_COUNT,
+                    isoforms_per_mirna=ISOFORMS_PER_MIRNA, model_features=5000, iterations=50):
+    """
+    Genera una coorte sintetica in work_dir/assets/data e addestra il modello in work_dir/assets/catboost.cbm.
+
+    I file stanno in assets/data accanto al modello: lì li cerca anche l'indice dei geni.
+
+    Returns:
+        dict: {'dir', 'model_path', 'manifest'} (manifest come write_cohort, etichetta 0 per i normal)
+    """
+    import preprocessing as pre
+
+    model_path = os.path.join(work_dir, 'assets', 'catboost.cbm')
+    data = write_cohort(os.path.join(work_dir, 'assets', 'data'), n_patients, n_genes, n_mirnas,
+                        isoforms_per_mirna)
+    cohort_df = pre.create_patient_dataset_from_json(data, '')
+    labels = [0 if patient_id in data['normal'] else 1 for patient_id in cohort_df.index]
+    train_model(cohort_df, labels, model_path, n_features=model_features, iterations=iterations)
+    return {'dir': work_dir, 'model_path': model_path, 'manifest': data}
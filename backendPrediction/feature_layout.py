@@ -0,0 +1,408 @@
+"""
+Layout delle feature attese da un modello e allineamento vettorizzato dei sample.
+
+Il layout viene calcolato una sola volta per modello caricato: contiene la mappa
+nome feature -> indice di colonna e un template preallocato in float32. Ogni
+sample viene poi allineato con un unico scatter NumPy invece di costruire un
+DataFrame per ogni feature.
+"""
+
+import hashlib
+import string
+
+import numpy as np
+import pandas as pd
+
+import instrumentation as ins
+
+# Valore usato per le feature categoriche assenti dal sample (come lo 0 delle numeriche)
+CAT_DEFAULT = "0"
+# Valore usato per le feature categoriche presenti ma NaN
+CAT_MISSING = "missing"
+
+
+def feature_gene_ids(feature_names):
+    """
+    Estrae in modo vettorizzato l'ID del gene da ogni nome di feature.
+
+    Stessa regola di extract_gene_id_from_feature: dal primo '_' seguito da
+    caratteri diversi da '_' e '|' fino al '|'; in mancanza, tutto ciò che segue
+    il primo '_' fino al primo '|'; altrimenti il nome della feature.
+    """
+    names = pd.Series(list(feature_names), dtype=object).astype(str)
+    gene_ids = names.str.extract(r'_([^_|]+)\|', expand=False)
+    fallback = names.str.split('_', n=1).str[1].str.split('|').str[0]
+    gene_ids = gene_ids.fillna(fallback).fillna(names)
+    return gene_ids.to_numpy(dtype=object)
+
+
+def isoform_suffix_table(size):
+    """
+    Suffissi alfabetici delle isoforme per gli ordinali 0..size-1.
+
+    Stessa regola di process_mirna_isoform: 'a'..'z', poi 'a1'..'z1', 'a2'...
+    """
+    ordinals = np.arange(size)
+    letters = np.asarray(list(string.ascii_lowercase), dtype=object)[ordinals % 26]
+    rounds = (ordinals // 26).astype(str).astype(object)
+    rounds[ordinals < 26] = ""
+    return letters + rounds
+
+
+def isoform_suffix_ordinals(suffixes):
+    """
+    Inverso di isoform_suffix_table: ordinale di ogni suffisso, -1 se non valido.
+    """
+    suffixes = pd.Series(list(suffixes), dtype=object).fillna('').astype(str)
+    valid = suffixes.str.fullmatch(r'[a-z](?:[1-9][0-9]*)?').to_numpy(dtype=bool)
+    letters = pd.Index(list(string.ascii_lowercase)).get_indexer(suffixes.str[0].fillna(''))
+    rounds = pd.to_numeric(suffixes.str[1:].where(valid, ''), errors='coerce')
+    rounds = rounds.fillna(0).to_numpy(dtype=np.int64)
+    return np.where(valid, letters + 26 * rounds, -1)
+
+
+def _to_float32(block):
+    """Converte un blocco di colonne in una matrice float32, forzando a NaN i valori non numerici"""
+    try:
+        return block.to_numpy(dtype=np.float32, na_value=np.nan)
+    except (ValueError, TypeError):
+        return block.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+
+
+class FeatureLayout:
+    """Piano di allineamento delle feature per un modello"""
+
+    def __init__(self, feature_names, cat_feature_indices=(), fill_value=0.0, cat_fill_value=CAT_DEFAULT,
+                 cat_missing_value=CAT_MISSING):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+        self.index = pd.Index(self.feature_names)
+
+        self.is_cat = np.zeros(self.n_features, dtype=bool)
+        self.cat_positions = np.asarray(sorted(cat_feature_indices), dtype=np.intp)
+        self.is_cat[self.cat_positions] = True
+        # Posizione di ogni feature categorica all'interno della matrice delle categoriche
+        self.cat_slot = np.full(self.n_features, -1, dtype=np.intp)
+        self.cat_slot[self.cat_positions] = np.arange(len(self.cat_positions))
+
+        # Indici per modalità calcolati al primo utilizzo, vedi modality_index
+        self._modality_cache = {}
+        self._schema_hash = None
+
+        # ID del gene associato a ogni feature, precalcolato per la mappatura dei nomi
+        self.gene_ids = feature_gene_ids(self.feature_names)
+
+        # Template preallocati: 0 per le feature assenti dal sample (NaN per le coorti
+        # costruite dai file, come nel DataFrame unione dei pazienti)
+        self.template = np.full(self.n_features, fill_value, dtype=np.float32)
+        self.cat_template = np.full(len(self.cat_positions), cat_fill_value, dtype=object)
+        # Valore delle categoriche di una modalità mancante (vedi fill_placeholder)
+        self.cat_missing_value = cat_missing_value
+
+    @classmethod
+    def from_model(cls, model):
+        """Costruisce il layout a partire da un modello CatBoost caricato"""
+        return cls(model.feature_names_, model.get_cat_feature_indices())
+
+    @property
+    def has_cat_features(self):
+        return len(self.cat_positions) > 0
+
+    @property
+    def schema_hash(self):
+        """Hash di nomi, feature categoriche e valori di default: identifica il layout"""
+        if self._schema_hash is None:
+            digest = hashlib.sha256()
+            digest.update("\n".join(self.feature_names).encode('utf-8'))
+            digest.update(self.cat_positions.astype(np.int64).tobytes())
+            digest.update(self.template.tobytes())
+            digest.update(repr((self.cat_template[:1].tolist(), self.cat_missing_value)).encode('utf-8'))
+            self._schema_hash = digest.hexdigest()
+        return self._schema_hash
+
+    def modality_index(self, prefix, columns):
+        """
+        Indice delle feature di una modalità con nomi "{prefix}_{chiave}|{colonna}".
+
+        Calcolato una volta per (prefix, colonne) e poi riutilizzato: permette ai
+        parser di scrivere i valori direttamente nelle colonne del modello senza
+        costruire le stringhe dei nomi delle feature.
+
+        Args:
+            prefix (str): Prefisso della modalità (es. "gene")
+            columns (list): Colonne del file usate come feature
+
+        Returns:
+            tuple: (pd.Index delle chiavi, matrice n_chiavi x n_colonne con la
+                posizione di ogni feature nel layout, -1 se assente)
+        """
+        cache_key = (prefix, tuple(columns))
+        cached = self._modality_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        names = pd.Series(self.feature_names, dtype=object).astype(str)
+        selected = np.flatnonzero(names.str.startswith(prefix + "_").to_numpy())
+        parts = names.iloc[selected].str.slice(len(prefix) + 1).str.rsplit('|', n=1)
+        keys = parts.str[0]
+        column_idx = pd.Index(columns).get_indexer(parts.str[1].fillna(''))
+
+        valid = column_idx >= 0
+        selected, keys, column_idx = selected[valid], keys[valid], column_idx[valid]
+
+        key_index = pd.Index(pd.unique(keys.to_numpy()))
+        positions = np.full((len(key_index), len(columns)), -1, dtype=np.intp)
+        positions[key_index.get_indexer(keys), column_idx] = selected
+
+        self._modality_cache[cache_key] = (key_index, positions)
+        return key_index, positions
+
+    def key_prefix_mask(self, prefix, columns, key_prefix):
+        """
+        Maschera delle chiavi di modality_index(prefix, columns) che iniziano con
+        key_prefix (es. le righe N_* dei file STAR), calcolata una volta.
+        """
+        cache_key = ('key_prefix', prefix, tuple(columns), key_prefix)
+        cached = self._modality_cache.get(cache_key)
+        if cached is None:
+            key_index, _ = self.modality_index(prefix, columns)
+            cached = np.asarray(key_index.astype(str).str.startswith(key_prefix), dtype=bool)
+            self._modality_cache[cache_key] = cached
+        return cached
+
+    def isoform_index(self, prefix, columns):
+        """
+        Indice numerico delle feature di isoforma "{prefix}_{miRNA_ID}_{suffisso}|{colonna}".
+
+        Ogni chiave del modello viene scomposta in codice del miRNA (posizione in
+        un indice categorico degli ID) e ordinale del suffisso, e codificata come
+        codice * stride + ordinale. I parser possono così trovare la riga del
+        modello dai codici dei miRNA e dall'ordinale dell'isoforma, senza
+        costruire le stringhe delle chiavi.
+
+        Returns:
+            tuple: (pd.Index degli ID miRNA, stride, pd.Index dei codici combinati,
+                riga di modality_index corrispondente a ogni codice)
+        """
+        cache_key = ('isoform', prefix, tuple(columns))
+        cached = self._modality_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        key_index, _ = self.modality_index(prefix, columns)
+        parts = pd.Series(key_index, dtype=object).astype(str).str.rsplit('_', n=1)
+        ordinals = isoform_suffix_ordinals(parts.str[1])
+        mirna_ids = parts.str[0].to_numpy(dtype=object)
+
+        valid = ordinals >= 0
+        mirna_index = pd.Index(pd.unique(mirna_ids[valid]))
+        stride = int(ordinals[valid].max()) + 1 if valid.any() else 1
+        codes = mirna_index.get_indexer(mirna_ids[valid]).astype(np.int64) * stride + ordinals[valid]
+
+        cached = (mirna_index, stride, pd.Index(codes), np.flatnonzero(valid))
+        self._modality_cache[cache_key] = cached
+        return cached
+
+    def modality_template(self, prefix):
+        """
+        Posizioni di tutte le feature del modello con nome "{prefix}_...".
+
+        Calcolate una volta per modalità: servono a riempire le feature di un
+        file mancante senza leggere alcun file di esempio.
+
+        Returns:
+            tuple: (posizioni delle feature numeriche, slot delle feature categoriche)
+        """
+        cache_key = ('template', prefix)
+        cached = self._modality_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        names = pd.Series(self.feature_names, dtype=object).astype(str)
+        positions = np.flatnonzero(names.str.startswith(prefix + "_").to_numpy())
+        is_cat = self.is_cat[positions]
+        cached = (positions[~is_cat], self.cat_slot[positions[is_cat]])
+        self._modality_cache[cache_key] = cached
+        return cached
+
+    def fill_placeholder(self, prefix, num_row, cat_row):
+        """
+        Segna come mancanti tutte le feature di una modalità assente per il paziente:
+        NaN per le numeriche e "missing" (cat_missing_value) per le categoriche.
+
+        Returns:
+            int: Numero di feature impostate
+        """
+        num_positions, cat_slots = self.modality_template(prefix)
+        num_row[num_positions] = np.nan
+        cat_row[cat_slots] = self.cat_missing_value
+        return len(num_positions) + len(cat_slots)
+
+    def scatter_keyed(self, prefix, columns, keys, values, num_row, cat_row=None, seen=None):
+        """
+        Scrive i valori di una modalità nelle righe del layout.
+
+        Args:
+            prefix (str): Prefisso della modalità
+            columns (list): Colonne corrispondenti alle colonne di `values`
+            keys (array-like): Chiave (es. gene_id) di ogni riga del file
+            values (np.ndarray): Valori n_righe x n_colonne (float32, o object per
+                le colonne categoriche)
+            num_row (np.ndarray): Riga numerica del paziente (float32)
+            cat_row (np.ndarray): Riga delle feature categoriche del paziente
+            seen (np.ndarray): Maschera delle chiavi già scritte, per leggere un file
+                a blocchi mantenendo la prima occorrenza di ogni chiave
+
+        Returns:
+            int: Numero di chiavi del file riconosciute dal modello
+        """
+        key_index, positions = self.modality_index(prefix, columns)
+        return self._scatter_rows(positions, key_index.get_indexer(keys), values, num_row, cat_row, seen)
+
+    def scatter_isoforms(self, prefix, columns, mirna_ids, ordinals, values, num_row, cat_row=None):
+        """
+        Come scatter_keyed, ma con le isoforme identificate da ID del miRNA e
+        ordinale dell'isoforma (vedi isoform_index) invece che da chiavi stringa.
+
+        Returns:
+            int: Numero di isoforme del file riconosciute dal modello
+        """
+        _, positions = self.modality_index(prefix, columns)
+        mirna_index, stride, code_index, code_rows = self.isoform_index(prefix, columns)
+        if len(code_index) == 0:
+            return 0
+
+        mirna_codes = mirna_index.get_indexer(mirna_ids)
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        known = (mirna_codes >= 0) & (ordinals < stride)
+        codes = np.where(known, mirna_codes.astype(np.int64) * stride + ordinals, -1)
+
+        found = code_index.get_indexer(codes)
+        rows = np.where(known & (found >= 0), code_rows[np.maximum(found, 0)], -1)
+        return self._scatter_rows(positions, rows, values, num_row, cat_row)
+
+    def _scatter_rows(self, positions, rows, values, num_row, cat_row=None, seen=None):
+        """Scrive le righe del file con riga di modalità `rows` (-1 = sconosciuta)"""
+        matched = np.flatnonzero(rows >= 0)
+        # Chiavi duplicate: vale la prima occorrenza
+        _, first = np.unique(rows[matched], return_index=True)
+        matched = matched[np.sort(first)]
+        if seen is not None:
+            matched = matched[~seen[rows[matched]]]
+            seen[rows[matched]] = True
+        if len(matched) == 0:
+            return 0
+
+        dst = positions[rows[matched]]
+        values = values[matched]
+        valid = dst >= 0
+        dst, values = dst[valid], values[valid]
+
+        dst_is_cat = self.is_cat[dst]
+        if (~dst_is_cat).any():
+            num_values = values[~dst_is_cat]
+            if num_values.dtype == object:
+                num_values = pd.to_numeric(pd.Series(num_values), errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+            num_row[dst[~dst_is_cat]] = num_values
+        if dst_is_cat.any() and cat_row is not None:
+            cat_values = values[dst_is_cat].astype(object)
+            cat_values = np.where(pd.isna(cat_values), CAT_MISSING, cat_values).astype(str)
+            cat_row[self.cat_slot[dst[dst_is_cat]]] = cat_values
+        return len(matched)
+
+    def scatter_dict(self, row_data, num_row, cat_row):
+        """Scrive in una riga del layout i valori di un dizionario nome feature -> valore"""
+        if not row_data:
+            return
+        positions = self.index.get_indexer(list(row_data.keys()))
+        values = np.asarray(list(row_data.values()), dtype=object)
+        found = positions >= 0
+        dst, values = positions[found], values[found]
+
+        dst_is_cat = self.is_cat[dst]
+        if (~dst_is_cat).any():
+            num_values = pd.to_numeric(pd.Series(values[~dst_is_cat]), errors='coerce')
+            num_row[dst[~dst_is_cat]] = num_values.to_numpy(dtype=np.float32, na_value=np.nan)
+        if dst_is_cat.any():
+            cat_values = values[dst_is_cat]
+            cat_values = np.where(pd.isna(cat_values), CAT_MISSING, cat_values).astype(str)
+            cat_row[self.cat_slot[dst[dst_is_cat]]] = cat_values
+
+    def gene_ids_of(self, features):
+        """Restituisce gli ID dei geni per un elenco di nomi di feature del layout"""
+        positions = self.index.get_indexer(features)
+        gene_ids = self.gene_ids[np.maximum(positions, 0)] if self.n_features else np.asarray([], dtype=object)
+        missing = positions < 0
+        if missing.any():
+            gene_ids = gene_ids.copy()
+            gene_ids[missing] = feature_gene_ids(np.asarray(features, dtype=object)[missing])
+        return gene_ids
+
+    def new_rows(self, n_rows):
+        """
+        Alloca le righe di un nuovo batch a partire dai template.
+
+        Returns:
+            tuple: (matrice float32 n_rows x n_features, matrice object n_rows x n_cat)
+        """
+        num = np.empty((n_rows, self.n_features), dtype=np.float32)
+        num[:] = self.template
+        cat = np.empty((n_rows, len(self.cat_positions)), dtype=object)
+        cat[:] = self.cat_template
+        return num, cat
+
+    def assemble(self, num, cat):
+        """
+        Combina le parti numerica e categorica nella matrice da passare al modello.
+
+        Returns:
+            np.ndarray: float32 se il modello non ha feature categoriche, altrimenti object
+        """
+        if not self.has_cat_features:
+            return num
+        data = num.astype(object)
+        data[:, self.cat_positions] = cat
+        return data
+
+    def align(self, sample_df, optional_modalities=()):
+        """
+        Allinea un DataFrame di sample (una riga per sample) al layout del modello.
+
+        Le feature attese ma assenti dal sample valgono 0 ("0" per le categoriche),
+        i NaN delle feature categoriche diventano "missing". Per i sample senza alcun
+        valore di una modalità opzionale (file non fornito) tutte le feature del modello
+        di quella modalità sono segnate come mancanti, come con fill_placeholder.
+
+        Args:
+            sample_df (pd.DataFrame): DataFrame con le features dei sample
+            optional_modalities (tuple): Prefissi delle modalità che possono mancare (es. "mirna_iso")
+
+        Returns:
+            np.ndarray: Matrice n_sample x n_features nell'ordine del modello
+        """
+        num, cat = self.new_rows(len(sample_df))
+
+        positions = self.index.get_indexer(sample_df.columns)
+        src = np.flatnonzero(positions >= 0)
+        dst = positions[src]
+        dst_is_cat = self.is_cat[dst]
+
+        num_src, num_dst = src[~dst_is_cat], dst[~dst_is_cat]
+        if len(num_dst):
+            num[:, num_dst] = _to_float32(sample_df.iloc[:, num_src])
+
+        cat_src, cat_dst = src[dst_is_cat], dst[dst_is_cat]
+        if len(cat_dst):
+            with ins.span("nan_handling"):
+                values = sample_df.iloc[:, cat_src].to_numpy(dtype=object)
+                values = np.where(pd.isna(values), CAT_MISSING, values).astype(str).astype(object)
+            cat[:, self.cat_slot[cat_dst]] = values
+
+        columns = sample_df.columns.astype(str)
+        for prefix in optional_modalities:
+            in_modality = columns.str.startswith(prefix + "_")
+            missing = sample_df.loc[:, in_modality].isna().all(axis=1).to_numpy()
+            for row in np.flatnonzero(missing):
+                self.fill_placeholder(prefix, num[row], cat[row])
+
+        return self.assemble(num, cat)
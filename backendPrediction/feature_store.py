@@ -0,0 +1,229 @@
+"""
+Formato binario su disco per sample e coorti già preparati.
+
+Una coorte salvata è una cartella con:
+- meta.json: nomi delle feature, feature categoriche, valori di default del layout,
+  schema hash, patient_id e categorie delle righe;
+- num.npy: matrice float32 n_righe x n_feature in ordine Fortran (colonna per
+  colonna), così che la lettura in mmap di poche colonne tocchi solo le loro pagine;
+- cat.npy / cat_nan.npy: feature categoriche come stringhe, con la maschera dei NaN.
+
+La rilettura non riesegue il parsing dei TSV: FeatureStore mappa i file in memoria
+e carica solo le colonne richieste (ad esempio quelle di un modello).
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from feature_layout import CAT_MISSING, FeatureLayout
+
+FORMAT_VERSION = 1
+# Righe copiate per volta nella matrice in ordine Fortran durante il salvataggio
+STORE_ROW_BLOCK = 4096
+
+META_FILE = "meta.json"
+NUM_FILE = "num.npy"
+CAT_FILE = "cat.npy"
+CAT_NAN_FILE = "cat_nan.npy"
+
+
+def _json_value(value):
+    """NaN non è JSON valido: viene salvato come null"""
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _layout_value(value):
+    return np.nan if value is None else value
+
+
+def save_cohort(path, cohort):
+    """
+    Salva una coorte (vedi preprocessing.build_patient_cohort) nel formato binario.
+
+    La cartella viene scritta accanto alla destinazione e poi rinominata, così che
+    un lettore non veda mai una coorte salvata a metà.
+
+    Args:
+        path (str): Cartella di destinazione (sostituita se esiste)
+        cohort (PatientCohort): Coorte da salvare
+
+    Returns:
+        str: Schema hash del layout della coorte
+    """
+    layout = cohort.layout
+    tmp_path = f"{path.rstrip(os.sep)}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    n_rows = len(cohort)
+    num = np.lib.format.open_memmap(os.path.join(tmp_path, NUM_FILE), mode='w+', dtype=np.float32,
+                                    shape=(n_rows, layout.n_features), fortran_order=True)
+    for start in range(0, n_rows, STORE_ROW_BLOCK):
+        num[start:start + STORE_ROW_BLOCK] = cohort.num[start:start + STORE_ROW_BLOCK]
+    num.flush()
+    del num
+
+    cat_nan = pd.isna(cohort.cat) if cohort.cat.size else np.zeros(cohort.cat.shape, dtype=bool)
+    cat_values = np.where(cat_nan, "", cohort.cat).astype(str) if cohort.cat.size else np.empty(cohort.cat.shape, dtype='U1')
+    np.save(os.path.join(tmp_path, CAT_FILE), cat_values)
+    np.save(os.path.join(tmp_path, CAT_NAN_FILE), np.asarray(cat_nan, dtype=bool))
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'schema_hash': layout.schema_hash,
+        'feature_names': layout.feature_names,
+        'cat_feature_indices': layout.cat_positions.tolist(),
+        'fill_value': _json_value(float(layout.template[0])) if layout.n_features else 0.0,
+        'cat_fill_value': _json_value(layout.cat_template[0]) if len(layout.cat_template) else None,
+        'cat_missing_value': _json_value(layout.cat_missing_value),
+        'n_rows': n_rows,
+        'patient_ids': list(cohort.patient_ids),
+        'categories': list(cohort.categories),
+    }
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return layout.schema_hash
+
+
+class FeatureStore:
+    """
+    Coorte salvata con save_cohort, letta in mmap.
+
+    Args:
+        path (str): Cartella della coorte
+        schema_hash (str): Se indicato, la coorte deve avere esattamente questo layout
+
+    Raises:
+        ValueError: Se il formato non è supportato o lo schema hash non corrisponde
+    """
+
+    def __init__(self, path, schema_hash=None):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Versione del formato non supportata in {path}: {self.meta.get('format_version')}")
+
+        self.layout = FeatureLayout(
+            self.meta['feature_names'], self.meta['cat_feature_indices'],
+            fill_value=_layout_value(self.meta['fill_value']),
+            cat_fill_value=_layout_value(self.meta['cat_fill_value']),
+            cat_missing_value=_layout_value(self.meta['cat_missing_value']))
+        # Il layout ricostruito deve essere quello salvato (nomi, categoriche e default)
+        if self.layout.schema_hash != self.meta['schema_hash']:
+            raise ValueError(f"Schema hash non valido in {path}: file corrotto o modificato")
+        if schema_hash is not None and self.meta['schema_hash'] != schema_hash:
+            raise ValueError(f"La coorte in {path} ha schema {self.meta['schema_hash'][:12]}, atteso {schema_hash[:12]}")
+
+        self.patient_ids = self.meta['patient_ids']
+        self.categories = self.meta['categories']
+        self.num = np.load(os.path.join(path, NUM_FILE), mmap_mode='r')
+        self._cat = np.load(os.path.join(path, CAT_FILE), mmap_mode='r')
+        self._cat_nan = np.load(os.path.join(path, CAT_NAN_FILE), mmap_mode='r')
+
+    @property
+    def schema_hash(self):
+        return self.meta['schema_hash']
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def _cat_columns(self, slots):
+        """Colonne categoriche come object, con NaN dove il valore salvato era mancante"""
+        values = np.asarray(self._cat[:, slots]).astype(object)
+        values[np.asarray(self._cat_nan[:, slots])] = np.nan
+        return values
+
+    def positions(self, feature_names):
+        """Colonna di ogni feature richiesta nella coorte, -1 se assente"""
+        return self.layout.index.get_indexer(list(feature_names))
+
+    def select(self, feature_names=None):
+        """
+        Carica la coorte, oppure solo alcune colonne.
+
+        Args:
+            feature_names (list): Feature da caricare (tutte se None); devono esistere nella coorte
+
+        Returns:
+            PatientCohort: Coorte con un layout ridotto alle colonne richieste
+        """
+        from preprocessing import PatientCohort
+
+        if feature_names is None:
+            num = self.num
+            cat = self._cat_columns(slice(None))
+            layout = self.layout
+        else:
+            positions = self.positions(feature_names)
+            if (positions < 0).any():
+                missing = [name for name, pos in zip(feature_names, positions) if pos < 0]
+                raise KeyError(f"Feature assenti dalla coorte {self.path}: {missing[:5]}")
+            # In ordine Fortran ogni colonna è contigua: vengono lette solo le pagine richieste
+            num = np.ascontiguousarray(self.num[:, positions])
+            is_cat = self.layout.is_cat[positions]
+            cat = self._cat_columns(self.layout.cat_slot[positions[is_cat]])
+            layout = FeatureLayout(list(feature_names), np.flatnonzero(is_cat),
+                                   fill_value=self.layout.template[0] if self.layout.n_features else 0.0,
+                                   cat_fill_value=self.layout.cat_template[0] if len(self.layout.cat_template) else np.nan,
+                                   cat_missing_value=self.layout.cat_missing_value)
+        return PatientCohort(layout, list(self.patient_ids), list(self.categories), num, cat, [],
+                             os.path.join(self.path, NUM_FILE))
+
+    def matrix_for(self, layout):
+        """
+        Matrice della coorte allineata al layout di un modello, leggendo solo le sue colonne.
+
+        Stesso risultato di layout.align(coorte.to_dataframe()): le feature del modello
+        assenti dalla coorte valgono 0 ("0" per le categoriche), i NaN delle categoriche
+        diventano "missing".
+
+        Returns:
+            np.ndarray: Matrice n_righe x n_feature del modello
+        """
+        if layout.schema_hash == self.schema_hash:
+            num = np.asarray(self.num)
+            cat = self._cat_columns(slice(None))
+            cat[pd.isna(cat)] = CAT_MISSING
+            return layout.assemble(num, cat)
+
+        num, cat = layout.new_rows(len(self))
+        positions = self.positions(layout.feature_names)
+        found = np.flatnonzero(positions >= 0)
+        src = positions[found]
+        dst_is_cat = layout.is_cat[found]
+
+        num_dst, num_src = found[~dst_is_cat], src[~dst_is_cat]
+        if len(num_dst):
+            values = self.num[:, num_src]
+            # Colonne categoriche della coorte usate come numeriche dal modello
+            src_is_cat = self.layout.is_cat[num_src]
+            if src_is_cat.any():
+                values = np.array(values)
+                values[:, src_is_cat] = pd.DataFrame(self._cat_columns(self.layout.cat_slot[num_src[src_is_cat]])) \
+                    .apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+            num[:, num_dst] = values
+
+        cat_dst, cat_src = found[dst_is_cat], src[dst_is_cat]
+        if len(cat_dst):
+            src_is_cat = self.layout.is_cat[cat_src]
+            values = np.empty((len(self), len(cat_src)), dtype=object)
+            if src_is_cat.any():
+                values[:, src_is_cat] = self._cat_columns(self.layout.cat_slot[cat_src[src_is_cat]])
+            if (~src_is_cat).any():
+                values[:, ~src_is_cat] = np.asarray(self.num[:, cat_src[~src_is_cat]]).astype(object)
+            values = np.where(pd.isna(values), CAT_MISSING, values).astype(str).astype(object)
+            cat[:, layout.cat_slot[cat_dst]] = values
+
+        return layout.assemble(num, cat)
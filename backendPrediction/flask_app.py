@@ -4,24 +4,66 @@ Flask API per il servizio di predizione con upload di file
 
 import os
 import uuid
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Request, Response, request, jsonify, render_template_string
 from werkzeug.utils import secure_filename
 import prediction as pred
 import preprocessing as pre
+import model_registry as mr
+import gene_index as gi
+import parse_cache as pc
+import ingest
+import jobs
+import instrumentation as ins
+
+
+class IngestRequest(Request):
+    """Request che elabora i file omici mentre vengono ricevuti (vedi ingest.py)"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if ingest.INGEST_ENABLED and filename and allowed_file(filename):
+            file_type = pre.file_type_from_name(secure_filename(filename))
+            if file_type is not None:
+                try:
+                    layout = mr.get_model(app.config['MODEL_PATH']).layout
+                except Exception as e:
+                    print(f"Elaborazione durante l'upload non disponibile, salvo il file: {e}")
+                else:
+                    # I job vengono eseguiti dopo la richiesta (anche da un altro worker): serve la copia su disco
+                    save = ingest.INGEST_SAVE_UPLOADS or self.path.startswith('/api/jobs')
+                    return ingest.UploadIngest(filename, file_type, layout, upload_path(filename), save=save)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def _load_form_data(self):
+        # Ricezione del corpo (e, con ingest, elaborazione dei file durante l'upload)
+        with ins.span("upload_receive"):
+            super()._load_form_data()
+
 
 app = Flask(__name__)
+app.request_class = IngestRequest
 
 # Configurazione Flask
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 500 * 1024 * 1024))  # 500MB default
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'assets/data')
+app.config['MODEL_PATH'] = os.getenv('MODEL_PATH', 'assets/catboost.cbm')
+app.config['BATCH_MAX_PATIENTS'] = int(os.getenv('BATCH_MAX_PATIENTS', 200))
+
+# Crea la cartella di upload se non esiste (anche quando l'app è avviata da gunicorn)
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Avviso se si sta usando la chiave di default in produzione
 if app.config['SECRET_KEY'] == 'dev-secret-key-change-in-production' and os.getenv('FLASK_ENV') == 'production':
     print("⚠️  ATTENZIONE: Stai usando la SECRET_KEY di default in produzione! Cambiala nel file .env")
 
+# Precarica il modello e l'indice dei geni all'avvio del worker (le richieste successive li riusano)
+loaded_model = mr.registry.preload(app.config['MODEL_PATH'])
+if loaded_model is not None:
+    pre.prepare_layout(loaded_model.layout)
+gi.get_gene_index(os.getcwd())
+
 # Configurazione legacy (mantieni per compatibilità)
-ALLOWED_EXTENSIONS = {'tsv', 'txt'}
+ALLOWED_EXTENSIONS = {'tsv', 'txt', 'gz'}
 
 def allowed_file(filename):
     """Controlla se il file ha un'estensione permessa"""
@@ -45,6 +87,120 @@ def determine_file_type(filename):
     else:
         return 'unknown'
 
+def parse_threshold(form):
+    """Legge la soglia di decisione opzionale dal form (None = soglia di default)"""
+    value = form.get('threshold')
+    if value in (None, ''):
+        return None
+    threshold = float(value)
+    if not 0.0 <= threshold <= 1.0:
+        raise ValueError(f"La soglia deve essere compresa tra 0 e 1: {value}")
+    return threshold
+
+def prediction_options(form):
+    """
+    Legge e valida i parametri comuni delle richieste di predizione.
+    
+    Returns:
+        tuple: (sample_type, explain, threshold)
+    
+    Raises:
+        ValueError: Se explain o threshold non sono validi
+    """
+    sample_type = form.get('sample_type', 'tumor')
+    explain = form.get('explain', 'global')
+    
+    if explain not in pred.EXPLAIN_MODES:
+        raise ValueError(f"Parametro explain non valido: {explain} (ammessi: {', '.join(pred.EXPLAIN_MODES)})")
+    
+    try:
+        threshold = parse_threshold(form)
+    except ValueError as e:
+        raise ValueError(f'Parametro threshold non valido: {e}')
+    
+    return sample_type, explain, threshold
+
+def predict_patients(json_data, base_dir, explain='global', threshold=None, files=()):
+    """
+    Prepara i pazienti direttamente nel layout del modello e li valuta con una sola chiamata.
+    
+    Args:
+        files (list): File caricati; quelli già elaborati durante l'upload non vengono riletti
+    
+    Returns:
+        list: Risultati per paziente (solo i pazienti elaborati con successo)
+    """
+    loaded_model = mr.get_model(app.config['MODEL_PATH'])
+    prefilled = {os.path.join(base_dir, file.stream.upload_path): file.stream
+                 for file in files if isinstance(file.stream, ingest.UploadIngest)}
+    patient_ids, aligned = pre.create_patient_matrix_from_json(json_data, base_dir, loaded_model.layout,
+                                                               prefilled=prefilled)
+    return pred.predict_batch(aligned, loaded_model, top_features=10, base_dir=base_dir,
+                              explain=explain, patient_ids=patient_ids, threshold=threshold)
+
+def format_prediction_result(results):
+    """Converte i risultati di una predizione in formato JSON serializzabile"""
+    result_data = {
+        'predicted_class': results['predicted_class'],
+        'confidence': float(results['confidence']),
+        'prediction_probability': results['prediction_probability'].tolist(),
+        'top_features': results['top_features'].to_dict('records')[:10],  # Prime 10 features
+        'explanation': results['explanation'],
+        'sample_info': results['sample_info']
+    }
+    
+    if 'shap_expected_value' in results:
+        result_data['shap_expected_value'] = results['shap_expected_value']
+    
+    # Aggiungi top_features_with_gene_names se disponibile
+    if 'top_features_with_gene_names' in results:
+        result_data['top_features_with_gene_names'] = results['top_features_with_gene_names'].to_dict('records')[:10]
+    
+    return result_data
+
+def upload_path(filename):
+    """Percorso univoco nella cartella di upload per un file caricato"""
+    filename = secure_filename(filename)
+    
+    # Aggiungi timestamp per evitare conflitti
+    timestamp = str(uuid.uuid4())[:8]
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{filename}")
+
+def save_uploaded_file(file):
+    """Salva un file caricato nella cartella di upload e restituisce il percorso relativo"""
+    with ins.span("upload_save"):
+        if isinstance(file.stream, ingest.UploadIngest):
+            # Già elaborato (ed eventualmente salvato) durante l'upload
+            upload = file.stream
+            upload.finish()
+            print(f"File ricevuto: {os.path.basename(upload.upload_path)} come tipo: {upload.file_type} "
+                  f"({upload.bytes_received} byte, salvato: {upload.saved})")
+            return upload.upload_path
+        
+        file_full_path = upload_path(file.filename)
+        file.save(file_full_path)
+        print(f"File salvato: {os.path.basename(file_full_path)} come tipo: {determine_file_type(file_full_path)}")
+        return file_full_path
+
+
+@app.before_request
+def start_request_trace():
+    """Inizia la raccolta degli span della richiesta (vedi instrumentation.py)"""
+    if ins.INSTRUMENTATION_ENABLED:
+        ins.start_trace()
+
+@app.after_request
+def finish_request_trace(response):
+    """Aggiorna le metriche della richiesta e, se richiesto, aggiunge l'header X-Timing"""
+    trace = ins.end_trace()
+    if trace is None:
+        return response
+    ins.metrics.observe_request(request.endpoint or 'unknown', request.method, response.status_code, trace.elapsed())
+    if ins.TIMING_HEADER or 'X-Timing' in request.headers:
+        response.headers['X-Timing'] = trace.header()
+    ins.metrics.flush()
+    return response
+
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -55,7 +211,10 @@ def predict():
             return jsonify({'success': False, 'error': 'Nessun file fornito'})
         
         files = request.files.getlist('files')
-        sample_type = request.form.get('sample_type', 'tumor')
+        try:
+            sample_type, explain, threshold = prediction_options(request.form)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
         
         # Controlla il numero di file
         if len(files) == 0:
@@ -75,24 +234,11 @@ def predict():
         patient_id = generate_patient_id()
           # Salva i file e crea la lista dei percorsi
         uploaded_files = []
-        file_path = "assets/data/"  # Percorso relativo corretto per il container
         
         for file in files:
             if file and allowed_file(file.filename):
-                # Usa secure_filename per sicurezza
-                filename = secure_filename(file.filename)
-                
-                # Aggiungi timestamp per evitare conflitti
-                timestamp = str(uuid.uuid4())[:8]
-                filename = f"{timestamp}_{filename}"
-                
-                file_full_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_full_path)
-                
                 # Aggiungi il percorso relativo alla lista
-                uploaded_files.append(file_path + filename)
-                
-                print(f"File salvato: {filename} come tipo: {determine_file_type(filename)}")
+                uploaded_files.append(save_uploaded_file(file))
         
         # Crea il dizionario JSON per la predizione
         json_data = {
@@ -103,26 +249,13 @@ def predict():
         
         print(f"JSON creato: {json_data}")        # Crea il dataset e fai la predizione
         base_dir = os.getcwd()
-        print(f"DEBUG: base_dir = {base_dir}")
-        sample_df = pre.create_patient_dataset_from_json(json_data, base_dir)        # Effettua la predizione
-        model_path = "assets/catboost.cbm"
-        
-        print(f"DEBUG: Chiamando load_and_predict_from_dataframe con base_dir = {base_dir}")
-        results = pred.load_and_predict_from_dataframe(model_path, sample_df, top_features=10, base_dir=base_dir)
-        print(f"DEBUG: Risultati chiavi: {list(results.keys())}")
-        print(f"DEBUG: 'top_features_with_gene_names' in results: {'top_features_with_gene_names' in results}")
+        # Crea le righe del paziente nel layout del modello e fai la predizione
+        patient_results = predict_patients(json_data, base_dir, explain, threshold, files)
+        if not patient_results:
+            raise ValueError("Nessun dato paziente elaborato (file di espressione genica mancante o non valido)")
+        results = patient_results[0]
           # Converti i risultati in formato JSON serializzabile
-        result_data = {
-            'predicted_class': results['predicted_class'],
-            'confidence': float(results['confidence']),                
-            'prediction_probability': results['prediction_probability'].tolist(),
-            'top_features': results['top_features'].to_dict('records')[:10],  # Prime 10 features
-            'sample_info': results['sample_info']
-        }
-        
-        # Aggiungi top_features_with_gene_names se disponibile
-        if 'top_features_with_gene_names' in results:
-            result_data['top_features_with_gene_names'] = results['top_features_with_gene_names'].to_dict('records')[:10]
+        result_data = format_prediction_result(results)
         
         response_data = {
             'success': True,
@@ -147,6 +280,132 @@ def health_check():
     """Endpoint per controllo stato servizio"""
     return jsonify({'status': 'healthy', 'service': 'cancer-prediction-api'})
 
+@app.route('/api/model', methods=['GET'])
+def model_info():
+    """Endpoint con versione, tempo di caricamento e memoria dei modelli caricati, stato della cache dei file e dei job"""
+    cache = pc.get_parse_cache()
+    return jsonify({'models': mr.registry.stats(),
+                    'parse_cache': cache.stats() if cache is not None else None,
+                    'jobs': job_runner().stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metriche delle fasi di predizione e delle richieste nel formato testuale Prometheus (di tutti i worker)"""
+    return Response(ins.render_prometheus(ins.collect()), mimetype='text/plain; version=0.0.4')
+
+def patient_response(patient_id, uploaded_files, sample_type, explain, threshold, files=()):
+    """
+    Valuta un singolo paziente e costruisce la risposta di /api/predict.
+    
+    Args:
+        uploaded_files (list): Percorsi relativi dei file salvati del paziente
+        files (list): File caricati; quelli già elaborati durante l'upload non vengono riletti
+    
+    Returns:
+        dict: Risposta JSON serializzabile
+    """
+    json_data = {sample_type: {patient_id: uploaded_files}}
+    
+    base_dir = os.getcwd()
+    patient_results = predict_patients(json_data, base_dir, explain, threshold, files)
+    if not patient_results:
+        raise ValueError("Nessun dato paziente elaborato (file di espressione genica mancante o non valido)")
+    results = patient_results[0]
+    
+    # Converti i risultati in formato JSON serializzabile
+    result_data = format_prediction_result(results)
+    
+    return {
+        'success': True,
+        'patient_id': patient_id,
+        'uploaded_files': uploaded_files,
+        'sample_type': sample_type,
+        'result': result_data
+    }
+
+def batch_patients(request_files):
+    """
+    Raggruppa i file per paziente in base al nome del campo `files[<etichetta>]` e li valida.
+    
+    Returns:
+        dict: Etichetta -> lista dei file del paziente
+    
+    Raises:
+        ValueError: Se i pazienti o i loro file non sono validi
+    """
+    patients = {}
+    for key in request_files.keys():
+        if key.startswith('files[') and key.endswith(']') and len(key) > len('files[]'):
+            patients[key[len('files['):-1]] = request_files.getlist(key)
+    
+    if not patients:
+        raise ValueError('Nessun paziente fornito (usa i campi files[<etichetta>])')
+    
+    if len(patients) > app.config['BATCH_MAX_PATIENTS']:
+        raise ValueError(f"Massimo {app.config['BATCH_MAX_PATIENTS']} pazienti per richiesta")
+    
+    for label, files in patients.items():
+        if len(files) == 0 or len(files) > 3:
+            raise ValueError(f'Numero file non valido per il paziente {label} (1-3 file)')
+        for file in files:
+            if file.filename == '' or not allowed_file(file.filename):
+                raise ValueError(f'Tipo file non permesso per il paziente {label}: {file.filename}')
+    
+    return patients
+
+def batch_response(uploaded_files, labels, sample_type, explain, threshold, files=()):
+    """
+    Valuta più pazienti con una sola chiamata al modello e costruisce la risposta di /api/predict/batch.
+    
+    Args:
+        uploaded_files (dict): patient_id -> percorsi relativi dei file salvati
+        labels (dict): patient_id -> etichetta inviata dal client
+        files (list): File caricati; quelli già elaborati durante l'upload non vengono riletti
+    
+    Returns:
+        dict: Risposta JSON serializzabile
+    """
+    json_data = {sample_type: uploaded_files}
+    
+    base_dir = os.getcwd()
+    # Una sola matrice allineata e una sola valutazione del modello per tutti i pazienti
+    batch_results = predict_patients(json_data, base_dir, explain, threshold, files)
+    
+    results = []
+    for results_item in batch_results:
+        patient_id = results_item['patient_id']
+        results.append({
+            'label': labels[patient_id],
+            'patient_id': patient_id,
+            'uploaded_files': uploaded_files[patient_id],
+            'result': format_prediction_result(results_item)
+        })
+    
+    # Pazienti scartati durante il preprocessing (es. file gene_expr mancante)
+    scored = {item['patient_id'] for item in results}
+    errors = [
+        {'label': label, 'patient_id': patient_id, 'error': 'Paziente scartato durante il preprocessing'}
+        for patient_id, label in labels.items() if patient_id not in scored
+    ]
+    
+    return {
+        'success': True,
+        'sample_type': sample_type,
+        'count': len(results),
+        'results': results,
+        'errors': errors
+    }
+
+def save_batch_files(patients):
+    """Salva i file di ogni paziente; restituisce (uploaded_files, labels) indicizzati per patient_id"""
+    labels = {}
+    uploaded_files = {}
+    for label, files in patients.items():
+        patient_id = generate_patient_id()
+        labels[patient_id] = label
+        uploaded_files[patient_id] = [save_uploaded_file(file) for file in files]
+    return uploaded_files, labels
+
 @app.route('/api/predict', methods=['POST'])
 def api_predict():
     """Endpoint API senza interfaccia web per integrazione"""
@@ -156,7 +415,10 @@ def api_predict():
             return jsonify({'success': False, 'error': 'Nessun file fornito'})
         
         files = request.files.getlist('files')
-        sample_type = request.form.get('sample_type', 'tumor')
+        try:
+            sample_type, explain, threshold = prediction_options(request.form)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
         
         if len(files) == 0 or len(files) > 3:
             return jsonify({'success': False, 'error': 'Numero file non valido (1-3 file)'})
@@ -164,52 +426,160 @@ def api_predict():
         # Processo identico a /predict
         patient_id = generate_patient_id()
         uploaded_files = []
-        file_path = "app/assets/data/"
         
         for file in files:
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                timestamp = str(uuid.uuid4())[:8]
-                filename = f"{timestamp}_{filename}"
-                file_full_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_full_path)
-                uploaded_files.append(file_path + filename)
+                uploaded_files.append(save_uploaded_file(file))
         
-        json_data = {sample_type: {patient_id: uploaded_files}}
+        return jsonify(patient_response(patient_id, uploaded_files, sample_type, explain, threshold, files))
         
-        base_dir = os.getcwd()
-        sample_df = pre.create_patient_dataset_from_json(json_data, base_dir)
-        
-        model_path = "app/assets/catboost.cbm"
-        results = pred.load_and_predict_from_dataframe(model_path, sample_df, top_features=10, base_dir=base_dir)
-        
-        # Converti i risultati in formato JSON serializzabile
-        result_data = {
-            'predicted_class': results['predicted_class'],
-            'confidence': float(results['confidence']),                
-            'prediction_probability': results['prediction_probability'].tolist(),
-            'top_features': results['top_features'].to_dict('records')[:10],  # Prime 10 features
-            'sample_info': results['sample_info']
-        }
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/predict/batch', methods=['POST'])
+def api_predict_batch():
+    """
+    Endpoint per la predizione di più pazienti in una sola chiamata al modello.
+    
+    I file di ogni paziente vanno inviati nel campo `files[<etichetta>]` (1-3 file
+    per paziente); l'etichetta viene restituita insieme al patient_id generato.
+    """
+    try:
+        try:
+            sample_type, explain, threshold = prediction_options(request.form)
+            patients = batch_patients(request.files)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
         
-        # Aggiungi top_features_with_gene_names se disponibile
-        if 'top_features_with_gene_names' in results:
-            result_data['top_features_with_gene_names'] = results['top_features_with_gene_names'].to_dict('records')[:10]
+        # Salva i file e crea il dizionario JSON con tutti i pazienti
+        uploaded_files, labels = save_batch_files(patients)
         
-        return jsonify({
-            'success': True,
-            'patient_id': patient_id,
-            'uploaded_files': uploaded_files,
-            'sample_type': sample_type,
-            'result': result_data
-        })
+        return jsonify(batch_response(uploaded_files, labels, sample_type, explain, threshold,
+                                      [file for files in patients.values() for file in files]))
         
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        print(f"Errore durante la predizione batch: {str(e)}")
+        return jsonify({'success': False, 'error': f'Errore durante la predizione batch: {str(e)}'})
+
+def run_prediction_job(kind, params, files=None):
+    """
+    Esegue un job di predizione salvato nella coda (vedi jobs.py).
+    
+    Args:
+        kind (str): "predict" (un paziente) o "batch"
+        params (dict): Opzioni della richiesta e percorsi dei file salvati
+        files (list): File elaborati durante l'upload, solo se il job è eseguito dal worker che l'ha ricevuto
+    
+    Returns:
+        dict: Stessa risposta di /api/predict o /api/predict/batch
+    """
+    files = files or ()
+    options = (params['sample_type'], params['explain'], params['threshold'])
+    if kind == 'predict':
+        return patient_response(params['patient_id'], params['uploaded_files'], *options, files)
+    if kind == 'batch':
+        return batch_response(params['uploaded_files'], params['labels'], *options, files)
+    raise ValueError(f"Tipo di job sconosciuto: {kind}")
+
+def job_runner():
+    """Pool dei job del processo (avviato al primo uso dopo un fork)"""
+    return jobs.start_runner(run_prediction_job)
+
+def job_status(job):
+    """Stato di un job in formato JSON, con gli URL per il polling"""
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'position': job.get('position'),
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+        'status_url': f"/api/jobs/{job['id']}",
+        'result_url': f"/api/jobs/{job['id']}/result"
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """
+    Mette in coda una predizione e restituisce subito il job_id (202).
+    
+    Accetta gli stessi campi di /api/predict (`files`, un paziente) o di
+    /api/predict/batch (`files[<etichetta>]`); lo stato si legge da
+    GET /api/jobs/<job_id> e il risultato da GET /api/jobs/<job_id>/result.
+    """
+    try:
+        try:
+            sample_type, explain, threshold = prediction_options(request.form)
+            if 'files' in request.files:
+                files = request.files.getlist('files')
+                if len(files) == 0 or len(files) > 3:
+                    raise ValueError('Numero file non valido (1-3 file)')
+                for file in files:
+                    if file.filename == '' or not allowed_file(file.filename):
+                        raise ValueError(f'Tipo file non permesso: {file.filename}')
+                patients = None
+            else:
+                patients = batch_patients(request.files)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        params = {'sample_type': sample_type, 'explain': explain, 'threshold': threshold}
+        if patients is None:
+            kind = 'predict'
+            params['patient_id'] = generate_patient_id()
+            params['uploaded_files'] = [save_uploaded_file(file) for file in files]
+        else:
+            kind = 'batch'
+            params['uploaded_files'], params['labels'] = save_batch_files(patients)
+            files = [file for files in patients.values() for file in files]
+        
+        try:
+            job = job_runner().submit(kind, params, context=files)
+        except jobs.JobQueueFull as e:
+            response = jsonify({'success': False, 'error': str(e)})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        
+        print(f"Job {job['id']} in coda ({kind}, posizione {job.get('position')})")
+        return jsonify(job_status(job)), 202
+        
+    except Exception as e:
+        print(f"Errore durante l'invio del job: {str(e)}")
+        return jsonify({'success': False, 'error': f"Errore durante l'invio del job: {str(e)}"}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """Stato di un job: queued (con posizione in coda), running, done o failed"""
+    job = job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'Job non trovato: {job_id}'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def api_job_result(job_id):
+    """
+    Risultato di un job terminato; il job viene eliminato dopo la lettura.
+    
+    Restituisce 202 con lo stato se il job è ancora in coda o in esecuzione.
+    """
+    job = job_runner().store.pop_result(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'Job non trovato: {job_id}'}), 404
+    if job['status'] not in jobs.FINISHED_STATUSES:
+        return jsonify(job_status(job)), 202
+    if job['status'] == jobs.FAILED:
+        return jsonify({'success': False, 'job_id': job_id, 'status': job['status'], 'error': job['error']})
+    return jsonify({**job['result'], 'job_id': job_id, 'status': job['status']})
 
 if __name__ == '__main__':
-    # Crea la cartella di upload se non esiste
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)    
-    print("Avvio Flask server...")
+    print("Avvio Flask server (solo sviluppo, in produzione: gunicorn -c gunicorn.conf.py flask_app:app)...")
+    
+    # Avvia il pool dei job: riprende anche i job rimasti in coda prima di un riavvio
+    # (con gunicorn viene avviato in ogni worker da post_fork)
+    job_runner()
 
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') == '1', host='0.0.0.0', port=5000)
@@ -0,0 +1,181 @@
+"""
+Indice persistente gene_id -> gene_name.
+
+L'indice viene costruito una sola volta dal file TSV augmented_star_gene_counts
+con codice vettorizzato, salvato su disco come array ordinati (pickle con
+versione) e tenuto in memoria da ogni worker.
+"""
+
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Versione del formato su disco: incrementarla invalida gli indici esistenti
+GENE_INDEX_VERSION = 1
+GENE_INDEX_FILENAME = "gene_index.pkl"
+
+# Dopo quanti secondi ricercare il TSV se al primo tentativo non era disponibile
+MISSING_RETRY_SECONDS = 60
+
+
+class GeneIndex:
+    """Mappatura gene_id -> gene_name basata su array ordinati e ricerca binaria"""
+
+    def __init__(self, gene_ids, gene_names, source=None):
+        order = np.argsort(gene_ids, kind='stable')
+        self.gene_ids = np.asarray(gene_ids, dtype=str)[order]
+        self.gene_names = np.asarray(gene_names, dtype=str)[order]
+        self.source = source
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def lookup(self, gene_ids):
+        """
+        Restituisce i nomi dei geni per una sequenza di ID (vettorizzato).
+
+        Args:
+            gene_ids (array-like): ID dei geni da cercare
+
+        Returns:
+            np.ndarray: Nomi dei geni; per gli ID non trovati restituisce l'ID stesso
+        """
+        gene_ids = np.asarray(gene_ids, dtype=str)
+        if len(self.gene_ids) == 0 or len(gene_ids) == 0:
+            return gene_ids.astype(object)
+        positions = np.searchsorted(self.gene_ids, gene_ids)
+        positions = np.minimum(positions, len(self.gene_ids) - 1)
+        found = self.gene_ids[positions] == gene_ids
+        return np.where(found, self.gene_names[positions], gene_ids).astype(object)
+
+    def to_dict(self):
+        """Restituisce l'indice come dizionario gene_id -> gene_name"""
+        return dict(zip(self.gene_ids.tolist(), self.gene_names.tolist()))
+
+    def save(self, path):
+        """Salva l'indice su disco in modo atomico"""
+        payload = {
+            'version': GENE_INDEX_VERSION,
+            'source': self.source,
+            'created_at': time.time(),
+            'gene_ids': self.gene_ids,
+            'gene_names': self.gene_names,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Carica un indice salvato; restituisce None se il file ha una versione diversa"""
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+        if not isinstance(payload, dict) or payload.get('version') != GENE_INDEX_VERSION:
+            return None
+        index = cls.__new__(cls)
+        index.gene_ids = payload['gene_ids']
+        index.gene_names = payload['gene_names']
+        index.source = payload.get('source')
+        return index
+
+    @classmethod
+    def from_tsv(cls, tsv_path):
+        """
+        Costruisce l'indice da un file TSV augmented_star_gene_counts.
+
+        Args:
+            tsv_path (str): Percorso del file TSV
+
+        Returns:
+            GeneIndex: Indice costruito, None se il file non ha le colonne attese
+        """
+        header = pd.read_csv(tsv_path, sep='\t', comment='#', nrows=0)
+        if 'gene_id' not in header.columns or 'gene_name' not in header.columns:
+            return None
+
+        df = pd.read_csv(tsv_path, sep='\t', comment='#', usecols=['gene_id', 'gene_name'],
+                         dtype={'gene_id': str, 'gene_name': str})
+        df = df.dropna()
+        df = df[(df['gene_id'] != '') & (df['gene_name'] != '') &
+                (df['gene_id'] != 'nan') & (df['gene_name'] != 'nan')]
+        # In caso di ID ripetuti vale l'ultima occorrenza, come con un dizionario
+        df = df.drop_duplicates(subset='gene_id', keep='last')
+        return cls(df['gene_id'].to_numpy(), df['gene_name'].to_numpy(), source=tsv_path)
+
+
+def find_gene_counts_tsv(base_dir):
+    """Cerca un file augmented_star_gene_counts.tsv (anche compresso .tsv.gz) in base_dir/assets/data"""
+    # Nel container Docker, la struttura è /app/assets/data
+    data_dir = os.path.join(base_dir, "assets", "data")
+    if not os.path.exists(data_dir):
+        return None
+    for file in sorted(os.listdir(data_dir)):
+        if file.endswith(("augmented_star_gene_counts.tsv", "augmented_star_gene_counts.tsv.gz")):
+            return os.path.join(data_dir, file)
+    return None
+
+
+_indexes = {}
+_missing_since = {}
+_lock = threading.Lock()
+
+
+def get_gene_index(base_dir):
+    """
+    Restituisce l'indice dei geni per base_dir, tenuto in memoria dal processo.
+
+    L'indice viene letto da base_dir/assets/gene_index.pkl; se manca o ha una
+    versione diversa viene ricostruito dal primo TSV disponibile e salvato.
+
+    Args:
+        base_dir (str): Directory base dell'applicazione
+
+    Returns:
+        GeneIndex: Indice dei geni, None se non è disponibile alcun TSV valido
+    """
+    index = _indexes.get(base_dir)
+    if index is not None:
+        return index
+
+    missing_since = _missing_since.get(base_dir)
+    if missing_since is not None and time.time() - missing_since < MISSING_RETRY_SECONDS:
+        return None
+
+    with _lock:
+        index = _indexes.get(base_dir)
+        if index is not None:
+            return index
+
+        index_path = os.path.join(base_dir, "assets", GENE_INDEX_FILENAME)
+        if os.path.exists(index_path):
+            try:
+                index = GeneIndex.load(index_path)
+            except Exception as e:
+                print(f"Indice dei geni {index_path} non leggibile, lo ricostruisco: {e}")
+
+        if index is None:
+            tsv_path = find_gene_counts_tsv(base_dir)
+            if tsv_path is None:
+                print("File TSV augmented_star_gene_counts non trovato")
+                _missing_since[base_dir] = time.time()
+                return None
+            index = GeneIndex.from_tsv(tsv_path)
+            if index is None:
+                # Trattato come mancante: verrà ricercato dopo MISSING_RETRY_SECONDS
+                print(f"File TSV {tsv_path} senza colonne gene_id e gene_name")
+                _missing_since[base_dir] = time.time()
+                return None
+            print(f"Caricata mappatura per {len(index)} geni dal file TSV")
+            try:
+                index.save(index_path)
+            except OSError as e:
+                print(f"Impossibile salvare l'indice dei geni in {index_path}: {e}")
+
+        _indexes[base_dir] = index
+        _missing_since.pop(base_dir, None)
+        return index
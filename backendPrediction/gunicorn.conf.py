@@ -0,0 +1,73 @@
+"""
+Configurazione gunicorn del backend di predizione.
+
+Uso: gunicorn -c gunicorn.conf.py flask_app:app
+
+Con preload_app il modello CatBoost, il layout delle feature e l'indice dei geni
+vengono caricati una sola volta nel master prima del fork: i worker condividono
+quelle pagine in copy-on-write. gc.freeze() sposta gli oggetti già caricati nella
+generazione permanente del garbage collector, che altrimenti li visiterebbe (e ne
+aggiornerebbe i contatori) forzando la copia delle pagine in ogni worker.
+"""
+
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Worker (processi) e thread per worker: di default un worker per core
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+preload_app = True
+
+# Riavvio dei worker dopo N richieste (con jitter per non riavviarli tutti insieme)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Con gthread il timeout controlla che il worker risponda, non la durata delle richieste
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 60))
+
+accesslog = '-'
+errorlog = '-'
+
+# I worker scrivono qui i totali delle metriche, sommati da /metrics (vedi instrumentation.py)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'backend_metrics'))
+
+# CatBoost usa di default tutti i core per ogni predizione: se non configurato divide i core tra i worker
+os.environ.setdefault('CATBOOST_THREAD_COUNT', str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def on_starting(server):
+    # Le metriche di un'esecuzione precedente del server non vanno sommate a quelle nuove
+    import instrumentation
+    instrumentation.reset_metrics_dir()
+
+
+def when_ready(server):
+    # Chiamato nel master dopo il caricamento dell'app e prima del fork dei worker
+    gc.collect()
+    gc.freeze()
+    server.log.info("Modello e indice dei geni caricati nel master, oggetti congelati prima del fork")
+
+
+def post_fork(server, worker):
+    # I thread non sopravvivono al fork: ogni worker avvia il proprio pool dei job
+    import flask_app
+    flask_app.job_runner()
+
+
+def worker_exit(server, worker):
+    # Riavvio o arresto del worker: non prende nuovi job e attende quelli in esecuzione
+    # (se viene terminato prima, il job torna in coda quando scade il suo heartbeat)
+    import jobs
+    runner = jobs.get_runner()
+    if runner is not None:
+        runner.stop(wait=True)
+
+    # I totali del worker restano nelle metriche anche dopo il suo riavvio
+    import instrumentation
+    instrumentation.archive_process_metrics()
@@ -0,0 +1,298 @@
+"""
+Elaborazione dei file omici durante l'upload.
+
+UploadIngest è il file su cui Werkzeug scrive i byte di una parte multipart:
+invece di accumularli per poi rileggerli da disco, decodifica il gzip al volo,
+divide il testo in blocchi di righe complete e li scrive direttamente nella riga
+del modello con gli stessi parser colonnari di preprocessing. La copia su disco
+nella cartella di upload è opzionale.
+
+I file già elaborati non vengono analizzati di nuovo: l'hash dei byte ricevuti
+(gli stessi letti da parse_cache.cached_fill) viene confrontato con la cache
+prima di analizzare il primo blocco, tramite il prefisso del file, e alla fine
+dell'upload tramite il contenuto completo.
+"""
+
+import hashlib
+import io
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import preprocessing as pre
+import parse_cache as pc
+
+# Elaborazione dei file durante l'upload (0 = salva su disco e rielabora, come prima)
+INGEST_ENABLED = os.getenv('INGEST_ENABLED', '1') == '1'
+# Copia su disco dei file caricati (serve anche per costruire l'indice dei geni)
+INGEST_SAVE_UPLOADS = os.getenv('INGEST_SAVE_UPLOADS', '1') == '1'
+# Byte di testo decodificato accumulati prima di elaborare un blocco di righe
+INGEST_BLOCK_BYTES = int(os.getenv('INGEST_BLOCK_BYTES', 1024 * 1024))
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class _BlockParser:
+    """Parser incrementale di un file TSV: riceve blocchi di righe complete"""
+
+    def __init__(self, file_type, layout, num_row, cat_row, name):
+        self.file_type = file_type
+        self.layout = layout
+        self.num_row = num_row
+        self.cat_row = cat_row
+        self.name = name
+        self.header = None
+        self.columns = None
+        if file_type == "gene_expr":
+            self.seen = pre.gene_rows_seen(layout)
+        # Isoforme già viste per miRNA, per continuare gli ordinali tra i blocchi
+        self.isoform_counts = {}
+
+    def _read_header(self, block):
+        """Cerca la riga di intestazione (prima riga non di commento); restituisce il resto del blocco"""
+        start = 0
+        while start < len(block):
+            end = block.find(b'\n', start)
+            end = len(block) if end < 0 else end + 1
+            line = block[start:end]
+            if line.strip() and not line.startswith(b'#'):
+                self.header = line if line.endswith(b'\n') else line + b'\n'
+                self.columns = pd.read_csv(io.BytesIO(self.header), sep='\t', nrows=0).columns.tolist()
+                self._check_columns()
+                return block[end:]
+            start = end
+        return b''
+
+    def _check_columns(self):
+        if self.file_type == "gene_expr":
+            self.usecols = pre.gene_expression_columns(self.columns, self.name)
+        elif self.file_type == "mirna_iso":
+            self.id_col, self.usecols, self.feature_columns = pre.mirna_isoform_columns(self.columns, self.name)
+        else:
+            self.id_col, self.feature_columns = pre.mirna_aggregate_columns(self.columns, self.name)
+            key_index, _ = self.layout.modality_index("mirna_agg", self.feature_columns)
+            self.seen = np.zeros(len(key_index), dtype=bool)
+            self.usecols = [self.id_col] + self.feature_columns
+
+    def feed(self, block):
+        """Elabora un blocco di righe complete"""
+        if self.header is None:
+            block = self._read_header(block)
+        if not block.strip():
+            return
+        data = io.BytesIO(self.header + block)
+
+        if self.file_type == "gene_expr":
+            df = pd.read_csv(data, sep='\t', comment='#', usecols=self.usecols, dtype=pre.GENE_DTYPES)
+            self.layout.scatter_keyed("gene", pre.GENE_FEATURE_COLUMNS, df["gene_id"].to_numpy(dtype=object),
+                                      df[pre.GENE_FEATURE_COLUMNS].to_numpy(dtype=np.float32),
+                                      self.num_row, seen=self.seen)
+        elif self.file_type == "mirna_iso":
+            df = pd.read_csv(data, sep='\t', comment='#', usecols=self.usecols)[self.usecols].dropna()
+            ids = df[self.id_col]
+            offsets = ids.map(self.isoform_counts).fillna(0).to_numpy(dtype=np.int64)
+            ordinals = pre.isoform_ordinals(ids) + offsets
+            for mirna_id, count in ids.value_counts(sort=False).items():
+                self.isoform_counts[mirna_id] = self.isoform_counts.get(mirna_id, 0) + count
+            self.layout.scatter_isoforms("mirna_iso", self.feature_columns, ids.to_numpy(dtype=object), ordinals,
+                                         df[self.feature_columns].to_numpy(dtype=object),
+                                         self.num_row, self.cat_row)
+        else:
+            df = pd.read_csv(data, sep='\t', comment='#', usecols=self.usecols)
+            self.layout.scatter_keyed("mirna_agg", self.feature_columns, df[self.id_col].to_numpy(dtype=object),
+                                      df[self.feature_columns].to_numpy(dtype=object),
+                                      self.num_row, self.cat_row, seen=self.seen)
+
+    def finish(self):
+        if self.header is None:
+            raise ValueError(f"Intestazione mancante nel file {self.name}")
+
+
+class UploadIngest(io.RawIOBase):
+    """
+    Destinazione di un file caricato che lo elabora mentre arriva.
+
+    Args:
+        filename (str): Nome del file caricato
+        file_type (str): Tipo del file ("gene_expr", "mirna_iso", "mirna_agg")
+        layout (FeatureLayout): Layout del modello in cui scrivere i valori
+        upload_path (str): Percorso del file nella cartella di upload
+        save (bool): Se salvare la copia su disco in upload_path
+    """
+
+    def __init__(self, filename, file_type, layout, upload_path, save=INGEST_SAVE_UPLOADS):
+        super().__init__()
+        self.filename = filename
+        self.file_type = file_type
+        self.layout = layout
+        self.upload_path = upload_path
+        self.saved = save
+        self.num_row, self.cat_row = (row[0] for row in layout.new_rows(1))
+        self.bytes_received = 0
+        self.content_hash = None
+        self.prefix_hash = None
+        self.error = None
+        # Compressione riconosciuta durante l'upload ('gzip' o None), per rileggere la copia su disco
+        self.compression = None
+        # True se il file va elaborato dalla copia su disco (voce della cache attesa ma non trovata)
+        self.reparse = False
+        self._parser = _BlockParser(file_type, layout, self.num_row, self.cat_row, filename)
+        # Hash dei byte ricevuti (compressi se gzip), come parse_cache.file_hashes sul file salvato
+        self._digest = hashlib.sha256()
+        self._prefix = hashlib.sha256()
+        self._prefix_size = 0
+        # Hash completo della voce di cache con lo stesso prefisso: il parsing viene saltato
+        self._candidate = None
+        self._decoder = None
+        self._buffer = bytearray()
+        self._finished = False
+        self._disk = open(upload_path, 'w+b') if save else None
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, data):
+        self.bytes_received += len(data)
+        if self._disk is not None:
+            self._disk.write(data)
+        self._digest.update(data)
+        if self.prefix_hash is None:
+            head = data[:pc.PREFIX_BYTES - self._prefix_size]
+            self._prefix.update(head)
+            self._prefix_size += len(head)
+            if self._prefix_size >= pc.PREFIX_BYTES:
+                self._check_prefix()
+        if self._decoder is None:
+            # gzip riconosciuto dal nome o dai primi byte; wbits=47 accetta gzip e zlib
+            gzipped = self.filename.lower().endswith('.gz') or bytes(data[:2]) == GZIP_MAGIC
+            self._decoder = zlib.decompressobj(wbits=47) if gzipped else False
+            self.compression = 'gzip' if gzipped else None
+        if self.error is not None or self._candidate is not None:
+            return len(data)
+        try:
+            text = self._decoder.decompress(data) if self._decoder else bytes(data)
+        except zlib.error as e:
+            self._fail(e)
+            return len(data)
+        self._consume(text)
+        return len(data)
+
+    def _check_prefix(self):
+        """Cerca nella cache un file con lo stesso prefisso prima di analizzare il primo blocco"""
+        self.prefix_hash = self._prefix.hexdigest()
+        cache = pc.get_parse_cache()
+        # Senza copia su disco il file non potrebbe essere rielaborato se l'hash completo fosse diverso
+        if cache is None or self._disk is None:
+            return
+        self._candidate = cache.lookup_prefix(self.prefix_hash, self.layout, self.file_type)
+        if self._candidate is not None:
+            self._buffer = bytearray()
+
+    def _consume(self, text, final=False):
+        if self.error is not None or self._candidate is not None:
+            return
+        self._buffer += text
+        # Nessun blocco viene analizzato prima del controllo del prefisso
+        if (len(self._buffer) < INGEST_BLOCK_BYTES or self.prefix_hash is None) and not final:
+            return
+        # Elabora solo righe complete; il resto rimane nel buffer per il blocco successivo
+        cut = len(self._buffer) if final else self._buffer.rfind(b'\n') + 1
+        if cut <= 0:
+            return
+        block = bytes(self._buffer[:cut])
+        del self._buffer[:cut]
+        try:
+            self._parser.feed(block)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        self.error = error
+        self._buffer = bytearray()
+        print(f"Errore nell'elaborazione in streaming di {self.filename}: {error}")
+
+    def finish(self):
+        """
+        Completa l'elaborazione (ultima riga, fine del gzip) e salva il risultato nella cache.
+
+        Un file già in cache viene letto dalla cache: se è più corto di PREFIX_BYTES
+        non è stato ancora analizzato, altrimenti il prefisso ha già fermato il parsing.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.content_hash = self._digest.hexdigest()
+        if self.prefix_hash is None:
+            self.prefix_hash = self._prefix.hexdigest()
+        if self._disk is not None:
+            self._disk.flush()
+        cache = pc.get_parse_cache()
+        if cache is not None and self.error is None:
+            if cache.load(self.content_hash, self.layout, self.file_type, self.num_row, self.cat_row):
+                self._buffer = bytearray()
+                return
+            if self._candidate is not None:
+                # Stesso prefisso ma contenuto diverso (o voce eliminata nel frattempo)
+                self.reparse = True
+                return
+        if self._decoder and self.error is None:
+            try:
+                self._consume(self._decoder.flush(), final=True)
+            except zlib.error as e:
+                self._fail(e)
+        else:
+            self._consume(b'', final=True)
+        if self.error is None:
+            try:
+                self._parser.finish()
+            except Exception as e:
+                self._fail(e)
+        if self.error is None:
+            if cache is not None:
+                cache.store(self.content_hash, self.layout, self.file_type, self.num_row, self.cat_row,
+                            prefix_hash=self.prefix_hash)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Werkzeug riporta il file all'inizio al termine della parte: l'upload è completo
+        if offset == 0 and whence == io.SEEK_SET:
+            self.finish()
+        if self._disk is not None:
+            return self._disk.seek(offset, whence)
+        return 0
+
+    def tell(self):
+        return self._disk.tell() if self._disk is not None else self.bytes_received
+
+    def readinto(self, buffer):
+        # Senza copia su disco il contenuto non viene conservato
+        if self._disk is None:
+            return 0
+        return self._disk.readinto(buffer)
+
+    def close(self):
+        if self._disk is not None and not self._disk.closed:
+            self._disk.close()
+        super().close()
+
+    def apply(self, file_type, layout, num_row, cat_row):
+        """
+        Copia nella riga del paziente i valori elaborati durante l'upload.
+
+        Returns:
+            bool: False se il file va rielaborato (errore, tipo o layout diversi, voce di cache mancante)
+        """
+        self.finish()
+        if self.error is not None or self.reparse or file_type != self.file_type or layout is not self.layout:
+            return False
+        num_positions, cat_slots = layout.modality_template(pc.MODALITY_PREFIXES[file_type])
+        num_row[num_positions] = self.num_row[num_positions]
+        cat_row[cat_slots] = self.cat_row[cat_slots]
+        return True
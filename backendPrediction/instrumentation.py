@@ -0,0 +1,352 @@
+"""
+Misura delle fasi del percorso di predizione.
+
+Ogni fase viene racchiusa in span("nome"), che misura tempo reale, tempo CPU del
+processo e crescita della memoria:
+- upload_receive / upload_save: ricezione del corpo multipart (con l'elaborazione
+  durante l'upload, vedi ingest.py) e salvataggio dei file;
+- parse_gene_expr, parse_mirna_iso, parse_mirna_agg: scrittura di ogni file nella
+  riga del paziente (nel percorso delle richieste i NaN delle categoriche vengono
+  sostituiti qui, durante lo scatter);
+- placeholder: modalità miRNA mancante riempita con i valori di default;
+- alignment / nan_handling: costruzione della matrice del modello;
+- model_evaluation, importance, gene_mapping: predict_proba, classifica o SHAP e
+  nomi dei geni.
+Gli span possono essere annidati (gene_mapping dentro importance): i tempi del
+livello esterno includono quelli interni.
+
+Ogni span aggiorna gli istogrammi e i contatori del processo, esposti da /metrics
+nel formato testuale Prometheus; durante una richiesta viene anche aggiunto alla
+sua Trace, da cui flask_app ricava l'header X-Timing. Con più worker gunicorn ogni
+processo scrive i propri totali in METRICS_DIR e /metrics li somma.
+
+Il tempo CPU è quello dell'intero processo (time.process_time), così da includere
+i thread di CatBoost; la memoria è la crescita dell'RSS del processo durante lo
+span (economica), oppure con TRACE_MEMORY=1 il picco di memoria allocata misurato
+da tracemalloc, più preciso ma con un costo su ogni allocazione. Entrambe le misure
+sono del processo: con richieste concorrenti includono anche il lavoro delle altre.
+"""
+
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (solo sviluppo, un processo): l'archivio delle metriche non viene bloccato
+    fcntl = None
+
+# Span, metriche e header X-Timing (0 = span senza alcun costo)
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', '1') == '1'
+# Header X-Timing su tutte le risposte (altrimenti solo se la richiesta contiene l'header X-Timing)
+TIMING_HEADER = os.getenv('TIMING_HEADER', '0') == '1'
+# Memoria degli span misurata con tracemalloc invece che dall'RSS
+TRACE_MEMORY = os.getenv('TRACE_MEMORY', '0') == '1'
+# Cartella condivisa dai worker per i totali di ogni processo (vuota = solo il processo corrente)
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+# Secondi minimi tra due scritture dei totali del processo in METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+
+# Limiti superiori (secondi) dei bucket degli istogrammi
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ARCHIVE_FILE = "metrics_archive.json"
+
+if INSTRUMENTATION_ENABLED and TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _bucket_counts(value):
+    return [1 if value <= bound else 0 for bound in BUCKETS]
+
+
+class Metrics:
+    """Istogrammi e contatori del processo per fase e per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = {}
+        self._flushed_at = 0.0
+
+    def observe_stage(self, name, wall, cpu, mem):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'mem': 0,
+                                             'buckets': [0] * len(BUCKETS)}
+            stage['count'] += 1
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['mem'] += mem
+            stage['buckets'] = [count + hit for count, hit in zip(stage['buckets'], _bucket_counts(wall))]
+
+    def observe_request(self, endpoint, method, status, wall):
+        key = f"{endpoint}|{method}|{status}"
+        with self._lock:
+            entry = self.requests.get(key)
+            if entry is None:
+                entry = self.requests[key] = {'count': 0, 'wall': 0.0, 'buckets': [0] * len(BUCKETS)}
+            entry['count'] += 1
+            entry['wall'] += wall
+            entry['buckets'] = [count + hit for count, hit in zip(entry['buckets'], _bucket_counts(wall))]
+
+    def snapshot(self):
+        """Copia dei totali del processo, serializzabile in JSON"""
+        with self._lock:
+            return json.loads(json.dumps({'stages': self.stages, 'requests': self.requests}))
+
+    def flush(self, force=False):
+        """Scrive i totali del processo in METRICS_DIR (al più ogni METRICS_FLUSH_INTERVAL secondi)"""
+        if not METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Impossibile scrivere le metriche in {METRICS_DIR}: {e}")
+
+
+metrics = Metrics()
+
+
+def merge_snapshots(snapshots):
+    """Somma i totali di più processi"""
+    merged = {'stages': {}, 'requests': {}}
+    for snapshot in snapshots:
+        for section in ('stages', 'requests'):
+            for key, entry in snapshot.get(section, {}).items():
+                total = merged[section].get(key)
+                if total is None:
+                    merged[section][key] = json.loads(json.dumps(entry))
+                    continue
+                for field, value in entry.items():
+                    if field == 'buckets':
+                        total['buckets'] = [a + b for a, b in zip(total['buckets'], value)]
+                    else:
+                        total[field] += value
+    return merged
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def collect():
+    """Totali del processo corrente e, con METRICS_DIR, degli altri worker (anche terminati)"""
+    snapshots = [metrics.snapshot()]
+    if METRICS_DIR:
+        own = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+            if path != own:
+                snapshots.append(_read_snapshot(path))
+    return merge_snapshots(snapshots)
+
+
+def archive_process_metrics():
+    """
+    Alla chiusura di un worker somma i suoi totali all'archivio comune ed elimina il
+    suo file: i contatori restano monotoni e i file non crescono con i riavvii.
+    """
+    if not METRICS_DIR:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(os.path.join(METRICS_DIR, "archive.lock"), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+            merged = merge_snapshots([_read_snapshot(archive_path), metrics.snapshot()])
+            tmp_path = f"{archive_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, archive_path)
+            own = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+            if os.path.exists(own):
+                os.remove(own)
+    except OSError as e:
+        print(f"Impossibile archiviare le metriche in {METRICS_DIR}: {e}")
+
+
+def reset_metrics_dir():
+    """Svuota METRICS_DIR all'avvio del server (i totali ripartono da zero)"""
+    if not METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        os.remove(path)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _histogram(lines, name, labels, entry):
+    for bound, count in zip(BUCKETS, entry['buckets']):
+        lines.append(f'{name}_bucket{{{_labels(**labels, le=bound)}}} {count}')
+    lines.append(f'{name}_bucket{{{_labels(**labels, le="+Inf")}}} {entry["count"]}')
+    lines.append(f'{name}_sum{{{_labels(**labels)}}} {entry["wall"]:.6f}')
+    lines.append(f'{name}_count{{{_labels(**labels)}}} {entry["count"]}')
+
+
+def render_prometheus(snapshot):
+    """Formato testuale Prometheus dei totali (vedi collect)"""
+    stages = sorted(snapshot['stages'].items())
+    requests = sorted((key.split('|'), entry) for key, entry in snapshot['requests'].items())
+    lines = ['# HELP prediction_stage_seconds Tempo reale delle fasi di predizione',
+             '# TYPE prediction_stage_seconds histogram']
+    for name, entry in stages:
+        _histogram(lines, 'prediction_stage_seconds', {'stage': name}, entry)
+    lines += ['# HELP prediction_stage_cpu_seconds_total Tempo CPU del processo (tutti i thread) nelle fasi '
+              'di predizione',
+              '# TYPE prediction_stage_cpu_seconds_total counter']
+    lines += [f'prediction_stage_cpu_seconds_total{{{_labels(stage=name)}}} {entry["cpu"]:.6f}' for name, entry in stages]
+    lines += ['# HELP prediction_stage_memory_growth_bytes_total Crescita della memoria del processo nelle fasi '
+              'di predizione (RSS, o picco tracemalloc con TRACE_MEMORY=1)',
+              '# TYPE prediction_stage_memory_growth_bytes_total counter']
+    lines += [f'prediction_stage_memory_growth_bytes_total{{{_labels(stage=name)}}} {entry["mem"]}'
+              for name, entry in stages]
+    lines += ['# HELP http_requests_total Richieste servite per endpoint, metodo e stato',
+              '# TYPE http_requests_total counter']
+    lines += [f'http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {entry["count"]}'
+              for (endpoint, method, status), entry in requests]
+    lines += ['# HELP http_request_duration_seconds Durata delle richieste per endpoint',
+              '# TYPE http_request_duration_seconds histogram']
+    # Durate per endpoint, sommando metodi e stati
+    durations = merge_snapshots([{'requests': {endpoint: entry}} for (endpoint, _, _), entry in requests])
+    for endpoint, entry in sorted(durations['requests'].items()):
+        _histogram(lines, 'http_request_duration_seconds', {'endpoint': endpoint}, entry)
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Span di una richiesta, nell'ordine in cui sono terminati"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, wall, cpu, mem):
+        self.spans.append((name, wall, cpu, mem))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        """
+        Totali per fase (una fase può ripetersi, ad esempio un parse per paziente).
+
+        Returns:
+            dict: nome -> {'count', 'wall_ms', 'cpu_ms', 'mem_bytes'}, nell'ordine della prima occorrenza
+        """
+        stages = {}
+        for name, wall, cpu, mem in self.spans:
+            stage = stages.setdefault(name, {'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0, 'mem_bytes': 0})
+            stage['count'] += 1
+            stage['wall_ms'] += wall * 1000
+            stage['cpu_ms'] += cpu * 1000
+            stage['mem_bytes'] += mem
+        return stages
+
+    def header(self):
+        """Valore dell'header X-Timing, con la sintassi di Server-Timing"""
+        parts = []
+        for name, stage in self.summary().items():
+            part = f"{name};dur={stage['wall_ms']:.2f};cpu={stage['cpu_ms']:.2f};mem={stage['mem_bytes']}"
+            if stage['count'] > 1:
+                part += f";count={stage['count']}"
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_memory_frames = threading.local()
+
+
+def start_trace():
+    """Inizia la Trace della richiesta corrente"""
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    """Termina e restituisce la Trace della richiesta corrente (None se non iniziata)"""
+    trace = _current_trace.get()
+    _current_trace.set(None)
+    return trace
+
+
+def _memory_start():
+    if not TRACE_MEMORY:
+        return _rss_bytes()
+    current, peak = tracemalloc.get_traced_memory()
+    frames = getattr(_memory_frames, 'frames', None)
+    if frames is None:
+        frames = _memory_frames.frames = []
+    if frames:
+        # reset_peak cancella il picco raggiunto finora dallo span esterno: lo conserva qui
+        frames[-1]['lost_peak'] = max(frames[-1]['lost_peak'], peak)
+    tracemalloc.reset_peak()
+    frames.append({'start': current, 'lost_peak': 0})
+    return current
+
+
+def _memory_end(start):
+    if not TRACE_MEMORY:
+        return max(0, _rss_bytes() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    frame = _memory_frames.frames.pop()
+    return max(0, max(peak, frame['lost_peak']) - frame['start'])
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    Misura una fase del percorso di predizione.
+
+    Args:
+        name (str): Nome della fase (etichetta stage delle metriche)
+    """
+    if not INSTRUMENTATION_ENABLED:
+        yield
+        return
+    memory_start = _memory_start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        mem = _memory_end(memory_start)
+        metrics.observe_stage(name, wall, cpu, mem)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, wall, cpu, mem)
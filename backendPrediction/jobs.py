@@ -0,0 +1,399 @@
+"""
+Job di predizione asincroni con coda persistente.
+
+Le richieste vengono salvate in un database SQLite (condiviso tra i worker
+gunicorn) e ricevono subito un job_id; in ogni processo un pool di thread
+limitato (JOB_WORKERS) esegue i job in ordine di arrivo. I processi aggiornano
+periodicamente l'heartbeat dei job in esecuzione: i job rimasti "running" senza
+heartbeat (processo terminato o servizio riavviato) tornano in coda. I risultati
+restano nel database finché non vengono letti, al massimo per JOB_RESULT_TTL secondi.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Cartella assets del backend, indipendente dalla cartella di lavoro
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+# Database dei job e thread che eseguono i job in ogni processo
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join(ASSETS_DIR, 'jobs.sqlite3'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 1))
+# Job in coda accettati prima di rifiutare nuove richieste
+JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', 100))
+# Secondi per cui un risultato non letto viene conservato
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 24 * 3600))
+# Intervallo di controllo della coda e secondi senza heartbeat dopo cui un job torna in coda
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', 60))
+# Tentativi massimi per job (un job che fa terminare il processo non viene ripetuto all'infinito)
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATUSES = (DONE, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+_STATUS_COLUMNS = "id, kind, status, error, attempts, created_at, started_at, finished_at"
+
+
+class JobQueueFull(Exception):
+    """La coda ha raggiunto JOB_MAX_QUEUED job in attesa"""
+
+
+class JobStore:
+    """Archivio SQLite dei job: coda, stato e risultati"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            # WAL: le letture di stato non attendono le scritture degli altri worker
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Connection(conn)
+
+    def submit(self, kind, params, max_queued=JOB_MAX_QUEUED):
+        """
+        Inserisce un nuovo job in coda.
+
+        Args:
+            kind (str): Tipo di job, passato all'handler
+            params (dict): Parametri serializzabili in JSON
+            max_queued (int): Job in attesa oltre i quali la richiesta viene rifiutata
+
+        Returns:
+            dict: Stato del job creato
+
+        Raises:
+            JobQueueFull: Se la coda è piena
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= max_queued:
+                conn.execute("ROLLBACK")
+                raise JobQueueFull(f"Coda dei job piena ({queued} job in attesa)")
+            conn.execute("INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, kind, QUEUED, json.dumps(params), time.time()))
+            conn.execute("COMMIT")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Stato di un job (senza risultato), con la posizione in coda se in attesa; None se sconosciuto"""
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_STATUS_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job['status'] == QUEUED:
+                job['position'] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?",
+                    (QUEUED, job['created_at'])).fetchone()[0]
+        return job
+
+    def claim(self, owner):
+        """Assegna a owner il job in coda più vecchio; None se la coda è vuota"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                               (QUEUED,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, "
+                         "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                         (RUNNING, owner, now, now, row['id']))
+            job = dict(conn.execute("SELECT id, kind, params, attempts FROM jobs WHERE id = ?",
+                                    (row['id'],)).fetchone())
+            conn.execute("COMMIT")
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def heartbeat(self, owner, job_ids):
+        """Segnala che i job di owner sono ancora in esecuzione"""
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                             [(time.time(), job_id, owner, RUNNING) for job_id in job_ids])
+
+    def finish(self, job_id, owner, result=None, error=None):
+        """Salva il risultato (o l'errore) di un job eseguito da owner"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, owner = NULL "
+                         "WHERE id = ? AND owner = ? AND status = ?",
+                         (FAILED if error is not None else DONE,
+                          json.dumps(result) if error is None else None,
+                          error, time.time(), job_id, owner, RUNNING))
+
+    def requeue_stale(self, stale_seconds=JOB_STALE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Rimette in coda i job "running" senza heartbeat recente.
+
+        Returns:
+            int: Job rimessi in coda o chiusi con errore per troppi tentativi
+        """
+        limit = time.time() - stale_seconds
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            failed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, f"Job interrotto {max_attempts} volte", time.time(), RUNNING, limit, max_attempts)).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, limit)).rowcount
+            conn.execute("COMMIT")
+        if failed or requeued:
+            print(f"Job interrotti: {requeued} rimessi in coda, {failed} chiusi con errore")
+        return failed + requeued
+
+    def pop_result(self, job_id):
+        """
+        Restituisce il risultato di un job e lo elimina se il job è terminato.
+
+        Returns:
+            dict: Stato del job con 'result' (se completato); None se sconosciuto
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(f"SELECT {_STATUS_COLUMNS}, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row['status'] in FINISHED_STATUSES:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def queued(self, job_ids):
+        """Job di job_ids ancora in attesa in coda"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT id FROM jobs WHERE status = ? AND id IN ({','.join('?' * len(job_ids))})",
+                                (QUEUED, *job_ids)).fetchall()
+        return {row['id'] for row in rows}
+
+    def purge(self, ttl=JOB_RESULT_TTL):
+        """Elimina i job terminati da più di ttl secondi e mai letti"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                (*FINISHED_STATUSES, time.time() - ttl)).rowcount
+
+    def counts(self):
+        """Numero di job per stato"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class _Connection:
+    """Connessione SQLite chiusa all'uscita dal blocco with (sqlite3 da solo non la chiude)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+class JobRunner:
+    """
+    Esegue i job della coda con un pool di thread limitato.
+
+    Args:
+        store (JobStore): Archivio dei job
+        handler (callable): handler(kind, params, context) -> risultato serializzabile in JSON
+        workers (int): Job eseguiti contemporaneamente da questo processo
+    """
+
+    def __init__(self, store, handler, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL,
+                 stale_seconds=JOB_STALE_SECONDS, result_ttl=JOB_RESULT_TTL):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.result_ttl = result_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pid = os.getpid()
+        self.completed = 0
+        self.failed = 0
+        self._running = set()
+        # Oggetti non serializzabili dei job inviati da questo processo (es. file elaborati durante l'upload),
+        # eliminati quando il job non è più in coda, anche se eseguito da un altro processo
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._thread = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self._wake.set()
+        # Il dispatcher non assegna più job: nessun submit dopo lo shutdown del pool
+        if self._thread.is_alive():
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            self._contexts.clear()
+
+    def submit(self, kind, params, context=None):
+        """
+        Mette in coda un job e sveglia il dispatcher.
+
+        Args:
+            context: Dati in memoria per l'handler, disponibili solo se il job viene eseguito da
+                questo processo (l'handler deve funzionare anche con context=None)
+
+        Returns:
+            dict: Stato del job creato
+        """
+        job = self.store.submit(kind, params)
+        if context is not None:
+            with self._lock:
+                self._contexts[job['id']] = context
+        self._wake.set()
+        return job
+
+    def _dispatch(self):
+        last_maintenance = 0.0
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    running = list(self._running)
+                self.store.heartbeat(self.owner, running)
+                now = time.time()
+                if now - last_maintenance >= self.stale_seconds / 2:
+                    last_maintenance = now
+                    self.store.requeue_stale(self.stale_seconds)
+                    self.store.purge(self.result_ttl)
+                    self._drop_contexts()
+                while len(running) < self.workers and not self._stop.is_set():
+                    job = self.store.claim(self.owner)
+                    if job is None:
+                        break
+                    with self._lock:
+                        self._running.add(job['id'])
+                        running.append(job['id'])
+                    self._executor.submit(self._run, job)
+            except Exception as e:
+                print(f"Errore nel dispatcher dei job: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _drop_contexts(self):
+        """Elimina i context dei job non più in coda: eseguiti (o in esecuzione) da un altro processo, o eliminati"""
+        with self._lock:
+            pending = [job_id for job_id in self._contexts if job_id not in self._running]
+        if not pending:
+            return
+        queued = self.store.queued(pending)
+        with self._lock:
+            for job_id in pending:
+                if job_id not in queued and job_id not in self._running:
+                    self._contexts.pop(job_id, None)
+
+    def _run(self, job):
+        with self._lock:
+            context = self._contexts.pop(job['id'], None)
+        print(f"Job {job['id']} ({job['kind']}) avviato, tentativo {job['attempts']}")
+        try:
+            result = self.handler(job['kind'], job['params'], context)
+        except Exception as e:
+            print(f"Job {job['id']} fallito: {e}")
+            self.store.finish(job['id'], self.owner, error=str(e))
+            with self._lock:
+                self.failed += 1
+        else:
+            self.store.finish(job['id'], self.owner, result=result)
+            with self._lock:
+                self.completed += 1
+        finally:
+            with self._lock:
+                self._running.discard(job['id'])
+            # Libera subito lo slot per il prossimo job in coda
+            self._wake.set()
+
+    def stats(self):
+        """Stato della coda condivisa e contatori di questo processo"""
+        with self._lock:
+            running = len(self._running)
+        return {
+            'counts': self.store.counts(),
+            'workers': self.workers,
+            'running_here': running,
+            'completed_here': self.completed,
+            'failed_here': self.failed,
+        }
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_runner(handler, db_path=JOB_DB_PATH, workers=JOB_WORKERS):
+    """
+    Avvia (una volta per processo) il pool che esegue i job della coda.
+
+    I thread non sopravvivono a fork: un processo figlio che chiama di nuovo
+    start_runner ottiene un pool proprio invece di quello ereditato.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            _runner = JobRunner(JobStore(db_path), handler, workers).start()
+    return _runner
+
+
+def get_runner():
+    """Restituisce il pool del processo, None se non ancora avviato"""
+    if _runner is None or _runner.pid != os.getpid():
+        return None
+    return _runner
@@ -0,0 +1,222 @@
+"""
+Registro dei modelli CatBoost condiviso a livello di processo.
+
+Ogni file .cbm viene deserializzato una sola volta per worker e riutilizzato
+da tutte le richieste. La versione del modello è identificata da percorso,
+mtime e hash del file: se il file sul volume `assets` cambia, il modello
+viene ricaricato e sostituito senza riavviare il servizio.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+
+from feature_layout import FeatureLayout
+
+# Thread usati da CatBoost per predizione e SHAP (-1 = tutti i core disponibili)
+DEFAULT_THREAD_COUNT = int(os.getenv('CATBOOST_THREAD_COUNT', -1))
+
+
+def _current_rss_bytes():
+    """Restituisce la memoria residente (RSS) del processo in byte, None se non disponibile"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """
+    Calcola l'hash SHA-1 di un file leggendolo a blocchi.
+
+    Args:
+        path (str): Percorso del file
+        chunk_size (int): Dimensione dei blocchi letti
+
+    Returns:
+        str: Digest esadecimale del file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LoadedModel:
+    """Modello CatBoost caricato insieme ai metadati della sua versione"""
+
+    def __init__(self, model, path, mtime_ns, size, sha1, load_seconds, memory_bytes,
+                 thread_count=DEFAULT_THREAD_COUNT):
+        self.model = model
+        self.thread_count = thread_count
+        self.classes = np.asarray(model.classes_)
+        # Piano di allineamento calcolato una sola volta per versione del modello
+        self.layout = FeatureLayout.from_model(model)
+        # Feature importance globale: dipende solo dal modello, calcolata al caricamento
+        self.feature_importance = np.asarray(model.get_feature_importance(), dtype=np.float64)
+        self.importance_order = np.argsort(-self.feature_importance, kind='stable')
+        self.importance_df = pd.DataFrame({
+            'feature': np.asarray(self.layout.feature_names, dtype=object)[self.importance_order],
+            'importance': self.feature_importance[self.importance_order]
+        })
+        # Classifiche top-K con nomi dei geni, per (top_k, base_dir)
+        self.rankings = {}
+        # Cache LRU delle spiegazioni SHAP per input identici (legata alla versione)
+        self.shap_cache = OrderedDict()
+        self.shap_lock = threading.Lock()
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha1 = sha1
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.loaded_at = time.time()
+
+    @property
+    def version(self):
+        """Identificativo breve della versione del modello"""
+        return self.sha1[:12]
+
+    def info(self):
+        """Restituisce le informazioni del modello in formato serializzabile"""
+        return {
+            'path': self.path,
+            'version': self.version,
+            'sha1': self.sha1,
+            'file_size_bytes': self.size,
+            'mtime': self.mtime_ns / 1e9,
+            'loaded_at': self.loaded_at,
+            'load_seconds': round(self.load_seconds, 4),
+            'memory_bytes': self.memory_bytes,
+            'feature_count': len(self.model.feature_names_ or []),
+            'tree_count': self.model.tree_count_,
+            'classes': self.classes.tolist(),
+            'thread_count': self.thread_count,
+        }
+
+
+class ModelRegistry:
+    """
+    Cache thread-safe dei modelli caricati, indicizzata per percorso assoluto.
+
+    Ad ogni accesso viene fatto solo uno `stat` del file: se mtime e dimensione
+    coincidono con quelli del modello in memoria, il modello viene restituito
+    direttamente. In caso contrario il file viene ricaricato; mentre un thread
+    ricarica, gli altri continuano a usare la versione precedente. Se il
+    ricaricamento fallisce, il file non viene riletto finché non cambia.
+    """
+
+    def __init__(self, thread_count=DEFAULT_THREAD_COUNT):
+        self.thread_count = thread_count
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        # percorso -> (mtime_ns, size) dell'ultima versione del file non caricabile
+        self._failed = {}
+
+    def _load(self, path, stat):
+        rss_before = _current_rss_bytes()
+        start = time.perf_counter()
+        model = CatBoostClassifier()
+        model.load_model(path)
+        load_seconds = time.perf_counter() - start
+        rss_after = _current_rss_bytes()
+
+        memory_bytes = None
+        if rss_before is not None and rss_after is not None:
+            memory_bytes = max(rss_after - rss_before, 0)
+
+        entry = LoadedModel(model, path, stat.st_mtime_ns, stat.st_size,
+                            file_sha1(path), load_seconds, memory_bytes, self.thread_count)
+        print(f"Modello caricato: {path} (versione {entry.version}, {load_seconds:.2f}s)")
+        return entry
+
+    def _loading_lock(self, path):
+        with self._lock:
+            return self._loading.setdefault(path, threading.Lock())
+
+    def get(self, model_path):
+        """
+        Restituisce il modello per il percorso indicato, caricandolo se necessario.
+
+        Args:
+            model_path (str): Percorso del file .cbm
+
+        Returns:
+            LoadedModel: Modello caricato con i relativi metadati
+        """
+        path = os.path.abspath(model_path)
+        stat = os.stat(path)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            return entry
+        # Versione del file già risultata non caricabile: continua con quella in memoria
+        if entry is not None and self._failed.get(path) == (stat.st_mtime_ns, stat.st_size):
+            return entry
+
+        loading_lock = self._loading_lock(path)
+        # Se un altro thread sta già ricaricando, continua con la versione corrente
+        if not loading_lock.acquire(blocking=entry is None):
+            return entry
+
+        try:
+            entry = self._entries.get(path)
+            stat = os.stat(path)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                return entry
+            if entry is not None and self._failed.get(path) == (stat.st_mtime_ns, stat.st_size):
+                return entry
+
+            # Stesso contenuto (es. file solo "toccato"): aggiorna i metadati senza ricaricare
+            if entry is not None and entry.size == stat.st_size and file_sha1(path) == entry.sha1:
+                entry.mtime_ns = stat.st_mtime_ns
+                self._failed.pop(path, None)
+                return entry
+
+            try:
+                new_entry = self._load(path, stat)
+            except Exception as e:
+                if entry is None:
+                    raise
+                # File in fase di scrittura o corrotto: mantieni la versione precedente
+                # senza rileggerlo a ogni richiesta finché mtime o dimensione non cambiano
+                self._failed[path] = (stat.st_mtime_ns, stat.st_size)
+                print(f"Errore nel ricaricamento del modello {path}, uso la versione {entry.version}: {e}")
+                return entry
+
+            self._failed.pop(path, None)
+            self._entries[path] = new_entry
+            return new_entry
+        finally:
+            loading_lock.release()
+
+    def preload(self, model_path):
+        """Carica il modello all'avvio del worker; restituisce None se il file non è disponibile"""
+        try:
+            return self.get(model_path)
+        except Exception as e:
+            print(f"Impossibile precaricare il modello {model_path}: {e}")
+            return None
+
+    def stats(self):
+        """Restituisce le informazioni su tutti i modelli caricati"""
+        return [entry.info() for entry in list(self._entries.values())]
+
+
+# Registro condiviso dal processo
+registry = ModelRegistry()
+
+
+def get_model(model_path):
+    """Scorciatoia per ottenere un modello dal registro di processo"""
+    return registry.get(model_path)
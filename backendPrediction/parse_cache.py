@@ -0,0 +1,267 @@
+"""
+Cache su disco dei file omici già elaborati, indicizzata per contenuto.
+
+Ogni voce contiene i valori che il parser di una modalità ha scritto nella riga
+del modello, per un file identificato dal suo hash SHA-256 e per un layout
+identificato dal suo schema hash. Le voci sono file .npz nella stessa cartella
+(condivisa tra i worker gunicorn). La dimensione totale è limitata: vengono
+eliminate per prime le voci usate meno di recente (mtime aggiornato ad ogni lettura).
+
+Accanto a ogni voce un piccolo file .ref associa l'hash dei primi PREFIX_BYTES
+byte del file al suo hash completo: durante un upload in streaming (ingest.py)
+il contenuto completo non è ancora noto, ma il prefisso basta per riconoscere un
+file già elaborato e non analizzarlo di nuovo.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+# Cartella assets del backend, indipendente dalla cartella di lavoro
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+# Cartella della cache e dimensione massima su disco (0 disabilita la cache)
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', os.path.join(ASSETS_DIR, 'parse_cache'))
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Byte iniziali del file usati per riconoscerlo prima che sia ricevuto per intero
+PREFIX_BYTES = 64 * 1024
+
+# Prefisso delle feature di ogni tipo di file
+MODALITY_PREFIXES = {
+    "gene_expr": "gene",
+    "mirna_iso": "mirna_iso",
+    "mirna_agg": "mirna_agg",
+}
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Calcola l'hash SHA-256 del contenuto di un file leggendolo a blocchi.
+
+    Args:
+        path (str): Percorso del file
+        chunk_size (int): Dimensione dei blocchi letti
+
+    Returns:
+        str: Digest esadecimale del file
+    """
+    return file_hashes(path, chunk_size)[0]
+
+
+def file_hashes(path, chunk_size=1024 * 1024):
+    """
+    Calcola in una sola lettura l'hash SHA-256 del file e quello dei suoi primi PREFIX_BYTES byte.
+
+    Returns:
+        tuple: (digest del contenuto, digest del prefisso)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(PREFIX_BYTES)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest(), hashlib.sha256(head).hexdigest()
+
+
+class ParseCache:
+    """Cache LRU su disco delle righe parziali prodotte dai parser, per modalità"""
+
+    def __init__(self, cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, content_hash, layout, file_type):
+        return os.path.join(self.cache_dir, f"{file_type}-{layout.schema_hash[:16]}-{content_hash}.npz")
+
+    def _ref_path(self, prefix_hash, layout, file_type):
+        return os.path.join(self.cache_dir, f"{file_type}-{layout.schema_hash[:16]}-prefix-{prefix_hash}.ref")
+
+    def lookup_prefix(self, prefix_hash, layout, file_type):
+        """
+        Hash completo dell'ultimo file in cache che inizia con il prefisso dato.
+
+        Il chiamante deve confrontarlo con l'hash del file ricevuto per intero:
+        file diversi possono avere lo stesso prefisso.
+
+        Returns:
+            str: Hash del contenuto, None se nessuna voce corrisponde
+        """
+        try:
+            with open(self._ref_path(prefix_hash, layout, file_type)) as f:
+                content_hash = f.read().strip()
+        except OSError:
+            return None
+        if not content_hash or not os.path.exists(self._path(content_hash, layout, file_type)):
+            return None
+        return content_hash
+
+    def load(self, content_hash, layout, file_type, num_row, cat_row):
+        """
+        Scrive nella riga del paziente i valori salvati per un file, se presenti.
+
+        Args:
+            content_hash (str): SHA-256 del contenuto del file
+            layout (FeatureLayout): Layout della riga
+            file_type (str): Tipo del file ("gene_expr", "mirna_iso", "mirna_agg")
+            num_row (np.ndarray): Riga float32 del paziente
+            cat_row (np.ndarray): Riga delle feature categoriche del paziente
+
+        Returns:
+            bool: True se la voce era in cache
+        """
+        path = self._path(content_hash, layout, file_type)
+        num_positions, cat_slots = layout.modality_template(MODALITY_PREFIXES[file_type])
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                num_values = entry['num']
+                cat_values = entry['cat'].astype(object)
+                cat_values[entry['cat_nan']] = np.nan
+        except (OSError, KeyError, ValueError):
+            # Voce assente, in scrittura da un altro worker o non leggibile
+            with self._lock:
+                self.misses += 1
+            return False
+        if len(num_values) != len(num_positions) or len(cat_values) != len(cat_slots):
+            with self._lock:
+                self.misses += 1
+            return False
+
+        num_row[num_positions] = num_values
+        cat_row[cat_slots] = cat_values
+        try:
+            # Aggiorna mtime: è l'ordine usato dall'eviction LRU
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, content_hash, layout, file_type, num_row, cat_row, prefix_hash=None):
+        """Salva i valori scritti dal parser di un file nella riga del paziente (e il riferimento dal prefisso)"""
+        path = self._path(content_hash, layout, file_type)
+        num_positions, cat_slots = layout.modality_template(MODALITY_PREFIXES[file_type])
+        cat_values = cat_row[cat_slots]
+        cat_nan = np.asarray([not isinstance(value, str) for value in cat_values], dtype=bool)
+        cat_values = np.where(cat_nan, "", cat_values).astype(str)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, num=num_row[num_positions], cat=cat_values, cat_nan=cat_nan)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Impossibile salvare {path} nella cache dei file elaborati: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        if prefix_hash is not None:
+            ref_path = self._ref_path(prefix_hash, layout, file_type)
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(content_hash)
+                os.replace(tmp_path, ref_path)
+            except OSError as e:
+                print(f"Impossibile salvare {ref_path} nella cache dei file elaborati: {e}")
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            # I .ref sono eliminati in ordine LRU come le voci (una voce mancante li rende inutili)
+            if entry.name.endswith(('.npz', '.ref')):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Elimina le voci usate meno di recente finché la cache supera max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                # Già eliminata da un altro worker
+                pass
+            else:
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Statistiche della cache: voci e byte su disco, hit/miss del processo"""
+        entries = self._entries()
+        return {
+            'cache_dir': self.cache_dir,
+            'entries': sum(1 for _, _, path in entries if path.endswith('.npz')),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'checked_at': time.time(),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """Restituisce la cache del processo, None se disabilitata o se la cartella non è scrivibile"""
+    global _cache
+    if PARSE_CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = ParseCache()
+                except OSError as e:
+                    print(f"Cache dei file elaborati non disponibile in {PARSE_CACHE_DIR}: {e}")
+                    return None
+    return _cache
+
+
+def cached_fill(file_type, file_path, filler, layout, num_row, cat_row, content_hash=None, prefix_hash=None):
+    """
+    Esegue filler(file_path, layout, num_row, cat_row) usando la cache se disponibile.
+
+    Args:
+        file_type (str): Tipo del file ("gene_expr", "mirna_iso", "mirna_agg")
+        file_path (str): Percorso del file
+        filler (callable): Parser che scrive il file nella riga del paziente
+        layout (FeatureLayout): Layout della riga
+        num_row (np.ndarray): Riga float32 del paziente
+        cat_row (np.ndarray): Riga delle feature categoriche del paziente
+        content_hash (str): SHA-256 del file se già noto (es. calcolato durante l'upload)
+        prefix_hash (str): SHA-256 dei primi PREFIX_BYTES byte, se già noto
+    """
+    cache = get_parse_cache()
+    if cache is None:
+        return filler(file_path, layout, num_row, cat_row)
+
+    if content_hash is None:
+        content_hash, prefix_hash = file_hashes(file_path)
+    if cache.load(content_hash, layout, file_type, num_row, cat_row):
+        return None
+    result = filler(file_path, layout, num_row, cat_row)
+    cache.store(content_hash, layout, file_type, num_row, cat_row, prefix_hash=prefix_hash)
+    return result
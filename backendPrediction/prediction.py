@@ -5,11 +5,28 @@ Tumor: ['TCGA-A8-A07G']
 
 import pandas as pd
 import numpy as np
-from catboost import CatBoostClassifier
+from catboost import Pool
 import preprocessing as pre
+import model_registry as mr
+from feature_layout import FeatureLayout, feature_gene_ids
+import gene_index as gi
+import instrumentation as ins
+import hashlib
 import re
 import os
 
+# Modalità di spiegazione delle predizioni
+EXPLAIN_MODES = ('none', 'global', 'shap')
+
+# Soglia sulla probabilità della classe positiva (modelli binari)
+DEFAULT_DECISION_THRESHOLD = float(os.getenv('DECISION_THRESHOLD', 0.5))
+
+# Limiti per le spiegazioni SHAP per-sample
+SHAP_CACHE_SIZE = int(os.getenv('SHAP_CACHE_SIZE', 256))      # sample in cache per modello
+SHAP_MAX_BATCH = int(os.getenv('SHAP_MAX_BATCH', 32))         # sample per chiamata ShapValues
+SHAP_MAX_TOP_K = int(os.getenv('SHAP_MAX_TOP_K', 50))         # contributi conservati per sample
+SHAP_CALC_TYPE = os.getenv('SHAP_CALC_TYPE', 'Regular')       # Regular | Approximate | Exact
+
 def extract_gene_id_from_feature(feature_name):
     """
     Estrae l'ID del gene dal nome della feature.
@@ -51,18 +68,8 @@ def load_gene_mapping_from_tsv(tsv_path):
         dict: Dizionario con mappatura gene_id -> gene_name
     """
     try:
-        # Leggi il file TSV
-        df = pd.read_csv(tsv_path, sep='\t', comment='#')
-        
-        # Crea dizionario di mappatura gene_id -> gene_name
-        gene_mapping = {}
-        if 'gene_id' in df.columns and 'gene_name' in df.columns:
-            for _, row in df.iterrows():
-                gene_id = str(row['gene_id'])
-                gene_name = str(row['gene_name'])
-                if gene_id and gene_name and gene_id != 'nan' and gene_name != 'nan':
-                    gene_mapping[gene_id] = gene_name
-        
+        index = gi.GeneIndex.from_tsv(tsv_path)
+        gene_mapping = index.to_dict() if index is not None else {}
         print(f"Caricata mappatura per {len(gene_mapping)} geni dal file TSV")
         return gene_mapping
     
@@ -70,62 +77,37 @@ def load_gene_mapping_from_tsv(tsv_path):
         print(f"Errore nel caricamento del file TSV {tsv_path}: {e}")
         return {}
 
-def map_features_to_gene_names(top_features_df, base_dir):
+def map_features_to_gene_names(top_features_df, base_dir, layout=None):
     """
     Mappa le feature più importanti ai nomi dei geni.
     
     Args:
         top_features_df (pd.DataFrame): DataFrame con le top features
-        base_dir (str): Directory base per trovare i file TSV
+        base_dir (str): Directory base in cui si trova l'indice dei geni
+        layout (FeatureLayout): Layout del modello con gli ID dei geni precalcolati (opzionale)
     
     Returns:
         pd.DataFrame: DataFrame arricchito con colonna 'gene_name'
-    """    # Cerca il file TSV augmented_star_gene_counts
-    tsv_path = None
-    # Nel container Docker, la struttura è /app/assets/data
-    data_dir = os.path.join(base_dir, "assets", "data")
-    
-    print(f"DEBUG: Cercando file TSV in directory: {data_dir}")
-    print(f"DEBUG: Directory esiste: {os.path.exists(data_dir)}")
-    
-    if os.path.exists(data_dir):
-        files = os.listdir(data_dir)
-        print(f"DEBUG: File trovati: {files}")
-        for file in files:
-            if file.endswith("augmented_star_gene_counts.tsv"):
-                tsv_path = os.path.join(data_dir, file)
-                print(f"DEBUG: File TSV trovato: {tsv_path}")
-                break
-    
-    if not tsv_path:
-        print("DEBUG: File TSV augmented_star_gene_counts non trovato")
-        # Aggiungi colonna gene_name uguale alla feature
-        result_df = top_features_df.copy()
-        result_df['gene_name'] = result_df['feature']
-        return result_df
-    else:
-        print(f"DEBUG: Usando file TSV: {tsv_path}")
-        # Carica la mappatura dei geni
-        gene_mapping = load_gene_mapping_from_tsv(tsv_path)
-    
-        # Estrai gli ID dei geni e mappa ai nomi
+    """
+    with ins.span("gene_mapping"):
         result_df = top_features_df.copy()
-        gene_names = []
-    
-        for feature in result_df['feature']:
-            # Estrai l'ID del gene
-            gene_id = extract_gene_id_from_feature(feature)
         
-            # Cerca il nome del gene nella mappatura
-            if gene_id in gene_mapping:
-                gene_name = gene_mapping[gene_id]
-            else:
-                # Se non trova la mappatura, usa l'ID estratto come nome
-                gene_name = gene_id
+        # Indice dei geni persistente, caricato una volta per processo
+        gene_index = gi.get_gene_index(base_dir)
+        if gene_index is None:
+            # Aggiungi colonna gene_name uguale alla feature
+            result_df['gene_name'] = result_df['feature']
+            return result_df
         
-            gene_names.append(gene_name)
-    
-        result_df['gene_name'] = gene_names
+        # Estrai gli ID dei geni (precalcolati nel layout del modello, se disponibile)
+        features = result_df['feature'].to_numpy(dtype=object)
+        if layout is not None:
+            gene_ids = layout.gene_ids_of(features)
+        else:
+            gene_ids = feature_gene_ids(features)
+        
+        # Cerca il nome del gene nell'indice; se non trovato usa l'ID estratto come nome
+        result_df['gene_name'] = gene_index.lookup(gene_ids)
         return result_df
 
 def align_features_with_model(sample_df, model):
@@ -134,61 +116,268 @@ def align_features_with_model(sample_df, model):
     
     Args:
         sample_df (pd.DataFrame): DataFrame con le features del sample
-        model: Modello CatBoost caricato
+        model: Modello caricato dal registro (LoadedModel) oppure modello CatBoost
     
     Returns:
-        pd.DataFrame: DataFrame allineato con le features del modello
+        np.ndarray: Matrice allineata con le features del modello (una riga per sample)
     """
-    try:
-        # Ottieni le feature names dal modello
-        model_features = model.feature_names_
-        
-        # Prepara le colonne da concatenare
-        columns_to_concat = []
-        
-        # Per ogni feature attesa dal modello
-        for feature in model_features:
-            if feature in sample_df.columns:
-                # Se la feature esiste nel sample, usala
-                columns_to_concat.append(sample_df[[feature]])
-            else:
-                # Se la feature non esiste, crea una serie con valore 0
-                zero_series = pd.DataFrame({feature: [0] * len(sample_df)}, index=sample_df.index)
-                columns_to_concat.append(zero_series)
+    # Il piano di allineamento è precalcolato per i modelli del registro
+    layout = getattr(model, 'layout', None)
+    if layout is None:
+        layout = FeatureLayout.from_model(model)
+    
+    with ins.span("alignment"):
+        aligned = layout.align(sample_df, pre.MIRNA_MODALITIES)
+    
+    print(f"Features originali: {len(sample_df.columns)}")
+    print(f"Features attese dal modello: {layout.n_features}")
+    print(f"Features allineate: {aligned.shape[1]}")
+    
+    return aligned
+
+def get_top_feature_ranking(loaded_model, top_features=10, base_dir=None):
+    """
+    Restituisce le top features globali del modello, con i nomi dei geni se base_dir è fornito.
+    
+    La classifica dipende solo dalla versione del modello e viene quindi
+    calcolata una volta e conservata insieme al modello caricato.
+    
+    Args:
+        loaded_model (LoadedModel): Modello ottenuto dal registro
+        top_features (int): Numero di top features
+        base_dir (str): Directory base per trovare i file di mappatura dei geni
+    
+    Returns:
+        pd.DataFrame: Colonne 'feature', 'importance' (e 'gene_name' se base_dir è fornito)
+    """
+    key = (top_features, base_dir)
+    ranking = loaded_model.rankings.get(key)
+    if ranking is None:
+        ranking = loaded_model.importance_df.head(top_features).copy()
+        cacheable = True
+        if base_dir:
+            # Senza indice dei geni i nomi sono gli ID delle feature: non si conservano,
+            # così i nomi vengono usati appena il TSV dei geni diventa disponibile
+            cacheable = gi.get_gene_index(base_dir) is not None
+            ranking = map_features_to_gene_names(ranking, base_dir, loaded_model.layout)
+        if cacheable:
+            loaded_model.rankings[key] = ranking
+    return ranking
+
+def make_pool(loaded_model, aligned):
+    """Crea il Pool CatBoost per una matrice già allineata al layout del modello"""
+    layout = loaded_model.layout
+    return Pool(aligned,
+                cat_features=layout.cat_positions.tolist() if layout.has_cat_features else None,
+                feature_names=layout.feature_names)
+
+def _sample_cache_key(loaded_model, row):
+    """Chiave di cache di un sample allineato: hash del suo contenuto"""
+    layout = loaded_model.layout
+    digest = hashlib.sha1()
+    if layout.has_cat_features:
+        digest.update(np.asarray(row[~layout.is_cat], dtype=np.float32).tobytes())
+        digest.update('\x1f'.join(map(str, row[layout.cat_positions])).encode())
+    else:
+        digest.update(np.ascontiguousarray(row, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+def _sample_values(values):
+    """
+    Valori del sample per le top features, con la precisione del float32 della matrice
+    allineata (5.9904 e non 5.9903998374938965); i valori categorici restano invariati.
+    """
+    return [float(str(np.float32(value))) if isinstance(value, (float, np.floating)) else value
+            for value in values.tolist()]
+
+def _shap_top_contributions(shap_values, max_top_k):
+    """
+    Riduce una matrice di SHAP values ai contributi più grandi in valore assoluto.
+    
+    Args:
+        shap_values (np.ndarray): SHAP values (n_sample x n_features+1) o
+            (n_sample x n_classi x n_features+1) per modelli multiclasse
+        max_top_k (int): Numero massimo di contributi da conservare
+    
+    Returns:
+        list: Per ogni sample una tupla (indici, contributi, expected_value)
+    """
+    if shap_values.ndim == 3:
+        # Multiclasse: spiega la classe con valore grezzo più alto
+        raw = shap_values.sum(axis=2)
+        predicted = raw.argmax(axis=1)
+        shap_values = shap_values[np.arange(len(shap_values)), predicted]
+    
+    contributions = shap_values[:, :-1]
+    expected_values = shap_values[:, -1]
+    k = min(max_top_k, contributions.shape[1])
+    
+    results = []
+    for row, expected_value in zip(contributions, expected_values):
+        abs_row = np.abs(row)
+        top_idx = np.argpartition(-abs_row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+        top_idx = top_idx[np.argsort(-abs_row[top_idx], kind='stable')]
+        results.append((top_idx, row[top_idx], float(expected_value)))
+    return results
+
+def explain_samples_shap(loaded_model, aligned, top_features=10, pool=None):
+    """
+    Calcola le spiegazioni SHAP per-sample limitandosi alle top-K features.
+    
+    I sample già spiegati vengono serviti dalla cache LRU del modello; i restanti
+    vengono calcolati insieme, in blocchi da SHAP_MAX_BATCH sample per chiamata.
+    
+    Args:
+        loaded_model (LoadedModel): Modello ottenuto dal registro
+        aligned (np.ndarray): Matrice allineata (una riga per sample)
+        top_features (int): Numero di contributi da restituire per sample
+        pool (Pool): Pool già costruito per `aligned`, riutilizzato se fornito
+    
+    Returns:
+        list: Per ogni sample un dict con 'top_features' (DataFrame) e 'expected_value'
+    """
+    top_features = min(top_features, SHAP_MAX_TOP_K)
+    keys = [_sample_cache_key(loaded_model, row) for row in aligned]
+    
+    explanations = [None] * len(aligned)
+    with loaded_model.shap_lock:
+        for i, key in enumerate(keys):
+            if key in loaded_model.shap_cache:
+                loaded_model.shap_cache.move_to_end(key)
+                explanations[i] = loaded_model.shap_cache[key]
+    
+    missing = [i for i, explanation in enumerate(explanations) if explanation is None]
+    for start in range(0, len(missing), SHAP_MAX_BATCH):
+        chunk = missing[start:start + SHAP_MAX_BATCH]
+        chunk_pool = pool.slice(chunk) if pool is not None else make_pool(loaded_model, aligned[chunk])
+        shap_values = loaded_model.model.get_feature_importance(
+            data=chunk_pool,
+            type='ShapValues',
+            shap_calc_type=SHAP_CALC_TYPE,
+            thread_count=loaded_model.thread_count
+        )
+        computed = _shap_top_contributions(np.asarray(shap_values), SHAP_MAX_TOP_K)
+        with loaded_model.shap_lock:
+            for i, explanation in zip(chunk, computed):
+                explanations[i] = explanation
+                loaded_model.shap_cache[keys[i]] = explanation
+                loaded_model.shap_cache.move_to_end(keys[i])
+            while len(loaded_model.shap_cache) > SHAP_CACHE_SIZE:
+                loaded_model.shap_cache.popitem(last=False)
+    
+    feature_names = np.asarray(loaded_model.layout.feature_names, dtype=object)
+    results = []
+    for row, (top_idx, contributions, expected_value) in zip(aligned, explanations):
+        top_idx = top_idx[:top_features]
+        results.append({
+            'top_features': pd.DataFrame({
+                'feature': feature_names[top_idx],
+                'importance': contributions[:top_features],
+                'sample_value': _sample_values(row[top_idx])
+            }),
+            'expected_value': expected_value
+        })
+    return results
+
+def decide_classes(probabilities, threshold=None):
+    """
+    Deriva le classi predette dalle probabilità.
+    
+    Per i modelli binari la classe positiva viene scelta se la sua probabilità
+    supera la soglia di decisione; per i multiclasse si usa la più probabile.
+    
+    Args:
+        probabilities (np.ndarray): Output di predict_proba (n_sample x n_classi)
+        threshold (float): Soglia di decisione (default DECISION_THRESHOLD)
+    
+    Returns:
+        np.ndarray: Indici delle classi predette (posizioni in loaded_model.classes)
+    """
+    if threshold is None:
+        threshold = DEFAULT_DECISION_THRESHOLD
+    if probabilities.shape[1] == 2:
+        return (probabilities[:, 1] >= threshold).astype(np.intp)
+    return probabilities.argmax(axis=1)
+
+def _predict_aligned(loaded_model, aligned, top_features=10, base_dir=None, explain='global', threshold=None):
+    """
+    Effettua la predizione su una matrice già allineata con una sola valutazione del modello.
+    
+    Args:
+        loaded_model (LoadedModel): Modello ottenuto dal registro
+        aligned (np.ndarray): Matrice allineata (una riga per sample)
+        top_features (int): Numero di top features da restituire
+        base_dir (str): Directory base per trovare i file di mappatura dei geni
+        explain (str): 'none', 'global' o 'shap'
+        threshold (float): Soglia di decisione per i modelli binari
+    
+    Returns:
+        list: Un dict di risultati per ogni riga, nello stesso ordine
+    """
+    if explain not in EXPLAIN_MODES:
+        raise ValueError(f"Modalità di spiegazione non valida: {explain} (ammesse: {', '.join(EXPLAIN_MODES)})")
+    
+    with ins.span("model_evaluation"):
+        # Un solo Pool, riutilizzato per probabilità e spiegazioni SHAP
+        pool = make_pool(loaded_model, aligned)
         
-        # Concatena tutte le colonne in una volta sola per evitare frammentazione
-        if columns_to_concat:
-            aligned_df = pd.concat(columns_to_concat, axis=1)
-        else:
-            aligned_df = pd.DataFrame(index=sample_df.index)
+        # Una sola valutazione del modello: la classe deriva dalle probabilità
+        predictions_proba = loaded_model.model.predict_proba(pool, thread_count=loaded_model.thread_count)
+        class_indices = decide_classes(predictions_proba, threshold)
+        predictions = loaded_model.classes[class_indices]
+    
+    with ins.span("importance"):
+        if explain == 'global':
+            # Feature importance e classifica sono precalcolate per la versione del modello:
+            # per ogni sample si aggiungono solo i valori delle top features
+            ranking = get_top_feature_ranking(loaded_model, top_features, base_dir)
+            top_idx = loaded_model.importance_order[:len(ranking)]
+        elif explain == 'shap':
+            explanations = explain_samples_shap(loaded_model, aligned, top_features, pool)
+    
+    results = []
+    for i, (prediction, prediction_proba) in enumerate(zip(predictions, predictions_proba)):
+        result = {
+            'prediction': prediction,
+            'prediction_probability': prediction_proba,
+            'predicted_class': int(prediction),
+            'confidence': float(prediction_proba[class_indices[i]]),
+            'explanation': explain,
+            'top_features': pd.DataFrame(columns=['feature', 'importance', 'sample_value']),
+            'sample_info': {
+                'total_features': loaded_model.layout.n_features,
+                'sample_shape': (1, aligned.shape[1]),
+                'features_aligned': True
+            }
+        }
         
-        print(f"Features originali: {len(sample_df.columns)}")
-        print(f"Features attese dal modello: {len(model_features)}")
-        print(f"Features allineate: {len(aligned_df.columns)}")
+        if explain == 'global':
+            top_features_df = ranking[['feature', 'importance']].copy()
+            top_features_df['sample_value'] = _sample_values(aligned[i, top_idx])
+            result['top_features'] = top_features_df
+            result['all_feature_importance'] = loaded_model.importance_df
+            
+            # Aggiungi mappatura dei nomi dei geni se base_dir è fornito
+            if base_dir:
+                mapped_features = top_features_df.copy()
+                mapped_features['gene_name'] = ranking['gene_name'].values
+                result['top_features_with_gene_names'] = mapped_features
         
-        return aligned_df
+        elif explain == 'shap':
+            # Contributi SHAP del sample (importance = contributo al valore grezzo del modello)
+            result['top_features'] = explanations[i]['top_features']
+            result['shap_expected_value'] = explanations[i]['expected_value']
+            
+            if base_dir:
+                result['top_features_with_gene_names'] = map_features_to_gene_names(
+                    explanations[i]['top_features'], base_dir, loaded_model.layout)
         
-    except Exception as e:
-        print(f"Errore nell'allineamento delle features: {e}")
-        # Fallback: usa le prime N features del sample dove N è il numero atteso dal modello
-        try:
-            expected_features = len(model.feature_names_)
-            if len(sample_df.columns) > expected_features:
-                print(f"Troncando da {len(sample_df.columns)} a {expected_features} features")
-                return sample_df.iloc[:, :expected_features]
-            elif len(sample_df.columns) < expected_features:
-                print(f"Padding da {len(sample_df.columns)} a {expected_features} features")
-                # Aggiungi colonne mancanti con valore 0
-                missing_cols = expected_features - len(sample_df.columns)
-                for i in range(missing_cols):
-                    sample_df[f'missing_feature_{i}'] = 0
-                return sample_df
-            else:
-                return sample_df
-        except:
-            return sample_df
+        results.append(result)
+    
+    return results
 
-def load_and_predict_from_dataframe(model_path, sample_df, top_features=10, base_dir=None):
+def load_and_predict_from_dataframe(model_path, sample_df, top_features=10, base_dir=None, explain='global',
+                                    threshold=None):
     """
     Carica un modello CatBoost e effettua predizione su un singolo sample da DataFrame
     
@@ -197,75 +386,69 @@ def load_and_predict_from_dataframe(model_path, sample_df, top_features=10, base
         sample_df (pd.DataFrame): DataFrame contenente un singolo sample (1 riga)
         top_features (int): Numero di top features da restituire
         base_dir (str): Directory base per trovare i file di mappatura dei geni
+        explain (str): 'none' (nessuna spiegazione), 'global' (feature importance
+            del modello) o 'shap' (contributi SHAP del sample)
+        threshold (float): Soglia di decisione per i modelli binari (default DECISION_THRESHOLD)
     
     Returns:
         dict: Risultati della predizione e feature importance con nomi dei geni
     """
-    # Carica il modello
-    model = CatBoostClassifier()
-    model.load_model(model_path)
+    # Ottieni il modello dal registro di processo (caricato una sola volta per versione)
+    loaded_model = mr.get_model(model_path)
     
     # Verifica che sia un singolo sample
     if len(sample_df) != 1:
         raise ValueError("Il DataFrame deve contenere esattamente un sample (1 riga)")
-      # Allinea le features con quelle attese dal modello
-    aligned_df = align_features_with_model(sample_df, model)
-    aligned_df = pre.check_and_replace_nan_in_dataframe(aligned_df)
     
-    # Gestisci specificamente i NaN per le categorical features di CatBoost
-    # Ottieni gli indici delle categorical features dal modello
-    try:
-        cat_features = model.get_cat_feature_indices()
-        if cat_features:
-            print(f"Trovate {len(cat_features)} categorical features nel modello")
-            for cat_idx in cat_features:
-                if cat_idx < len(aligned_df.columns):
-                    col_name = aligned_df.columns[cat_idx]
-                    # Converti NaN a stringa per le categorical features
-                    aligned_df[col_name] = aligned_df[col_name].fillna("missing").astype(str)
-    except Exception as e:
-        print(f"Avviso: Impossibile ottenere categorical features dal modello: {e}")
-        # Fallback: converti tutti i NaN rimanenti a 0 per sicurezza
-        aligned_df = aligned_df.fillna(0)
+    # Allinea le features con quelle attese dal modello
+    # (i NaN delle categorical features diventano "missing" durante l'allineamento)
+    aligned = align_features_with_model(sample_df, loaded_model)
+    
+    return _predict_aligned(loaded_model, aligned, top_features, base_dir, explain, threshold)[0]
 
-    # Effettua la predizione usando le features allineate
-    prediction = model.predict(aligned_df)[0]
-    prediction_proba = model.predict_proba(aligned_df)[0]
-    
-    # Ottieni feature importance
-    feature_importance = model.get_feature_importance()
-    feature_names = aligned_df.columns.tolist()
-    
-    # Crea DataFrame con feature importance
-    importance_df = pd.DataFrame({
-        'feature': feature_names,
-        'importance': feature_importance,
-        'sample_value': aligned_df.iloc[0].values
-    }).sort_values('importance', ascending=False)
-      # Seleziona top features
-    top_features_df = importance_df.head(top_features)
+def predict_batch(samples, model_path, top_features=10, base_dir=None, explain='global', patient_ids=None,
+                  threshold=None):
+    """
+    Effettua la predizione su più pazienti con una sola chiamata vettorizzata al modello.
     
-    # Mappa le feature ai nomi dei geni se base_dir è fornito
-    result = {
-        'prediction': prediction,
-        'prediction_probability': prediction_proba,
-        'predicted_class': int(prediction),
-        'confidence': float(prediction_proba.max()),
-        'top_features': top_features_df,
-        'all_feature_importance': importance_df,
-        'sample_info': {
-            'total_features': len(feature_names),
-            'sample_shape': aligned_df.shape,
-            'features_aligned': True
-        }
-    }
+    Args:
+        samples (pd.DataFrame | np.ndarray): DataFrame con un paziente per riga
+            (l'indice viene usato come patient_id) oppure matrice già allineata
+            al layout del modello
+        model_path (str | LoadedModel): Percorso del file .cbm oppure modello già
+            ottenuto dal registro (da usare se la matrice è stata costruita con il suo layout)
+        top_features (int): Numero di top features da restituire per paziente
+        base_dir (str): Directory base per trovare i file di mappatura dei geni
+        explain (str): 'none', 'global' o 'shap'
+        patient_ids (list): Identificativi dei pazienti (default: indice del DataFrame)
+        threshold (float): Soglia di decisione per i modelli binari (default DECISION_THRESHOLD)
     
-    # Aggiungi mappatura dei nomi dei geni se base_dir è fornito
-    if base_dir:
-        mapped_features = map_features_to_gene_names(top_features_df, base_dir)
-        result['top_features_with_gene_names'] = mapped_features
+    Returns:
+        list: Risultati per paziente, nello stesso ordine dei sample, con chiave 'patient_id'
+    """
+    loaded_model = model_path if isinstance(model_path, mr.LoadedModel) else mr.get_model(model_path)
+    
+    if isinstance(samples, pd.DataFrame):
+        if patient_ids is None:
+            patient_ids = samples.index.tolist()
+        aligned = align_features_with_model(samples, loaded_model)
+    else:
+        aligned = np.asarray(samples)
+        if aligned.ndim != 2 or aligned.shape[1] != loaded_model.layout.n_features:
+            raise ValueError(f"La matrice deve avere {loaded_model.layout.n_features} colonne allineate al modello")
     
-    return result
+    if patient_ids is None:
+        patient_ids = list(range(len(aligned)))
+    if len(patient_ids) != len(aligned):
+        raise ValueError("Il numero di patient_ids non corrisponde al numero di sample")
+    
+    if len(aligned) == 0:
+        return []
+    
+    results = _predict_aligned(loaded_model, aligned, top_features, base_dir, explain, threshold)
+    for patient_id, result in zip(patient_ids, results):
+        result['patient_id'] = patient_id
+    return results
 
 def predict_and_explain(model_path, sample_df, show_top=15, base_dir=None):
     """
@@ -277,7 +460,7 @@ def predict_and_explain(model_path, sample_df, show_top=15, base_dir=None):
         show_top (int): Numero di feature da mostrare
         base_dir (str): Directory base per trovare il file TSV (opzionale)
     """
-    results = load_and_predict_from_dataframe(model_path, sample_df, show_top)
+    results = load_and_predict_from_dataframe(model_path, sample_df, show_top, base_dir)
     
     print(f"Predizione: Classe {results['predicted_class']}")
     print(f"Confidenza: {results['confidence']:.4f}")
@@ -285,7 +468,7 @@ def predict_and_explain(model_path, sample_df, show_top=15, base_dir=None):
     print(f"Numero totale di features: {results['sample_info']['total_features']}")
     # Mappa le feature ai nomi dei geni se base_dir è fornito
     if base_dir:
-        mapped_features = map_features_to_gene_names(results['top_features'], base_dir)
+        mapped_features = results['top_features_with_gene_names']
         print(f"\nTop {show_top} features più importanti (con nomi geni):")
         
         # Configura pandas per mostrare tutte le colonne
@@ -294,7 +477,6 @@ def predict_and_explain(model_path, sample_df, show_top=15, base_dir=None):
         pd.set_option('display.max_colwidth', None)
         
         print(mapped_features[['feature', 'gene_name', 'importance', 'sample_value']])
-        results['top_features_with_gene_names'] = mapped_features
     else:
         print(f"\nTop {show_top} features più importanti:")
         
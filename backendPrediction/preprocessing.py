@@ -1,21 +1,42 @@
 # Functions to reader csv files and process gene expression, miRNA isoform, and miRNA aggregate data
 
 import pandas as pd
+import functools
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import numpy as np
-import string
+
+from feature_layout import FeatureLayout, isoform_suffix_table
+import parse_cache as pc
+import feature_store as fs
+import instrumentation as ins
 
 
 def check_and_replace_nan_in_dataframe(df):
     """
     Sostituisce i valori NaN con "missing" nelle colonne di tipo stringa/object.
     """
-    for column in df.columns:
-        if df[column].dtype == 'object':  # Colonne di tipo stringa
-            df[column] = df[column].fillna("missing")
+    with ins.span("nan_handling"):
+        for column in df.columns:
+            if df[column].dtype == 'object':  # Colonne di tipo stringa
+                df[column] = df[column].fillna("missing")
     return df
 
+# Colonne del file STAR usate come feature
+GENE_FEATURE_COLUMNS = ["unstranded", "stranded_first", "stranded_second", "tpm_unstranded", "fpkm_unstranded", "fpkm_uq_unstranded"]
+# Tipi delle colonne lette dal parser colonnare
+GENE_DTYPES = {"gene_id": str, **{feature: np.float32 for feature in GENE_FEATURE_COLUMNS}}
+# Righe lette per blocco dal parser colonnare
+GENE_READ_CHUNKSIZE = 20000
+# Colonne del file delle isoforme usate come feature
+MIRNA_ISO_FEATURE_COLUMNS = ["read_count", "reads_per_million_miRNA_mapped", "miRNA_region"]
+# Colonne del file dei miRNA aggregati usate come feature
+MIRNA_AGG_FEATURE_COLUMNS = ["read_count", "reads_per_million_miRNA_mapped"]
+# Modalità che possono mancare per un paziente (le sue feature valgono allora NaN)
+MIRNA_MODALITIES = ("mirna_iso", "mirna_agg")
+
 def process_gene_expression(file_path, prefix="gene"):
     """
     Elabora il file di espressione genica e lo converte in una singola riga.
@@ -27,7 +48,7 @@ def process_gene_expression(file_path, prefix="gene"):
         df = df[~df['gene_id'].str.startswith('N_')]
     
     # Mantieni solo le colonne che ci interessano
-    feature_columns = ["unstranded", "stranded_first", "stranded_second", "tpm_unstranded", "fpkm_unstranded", "fpkm_uq_unstranded"]
+    feature_columns = GENE_FEATURE_COLUMNS
     required_cols = ["gene_id"] + feature_columns
     
     # Verifica che le colonne esistano
@@ -65,75 +86,186 @@ def process_gene_expression(file_path, prefix="gene"):
     
     return row_data
 
+def gene_expression_columns(columns, file_path):
+    """Verifica l'intestazione di un file STAR; restituisce le colonne lette dal parser colonnare"""
+    missing_cols = set(["gene_id"] + GENE_FEATURE_COLUMNS) - set(columns)
+    if missing_cols:
+        raise ValueError(f"Colonne mancanti nel file {file_path}: {missing_cols}")
+    return ["gene_id"] + GENE_FEATURE_COLUMNS
+
+def gene_rows_seen(layout, prefix="gene"):
+    """
+    Maschera delle chiavi già scritte per leggere un file STAR a blocchi (vedi
+    FeatureLayout.scatter_keyed): le righe N_* (statistiche di mapping) partono
+    già segnate e non vengono scritte nemmeno se il modello ha una feature con quel nome.
+    """
+    return layout.key_prefix_mask(prefix, GENE_FEATURE_COLUMNS, "N_").copy()
+
+def fill_gene_expression(file_path, layout, num_row, cat_row=None, prefix="gene", compression='infer'):
+    """
+    Elabora il file di espressione genica scrivendo i valori direttamente nella riga del modello.
+    
+    Legge solo gene_id e le colonne delle feature, con dtype espliciti e a blocchi,
+    e usa l'indice dei geni del layout: non vengono costruite chiavi stringa per gene.
+    In caso di gene_id duplicati vale la prima occorrenza, come in process_gene_expression.
+    
+    Args:
+        file_path (str): Percorso del file augmented_star_gene_counts
+        layout (FeatureLayout): Layout delle feature del modello
+        num_row (np.ndarray): Riga float32 del paziente da riempire
+        cat_row (np.ndarray): Riga delle feature categoriche (non usata: nessuna feature categorica)
+        prefix (str): Prefisso delle feature di espressione genica
+        compression (str): Compressione del file per pandas ('infer' la ricava dal nome)
+    
+    Returns:
+        int: Numero di geni del file riconosciuti dal modello
+    """
+    header = pd.read_csv(file_path, sep='\t', comment='#', nrows=0, compression=compression)
+    usecols = gene_expression_columns(header.columns, file_path)
+    
+    # Le righe N_* (statistiche di mapping) vengono scartate, come in process_gene_expression
+    seen = gene_rows_seen(layout, prefix)
+    matched = 0
+    
+    reader = pd.read_csv(file_path, sep='\t', comment='#', usecols=usecols, compression=compression,
+                         dtype=GENE_DTYPES, chunksize=GENE_READ_CHUNKSIZE)
+    for chunk in reader:
+        gene_ids = chunk["gene_id"].to_numpy(dtype=object)
+        values = chunk[GENE_FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+        matched += layout.scatter_keyed(prefix, GENE_FEATURE_COLUMNS, gene_ids, values, num_row, seen=seen)
+    
+    return matched
+
+def mirna_isoform_columns(columns, file_path):
+    """
+    Individua le colonne di un file di isoforme a partire dalla sua intestazione.
+    
+    Returns:
+        tuple: (colonna degli ID miRNA, colonne richieste, colonne feature presenti)
+    """
+    columns = list(columns)
+    # Adatta i nomi delle colonne in base al formato del file
+    if "isoform_coords" in columns:
+        id_col = "miRNA_ID"
+        coord_col = "isoform_coords"
+    else:
+        # Adatta per potenziali differenze nel formato del file
+        id_col = next((col for col in columns if "miRNA" in col or "mirna" in col), "miRNA_ID")
+        coord_col = next((col for col in columns if "coord" in col), "isoform_coords")
+    
+    feature_columns = [col for col in MIRNA_ISO_FEATURE_COLUMNS if col in columns]
+    required_cols = [id_col, coord_col] + feature_columns
+    
+    # Verifica che le colonne esistano
+    if not all(col in columns for col in required_cols):
+        # Stampa le colonne disponibili per debugging
+        print(f"Colonne disponibili: {columns}")
+        missing = [col for col in required_cols if col not in columns]
+        raise ValueError(f"Colonne mancanti nel file {file_path}: {missing}")
+    return id_col, required_cols, feature_columns
+
+def _read_mirna_isoform(file_path, compression='infer'):
+    """
+    Legge il file dei miRNA a livello di isoforma.
+    
+    Returns:
+        tuple: (DataFrame senza righe NA, colonna degli ID miRNA, colonne feature presenti)
+    """
+    # Leggi il file
+    df = pd.read_csv(file_path, sep='\t', comment='#', compression=compression)
+    id_col, required_cols, feature_columns = mirna_isoform_columns(df.columns, file_path)
+    
+    # Filtra e rimuovi NA
+    df = df[required_cols].dropna()
+    return df, id_col, feature_columns
+
+def isoform_ordinals(ids):
+    """Ordinale di ogni riga tra le isoforme dello stesso miRNA (0, 1, 2... nell'ordine del file)"""
+    return ids.groupby(ids, sort=False).cumcount().to_numpy()
+
+# Tabella dei suffissi precalcolata, estesa solo per miRNA con moltissime isoforme
+_isoform_suffixes = isoform_suffix_table(26 * 4)
+
+def isoform_suffixes(ordinals):
+    """Suffissi alfabetici ('a'..'z', 'a1'...) per gli ordinali delle isoforme"""
+    global _isoform_suffixes
+    if len(ordinals) and ordinals.max() >= len(_isoform_suffixes):
+        _isoform_suffixes = isoform_suffix_table(2 * (int(ordinals.max()) + 1))
+    return _isoform_suffixes[ordinals]
+
 def process_mirna_isoform(file_path, prefix="mirna_iso"):
     """
     Elabora il file dei miRNA a livello di isoforma con identificatori unici basati su lettere alfabetiche.
     """
     try:
-        # Leggi il file
-        df = pd.read_csv(file_path, sep='\t', comment='#')
-        
-        # Mantieni solo le colonne che ci interessano
-        feature_columns = ["read_count", "reads_per_million_miRNA_mapped", "miRNA_region"]
-        
-        # Adatta i nomi delle colonne in base al formato del file
-        if "isoform_coords" in df.columns:
-            id_col = "miRNA_ID"
-            coord_col = "isoform_coords"
-        else:
-            # Adatta per potenziali differenze nel formato del file
-            id_col = next((col for col in df.columns if "miRNA" in col or "mirna" in col), "miRNA_ID")
-            coord_col = next((col for col in df.columns if "coord" in col), "isoform_coords")
-        
-        required_cols = [id_col, coord_col] + [col for col in feature_columns if col in df.columns]
-        
-        # Verifica che le colonne esistano
-        if not all(col in df.columns for col in required_cols):
-            # Stampa le colonne disponibili per debugging
-            print(f"Colonne disponibili: {df.columns.tolist()}")
-            missing = [col for col in required_cols if col not in df.columns]
-            raise ValueError(f"Colonne mancanti nel file {file_path}: {missing}")
-        
-        # Filtra e rimuovi NA
-        df = df[required_cols].dropna()
+        df, id_col, feature_columns = _read_mirna_isoform(file_path)
         
         # Aggiungi una lettera alfabetica per rendere ogni riga univoca per miRNA_ID
-        df['unique_suffix'] = (
-            df.groupby(id_col).cumcount().apply(lambda x: string.ascii_lowercase[x % 26] + (str(x // 26) if x >= 26 else ""))
-        )
-        df['unique_id'] = df[id_col] + "_" + df['unique_suffix']
+        unique_ids = df[id_col].to_numpy(dtype=object) + "_" + isoform_suffixes(isoform_ordinals(df[id_col]))
         
         # Crea il dizionario dei dati
         row_data = {}
         for feature in feature_columns:
-            if feature in df.columns:
-                feature_series = df.set_index('unique_id')[feature]
-                feature_series.index = [f"{prefix}_{id}|{feature}" for id in feature_series.index]
-                row_data.update(feature_series.to_dict())
+            feature_keys = prefix + "_" + unique_ids + "|" + feature
+            row_data.update(zip(feature_keys.tolist(), df[feature].tolist()))
         
         return row_data
     except Exception as e:
         print(f"Errore durante l'elaborazione del file {file_path}: {e}")
         raise
 
-def process_mirna_aggregate(file_path, prefix="mirna_agg"):
-    """
-    Elabora il file dei miRNA aggregati.
+def fill_mirna_isoform(file_path, layout, num_row, cat_row, prefix="mirna_iso", compression='infer'):
     """
-    df = pd.read_csv(file_path, sep='\t', comment='#')
+    Elabora il file delle isoforme scrivendo i valori direttamente nella riga del modello.
     
-    # Mantieni solo le colonne che ci interessano
-    feature_columns = ["read_count", "reads_per_million_miRNA_mapped"]
+    Le isoforme sono identificate dal codice del miRNA e dall'ordinale dell'isoforma
+    (vedi FeatureLayout.isoform_index): non vengono costruiti suffissi né chiavi stringa.
     
+    Args:
+        file_path (str): Percorso del file isoforms.quantification
+        layout (FeatureLayout): Layout delle feature del modello
+        num_row (np.ndarray): Riga float32 del paziente da riempire
+        cat_row (np.ndarray): Riga delle feature categoriche del paziente
+        prefix (str): Prefisso delle feature delle isoforme
+        compression (str): Compressione del file per pandas ('infer' la ricava dal nome)
+    
+    Returns:
+        int: Numero di isoforme del file riconosciute dal modello
+    """
+    df, id_col, feature_columns = _read_mirna_isoform(file_path, compression)
+    values = df[feature_columns].to_numpy(dtype=object)
+    return layout.scatter_isoforms(prefix, feature_columns, df[id_col].to_numpy(dtype=object),
+                                   isoform_ordinals(df[id_col]), values, num_row, cat_row)
+
+def mirna_aggregate_columns(columns, file_path):
+    """
+    Individua le colonne di un file di miRNA aggregati a partire dalla sua intestazione.
+    
+    Returns:
+        tuple: (colonna degli ID miRNA, colonne feature presenti)
+    """
+    columns = list(columns)
     # Adatta i nomi delle colonne in base al formato del file
-    id_col = next((col for col in df.columns if "miRNA" in col or "mirna" in col), "miRNA_ID")
-    required_cols = [id_col] + [col for col in feature_columns if col in df.columns]
+    id_col = next((col for col in columns if "miRNA" in col or "mirna" in col), "miRNA_ID")
+    feature_columns = [col for col in MIRNA_AGG_FEATURE_COLUMNS if col in columns]
+    required_cols = [id_col] + feature_columns
     
     # Verifica che le colonne esistano
-    if not all(col in df.columns for col in required_cols):
-        print(f"Colonne disponibili: {df.columns.tolist()}")
-        missing = [col for col in required_cols if col not in df.columns]
+    if not all(col in columns for col in required_cols):
+        print(f"Colonne disponibili: {columns}")
+        missing = [col for col in required_cols if col not in columns]
         raise ValueError(f"Colonne mancanti nel file {file_path}: {missing}")
+    return id_col, feature_columns
+
+def _read_mirna_aggregate(file_path, compression='infer'):
+    """
+    Legge il file dei miRNA aggregati.
+    
+    Returns:
+        tuple: (DataFrame senza miRNA duplicati, colonna degli ID miRNA, colonne feature presenti)
+    """
+    df = pd.read_csv(file_path, sep='\t', comment='#', compression=compression)
+    id_col, feature_columns = mirna_aggregate_columns(df.columns, file_path)
     
     # Filtra e rimuovi NA
     #df = df[required_cols].dropna()
@@ -145,19 +277,419 @@ def process_mirna_aggregate(file_path, prefix="mirna_agg"):
         print(f"miRNA_ID duplicati in {file_path}: {', '.join(duplicate_values)}")
         df = df.drop_duplicates(subset=[id_col])
     
+    return df, id_col, feature_columns
+
+def process_mirna_aggregate(file_path, prefix="mirna_agg"):
+    """
+    Elabora il file dei miRNA aggregati.
+    """
+    df, id_col, feature_columns = _read_mirna_aggregate(file_path)
+    
     # Crea il dizionario dei dati
     row_data = {}
     for feature in feature_columns:
-        if feature in df.columns:
-            feature_series = df.set_index(id_col)[feature]
-            feature_series.index = [f"{prefix}_{id}|{feature}" for id in feature_series.index]
-            row_data.update(feature_series.to_dict())
+        feature_series = df.set_index(id_col)[feature]
+        feature_series.index = [f"{prefix}_{id}|{feature}" for id in feature_series.index]
+        row_data.update(feature_series.to_dict())
     
     return row_data
 
+def fill_mirna_aggregate(file_path, layout, num_row, cat_row=None, prefix="mirna_agg", compression='infer'):
+    """
+    Elabora il file dei miRNA aggregati scrivendo i valori direttamente nella riga del modello.
+    
+    Returns:
+        int: Numero di miRNA del file riconosciuti dal modello
+    """
+    df, id_col, feature_columns = _read_mirna_aggregate(file_path, compression)
+    values = df[feature_columns].to_numpy(dtype=object)
+    return layout.scatter_keyed(prefix, feature_columns, df[id_col].to_numpy(dtype=object),
+                                values, num_row, cat_row)
+
+
+def file_type_from_name(path):
+    """
+    Tipo di un singolo file in base al nome, con gli stessi pattern di classify_patient_files.
+    
+    Returns:
+        str: "gene_expr", "mirna_iso", "mirna_agg" oppure None (file wxs o non riconosciuto)
+    """
+    if ".wxs." in path:
+        return None
+    if "rna_seq" in path or "gene_counts" in path or "star_gene" in path:
+        return "gene_expr"
+    if "isoforms" in path or "isoform" in path:
+        return "mirna_iso"
+    if "mirnas" in path or "mirna" in path:
+        return "mirna_agg"
+    return None
+
+def classify_patient_files(file_paths, base_dir):
+    """
+    Filtra i file wxs e organizza i file di un paziente per tipo.
+    
+    Returns:
+        tuple: (gene_expr_file, mirna_iso_file, mirna_agg_file), None se mancante
+    """
+    gene_expr_file = None
+    mirna_iso_file = None
+    mirna_agg_file = None
+    
+    for path in file_paths:
+        # Salta i file wxs
+        if ".wxs." in path:
+            continue
+        # Identifica il tipo di file in base ai pattern nel nome
+        if (("rna_seq" in path or "gene_counts" in path or "star_gene" in path) and 
+            not gene_expr_file):
+            gene_expr_file = os.path.join(base_dir, path)
+        elif (("isoforms" in path or "isoform" in path) and 
+            not mirna_iso_file):
+            mirna_iso_file = os.path.join(base_dir, path)
+        elif ((("mirnas" in path or "mirna" in path) and "isoform" not in path) and 
+            not mirna_agg_file):
+            mirna_agg_file = os.path.join(base_dir, path)
+    
+    return gene_expr_file, mirna_iso_file, mirna_agg_file
+
+
+# Processi usati per il preprocessing dei pazienti (1 = elaborazione seriale)
+PREPROCESSING_WORKERS = int(os.getenv('PREPROCESSING_WORKERS', 1))
+# Oltre questa dimensione la matrice della coorte viene scritta su un file .npy mappato in memoria
+COHORT_MAX_MEMORY_BYTES = int(os.getenv('COHORT_MAX_MEMORY_BYTES', 4 * 1024 ** 3))
+
+def _patient_error(patient_id, category, file_type, error, skipped):
+    """Voce dell'elenco strutturato degli errori di preprocessing"""
+    return {
+        "patient_id": patient_id,
+        "category": category,
+        "file_type": file_type,
+        "error": str(error),
+        "skipped": skipped,
+    }
+
+def _patient_tasks(data, base_dir):
+    """Elenco (category, patient_id, file_paths, base_dir) nell'ordine dei pazienti nel JSON"""
+    return [(category, patient_id, file_paths, base_dir)
+            for category, patients in data.items()
+            for patient_id, file_paths in patients.items()]
+
+# Layout usato dai processi del pool, impostato dall'initializer
+_worker_layout = None
+
+def _init_patient_worker(layout):
+    global _worker_layout
+    _worker_layout = layout
+
+def patient_pool(workers, layout):
+    """
+    Pool di processi per l'elaborazione dei pazienti, riutilizzabile tra più coorti
+    con lo stesso layout (il layout viene inviato a ogni processo una sola volta).
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_patient_worker, initargs=(layout,))
+
+def _map_patients(function, tasks, workers, chunksize=None, desc="Elaborazione pazienti", layout=None, executor=None,
+                  **kwargs):
+    """
+    Applica function(task, layout, **kwargs) a ogni paziente, restituendo i risultati nell'ordine dei task.
+    
+    Con workers > 1 i pazienti vengono distribuiti a blocchi di chunksize su un pool
+    di processi (executor, se fornito, altrimenti uno creato per questa chiamata);
+    map restituisce comunque i risultati nell'ordine dei pazienti.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tqdm(tasks, desc=desc):
+            yield function(task, layout, **kwargs)
+        return
+    
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+    if executor is not None:
+        yield from tqdm(executor.map(function, tasks, chunksize=chunksize), total=len(tasks), desc=desc)
+        return
+    with patient_pool(min(workers, len(tasks)), layout) as executor:
+        yield from tqdm(executor.map(function, tasks, chunksize=chunksize), total=len(tasks), desc=desc)
+
+def _gene_expression_ids(file_path):
+    """gene_id del file STAR nell'ordine del file, senza righe N_ e senza duplicati"""
+    header = pd.read_csv(file_path, sep='\t', comment='#', nrows=0)
+    gene_expression_columns(header.columns, file_path)
+    gene_ids = pd.read_csv(file_path, sep='\t', comment='#', usecols=["gene_id"], dtype={"gene_id": str})["gene_id"]
+    gene_ids = gene_ids[~gene_ids.str.startswith('N_', na=False)]
+    return gene_ids.drop_duplicates().to_numpy(dtype=object)
+
+def _modality_feature_names(file_type, file_path):
+    """Nomi delle feature prodotti da un file, nello stesso ordine dei parser a dizionario"""
+    if file_type == "gene_expr":
+        prefix, columns = "gene", GENE_FEATURE_COLUMNS
+        ids = _gene_expression_ids(file_path)
+    elif file_type == "mirna_iso":
+        df, id_col, columns = _read_mirna_isoform(file_path)
+        prefix = "mirna_iso"
+        ids = df[id_col].to_numpy(dtype=object) + "_" + isoform_suffixes(isoform_ordinals(df[id_col]))
+    else:
+        df, id_col, columns = _read_mirna_aggregate(file_path)
+        prefix = "mirna_agg"
+        ids = df[id_col].to_numpy(dtype=object)
+    ids = np.asarray([str(id) for id in ids], dtype=object)
+    return [prefix + "_" + ids + "|" + column for column in columns]
+
+def _patient_feature_names(task, layout=None):
+    """
+    Primo passaggio della coorte: nomi delle feature di un paziente, leggendo
+    solo le colonne necessarie. Segue le stesse regole di scarto del secondo
+    passaggio; gli errori vengono riportati da quest'ultimo.
+    
+    Un file miRNA mancante non aggiunge colonne: quelle della modalità vengono
+    dagli altri pazienti e nel secondo passaggio il template del layout le lascia NaN.
+    """
+    _, _, file_paths, base_dir = task
+    files = zip(("gene_expr", "mirna_iso", "mirna_agg"), classify_patient_files(file_paths, base_dir))
+    names = []
+    for file_type, file_path in files:
+        if not file_path:
+            if file_type == "gene_expr":
+                return []
+            continue
+        try:
+            names.extend(_modality_feature_names(file_type, file_path))
+        except Exception:
+            if file_type == "gene_expr":
+                return []
+    return names
+
+def _upload_hashes(upload):
+    """Hash del file calcolati durante l'upload (gli stessi di parse_cache.file_hashes), se disponibili"""
+    if upload is None or upload.content_hash is None or not upload.saved:
+        return None, None
+    return upload.content_hash, upload.prefix_hash
+
+def _upload_filler(filler, upload):
+    """
+    Parser per la copia su disco di un file caricato: un gzip riconosciuto dai primi
+    byte durante l'upload viene letto come tale anche se il nome non termina in .gz.
+    """
+    if upload is None or upload.compression is None:
+        return filler
+    return functools.partial(filler, compression=upload.compression)
+
+def _fill_patient_row(task, layout=None, prefilled=None):
+    """
+    Secondo passaggio della coorte: scrive i dati di un paziente in una riga del layout.
+    
+    Args:
+        task (tuple): (category, patient_id, file_paths, base_dir)
+        layout (FeatureLayout): Layout delle colonne (nei processi del pool quello dell'initializer)
+        prefilled (dict): File già elaborati durante l'upload, per percorso (vedi ingest.UploadIngest)
+    
+    Returns:
+        tuple: (riga float32 o None se il paziente è scartato, riga delle categoriche, lista degli errori)
+    """
+    layout = _worker_layout if layout is None else layout
+    prefilled = prefilled or {}
+    category, patient_id, file_paths, base_dir = task
+    errors = []
+    
+    # Filtra i file wxs e organizza per tipo
+    gene_expr_file, mirna_iso_file, mirna_agg_file = classify_patient_files(file_paths, base_dir)
+    
+    # Se gene expression non è disponibile, scartiamo il paziente
+    if not gene_expr_file:
+        errors.append(_patient_error(patient_id, category, "gene_expr", "File gene_expr mancante", True))
+        return None, None, errors
+    
+    num, cat = layout.new_rows(1)
+    num_row, cat_row = num[0], cat[0]
+    try:
+        # Espressione genica: già elaborata durante l'upload, oppure parser colonnare (o cache per contenuto)
+        with ins.span("parse_gene_expr"):
+            upload = prefilled.get(gene_expr_file)
+            if upload is None or not upload.apply("gene_expr", layout, num_row, cat_row):
+                pc.cached_fill("gene_expr", gene_expr_file, _upload_filler(fill_gene_expression, upload), layout,
+                               num_row, cat_row, *_upload_hashes(upload))
+    except Exception as e:
+        errors.append(_patient_error(patient_id, category, "gene_expr", e, True))
+        return None, None, errors
+    
+    # File miRNA: scritti nel layout; se mancanti, tutte le feature della modalità sono mancanti
+    for file_type, file_path, filler in (("mirna_iso", mirna_iso_file, fill_mirna_isoform),
+                                         ("mirna_agg", mirna_agg_file, fill_mirna_aggregate)):
+        try:
+            if file_path:
+                try:
+                    with ins.span(f"parse_{file_type}"):
+                        upload = prefilled.get(file_path)
+                        if upload is None or not upload.apply(file_type, layout, num_row, cat_row):
+                            pc.cached_fill(file_type, file_path, _upload_filler(filler, upload), layout,
+                                           num_row, cat_row, *_upload_hashes(upload))
+                    continue
+                except FileNotFoundError:
+                    errors.append(_patient_error(patient_id, category, file_type,
+                                                 f"File non trovato: {file_path}, uso il placeholder", False))
+            with ins.span("placeholder"):
+                layout.fill_placeholder(file_type, num_row, cat_row)
+        except Exception as e:
+            # Continuiamo comunque con il resto dei dati
+            errors.append(_patient_error(patient_id, category, file_type, e, False))
+    
+    return num_row, cat_row, errors
+
+def _shrink_npy(path, num, n_rows):
+    """Riscrive il file .npy della coorte con le sole prime n_rows righe"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shrunk = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=num.dtype, shape=(n_rows,) + num.shape[1:])
+    shrunk[:] = num[:n_rows]
+    shrunk.flush()
+    del shrunk
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r+')
+
+
+class PatientCohort:
+    """
+    Coorte di pazienti: matrice numerica float32 (eventualmente mappata su un file .npy)
+    e matrice delle feature categoriche, con una riga per paziente nell'ordine del JSON.
+    """
+
+    def __init__(self, layout, patient_ids, categories, num, cat, errors, memmap_path=None):
+        self.layout = layout
+        self.patient_ids = patient_ids
+        self.categories = categories
+        self.num = num
+        self.cat = cat
+        self.errors = errors
+        self.memmap_path = memmap_path
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def matrix(self):
+        """Matrice da passare al modello (vedi FeatureLayout.assemble)"""
+        return self.layout.assemble(self.num, self.cat)
+
+    def to_dataframe(self):
+        """DataFrame con una riga per paziente (indice patient_id) e una colonna per feature"""
+        index = pd.Index(self.patient_ids, name='patient_id')
+        df = pd.DataFrame(self.num, index=index, columns=self.layout.feature_names, copy=False)
+        if self.layout.has_cat_features:
+            cat_columns = [self.layout.feature_names[i] for i in self.layout.cat_positions]
+            cat_df = pd.DataFrame(self.cat, index=index, columns=cat_columns)
+            df = pd.concat([df.drop(columns=cat_columns), cat_df], axis=1)[self.layout.feature_names]
+        return df
+
+
+def cohort_layout(data, base_dir, workers=None, chunksize=None):
+    """
+    Ricava le colonne di una coorte dai file dei pazienti (primo passaggio).
+    
+    Vengono letti solo gli ID di geni e miRNA; le colonne seguono l'ordine di
+    prima apparizione, come nel DataFrame costruito dai dizionari dei pazienti.
+    Le feature assenti per un paziente valgono NaN.
+    
+    Returns:
+        FeatureLayout: Layout delle colonne della coorte (miRNA_region categoriche)
+    """
+    workers = PREPROCESSING_WORKERS if workers is None else workers
+    feature_names = {}
+    for names in _map_patients(_patient_feature_names, _patient_tasks(data, base_dir), workers, chunksize,
+                               desc="Lettura colonne pazienti"):
+        for block in names:
+            feature_names.update(dict.fromkeys(block.tolist()))
+    feature_names = list(feature_names)
+    cat_indices = [i for i, name in enumerate(feature_names) if name.endswith("|miRNA_region")]
+    return FeatureLayout(feature_names, cat_indices, fill_value=np.nan, cat_fill_value=np.nan,
+                         cat_missing_value=np.nan)
+
+
+def build_patient_cohort(data, base_dir, layout=None, workers=None, chunksize=None, memmap_path=None, errors=None,
+                         prefilled=None, executor=None):
+    """
+    Costruisce la matrice di una coorte di pazienti riempiendo in place una
+    matrice float32 preallocata, senza dizionari per paziente.
+    
+    Parameters:
+    -----------
+    data : dict
+        Dizionario contenente i path dei file per ogni paziente
+    base_dir : str
+        Directory di base da combinare con i path relativi nel JSON
+    layout : FeatureLayout, optional
+        Colonne della matrice: quelle del modello, oppure ricavate dai file con cohort_layout
+    workers : int, optional
+        Processi usati per elaborare i pazienti in parallelo (default PREPROCESSING_WORKERS)
+    chunksize : int, optional
+        Pazienti inviati a ogni processo per volta (default calcolato dal numero di pazienti)
+    memmap_path : str, optional
+        File .npy su cui mappare la matrice numerica; se None e la matrice supera
+        COHORT_MAX_MEMORY_BYTES viene usato un file temporaneo
+    errors : list, optional
+        Lista in cui aggiungere gli errori per paziente (dizionari con patient_id,
+        category, file_type, error, skipped); se None viene stampato solo un riepilogo
+    prefilled : dict, optional
+        File già elaborati durante l'upload, per percorso assoluto (solo elaborazione seriale)
+    executor : ProcessPoolExecutor, optional
+        Pool creato con patient_pool(workers, layout) e riusato tra più chiamate
+        (es. i blocchi di batch_score); richiede lo stesso layout del pool
+        
+    Returns:
+    --------
+    PatientCohort
+        Coorte con i soli pazienti elaborati, nell'ordine del JSON
+    """
+    workers = PREPROCESSING_WORKERS if workers is None else workers
+    if prefilled:
+        # I file elaborati durante l'upload vivono nel processo corrente
+        workers = 1
+    if layout is None:
+        if executor is not None:
+            raise ValueError("Un pool condiviso richiede il layout con cui è stato creato")
+        layout = cohort_layout(data, base_dir, workers, chunksize)
+    tasks = _patient_tasks(data, base_dir)
+    
+    shape = (len(tasks), layout.n_features)
+    if memmap_path is None and shape[0] * shape[1] * np.dtype(np.float32).itemsize > COHORT_MAX_MEMORY_BYTES:
+        memmap_path = os.path.join(tempfile.mkdtemp(prefix="cohort_"), "cohort.npy")
+    if memmap_path:
+        num = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=shape)
+    else:
+        num = np.empty(shape, dtype=np.float32)
+    cat = np.empty((len(tasks), len(layout.cat_positions)), dtype=object)
+    
+    # Le righe dei pazienti scartati non vengono occupate: i pazienti elaborati restano contigui
+    patient_ids, categories, patient_errors = [], [], []
+    results = _map_patients(_fill_patient_row, tasks, workers, chunksize, layout=layout, executor=executor,
+                            prefilled=prefilled)
+    for (category, patient_id, _, _), (num_row, cat_row, task_errors) in zip(tasks, results):
+        patient_errors.extend(task_errors)
+        if num_row is None:
+            continue
+        row = len(patient_ids)
+        num[row] = num_row
+        cat[row] = cat_row
+        patient_ids.append(patient_id)
+        categories.append(category)
+    
+    n_rows = len(patient_ids)
+    if memmap_path:
+        num.flush()
+        if n_rows < len(tasks):
+            num = _shrink_npy(memmap_path, num, n_rows)
+    elif n_rows < len(tasks):
+        num.resize((n_rows, layout.n_features), refcheck=False)
+    cat = cat[:n_rows]
+    
+    if errors is not None:
+        errors.extend(patient_errors)
+    elif patient_errors:
+        skipped = sum(1 for error in patient_errors if error["skipped"])
+        print(f"Preprocessing: {len(patient_errors)} errori, {skipped} pazienti scartati")
+    
+    return PatientCohort(layout, patient_ids, categories, num, cat, patient_errors, memmap_path)
+
 
 # Function to create a complete patient dataset from JSON file paths
-def create_patient_dataset_from_json(data, base_dir, output_file=None):
+def create_patient_dataset_from_json(data, base_dir, output_file=None, workers=None, chunksize=None, errors=None,
+                                     layout=None):
     """
     Crea un dataset completo per tutti i pazienti leggendo i path da un JSON.
     
@@ -168,156 +700,79 @@ def create_patient_dataset_from_json(data, base_dir, output_file=None):
     base_dir : str
         Directory di base da combinare con i path relativi nel JSON
     output_file : str, optional
-        Percorso dove salvare il dataset finale in formato CSV
+        Percorso dove salvare il dataset: file .csv oppure cartella nel formato
+        binario di feature_store (rileggibile in mmap senza rielaborare i TSV)
+    workers : int, optional
+        Processi usati per elaborare i pazienti in parallelo (default PREPROCESSING_WORKERS)
+    chunksize : int, optional
+        Pazienti inviati a ogni processo per volta (default calcolato dal numero di pazienti)
+    errors : list, optional
+        Lista in cui aggiungere gli errori per paziente (vedi build_patient_cohort)
+    layout : FeatureLayout, optional
+        Layout di un modello: le colonne sono le sue feature e le modalità mancanti
+        usano i suoi template NaN; se None le colonne sono ricavate dai file della coorte
         
     Returns:
     --------
     pandas.DataFrame
-        Dataset con una riga per paziente e colonne per tutte le features
+        Dataset con una riga per paziente e colonne per tutte le features,
+        nello stesso ordine dei pazienti nel JSON
     """
-    
-    def find_placeholder_file(file_type):
-        """
-        Trova un file placeholder nella cartella assets/data/tumor/ per il tipo specificato.
-        """
-        placeholder_dir = "backendPrediction/assets/data/"
-        
-        try:
-            files = os.listdir(placeholder_dir)
-            
-            if file_type == "gene_expr":
-                # Cerca file di gene expression
-                for file in files:
-                    if ("rna_seq" in file or "gene_counts" in file or "star_gene" in file):
-                        return os.path.join(placeholder_dir, file)
-            elif file_type == "mirna_iso":
-                # Cerca file di miRNA isoforms
-                for file in files:
-                    if ("isoforms" in file or "isoform" in file):
-                        return os.path.join(placeholder_dir, file)
-            elif file_type == "mirna_agg":
-                # Cerca file di miRNA aggregati
-                for file in files:
-                    if (("mirnas" in file or "mirna" in file) and "isoform" not in file):
-                        return os.path.join(placeholder_dir, file)
-        except FileNotFoundError:
-            print(f"Cartella {placeholder_dir} non trovata!")
-            return None
-        
-        return None
-    
-    all_patients_data = []
-    
-    # Processa i dati dei pazienti in tutte le categorie
-    for category, patients in data.items():
-        for patient_id, file_paths in tqdm(patients.items(), desc=f"Elaborazione pazienti {category}"):
-            # Inizializza i dati del paziente
-            patient_data = {"patient_id": patient_id, "category": category}
-            
-            # Filtra i file wxs e organizza per tipo
-            gene_expr_file = None
-            mirna_iso_file = None
-            mirna_agg_file = None
-            
-            for path in file_paths:
-                # Salta i file wxs
-                if ".wxs." in path:
-                    continue
-                  # Identifica il tipo di file in base ai pattern nel nome
-                if (("rna_seq" in path or "gene_counts" in path or "star_gene" in path) and 
-                    not gene_expr_file):
-                    gene_expr_file = os.path.join(base_dir, path)
-                elif (("isoforms" in path or "isoform" in path) and 
-                    not mirna_iso_file):
-                    mirna_iso_file = os.path.join(base_dir, path)
-                elif ((("mirnas" in path or "mirna" in path) and "isoform" not in path) and 
-                    not mirna_agg_file):
-                    mirna_agg_file = os.path.join(base_dir, path)
-            
-            # Se gene expression non è disponibile, scartiamo il paziente
-            if not gene_expr_file:
-                print(f"Paziente {patient_id} manca del file gene_expr, lo scartiamo.")
-                continue
-                
-            try:
-                # Elabora il file di espressione genica
-                gene_data = process_gene_expression(gene_expr_file)
-                patient_data.update(gene_data)
-                  # Gestione dei file miRNA isoform
-                try:
-                    if mirna_iso_file:
-                        mirna_iso_data = process_mirna_isoform(mirna_iso_file)
-                    else:
-                        # Usa un file placeholder dalla cartella assets/data/tumor/
-                        placeholder_file = find_placeholder_file("mirna_iso")
-                        if placeholder_file:
-                            print(f"Usando file placeholder {placeholder_file} per mirna_iso del paziente {patient_id}")
-                            temp_data = process_mirna_isoform(placeholder_file)
-                            # Imposta tutti i valori a NaN
-                            mirna_iso_data = {k: np.nan for k in temp_data.keys()}
-                        else:
-                            print(f"Nessun file placeholder trovato per mirna_iso. Dati non aggiunti per il paziente {patient_id}.")
-                            mirna_iso_data = {}
-                    patient_data.update(mirna_iso_data)
-                except FileNotFoundError:
-                    print(f"File mirna_iso non trovato per il paziente {patient_id}. Usando placeholder.")
-                    placeholder_file = find_placeholder_file("mirna_iso")
-                    if placeholder_file:
-                        temp_data = process_mirna_isoform(placeholder_file)
-                        mirna_iso_data = {k: np.nan for k in temp_data.keys()}
-                        patient_data.update(mirna_iso_data)
-                    else:
-                        print(f"Nessun file placeholder per mirna_iso. Dati non aggiunti per il paziente {patient_id}.")
-                except Exception as e:
-                    print(f"Errore nell'elaborazione del mirna_iso per il paziente {patient_id}: {e}")
-                    # Continuiamo comunque con il resto dei dati
-                  # Gestione dei file miRNA aggregate
-                try:
-                    if mirna_agg_file:
-                        mirna_agg_data = process_mirna_aggregate(mirna_agg_file)
-                    else:
-                        # Usa un file placeholder dalla cartella assets/data/tumor/
-                        placeholder_file = find_placeholder_file("mirna_agg")
-                        if placeholder_file:
-                            print(f"Usando file placeholder {placeholder_file} per mirna_agg del paziente {patient_id}")
-                            temp_data = process_mirna_aggregate(placeholder_file)
-                            # Imposta tutti i valori a NaN
-                            mirna_agg_data = {k: np.nan for k in temp_data.keys()}
-                        else:
-                            print(f"Nessun file placeholder trovato per mirna_agg. Dati non aggiunti per il paziente {patient_id}.")
-                            mirna_agg_data = {}
-                    patient_data.update(mirna_agg_data)
-                except FileNotFoundError:
-                    print(f"File mirna_agg non trovato per il paziente {patient_id}. Usando placeholder.")
-                    placeholder_file = find_placeholder_file("mirna_agg")
-                    if placeholder_file:
-                        temp_data = process_mirna_aggregate(placeholder_file)
-                        mirna_agg_data = {k: np.nan for k in temp_data.keys()}
-                        patient_data.update(mirna_agg_data)
-                    else:
-                        print(f"Nessun file placeholder per mirna_agg. Dati non aggiunti per il paziente {patient_id}.")
-                except Exception as e:
-                    print(f"Errore nell'elaborazione del mirna_agg per il paziente {patient_id}: {e}")
-                    # Continuiamo comunque con il resto dei dati
-                
-                all_patients_data.append(patient_data)
-            except Exception as e:
-                print(f"Errore nell'elaborazione del paziente {patient_id}: {e}")
+    cohort = build_patient_cohort(data, base_dir, layout, workers=workers, chunksize=chunksize, errors=errors)
     
     # Crea il DataFrame
-    if not all_patients_data:
+    if len(cohort) == 0:
         print("Nessun dato paziente trovato!")
         return None
-    df = pd.DataFrame(all_patients_data)
-    df.pop('patient_id')
-    df.pop('category')
+    df = cohort.to_dataframe()
     
-
     # Salva il dataset se richiesto
-    """if output_file:
-        df.to_csv(output_file, index=False)
-        print(f"Dataset salvato in {output_file}")"""
+    if output_file:
+        if output_file.lower().endswith('.csv'):
+            df.to_csv(output_file)
+        else:
+            fs.save_cohort(output_file, cohort)
+        print(f"Dataset salvato in {output_file}")
     
     return df
 
 
+def prepare_layout(layout):
+    """
+    Precalcola gli indici del layout usati dai parser e i template NaN delle modalità
+    miRNA, così che la prima richiesta non paghi il costo della loro costruzione.
+    """
+    layout.modality_index("gene", GENE_FEATURE_COLUMNS)
+    gene_rows_seen(layout)
+    layout.isoform_index("mirna_iso", MIRNA_ISO_FEATURE_COLUMNS)
+    for file_type in MIRNA_MODALITIES:
+        layout.modality_template(file_type)
+
+def create_patient_matrix_from_json(data, base_dir, layout, errors=None, prefilled=None):
+    """
+    Come create_patient_dataset_from_json, ma scrive i dati di ogni paziente
+    direttamente in una matrice già ordinata secondo il layout del modello.
+    
+    Parameters:
+    -----------
+    data : dict
+        Dizionario contenente i path dei file per ogni paziente
+    base_dir : str
+        Directory di base da combinare con i path relativi nel JSON
+    layout : FeatureLayout
+        Layout delle feature del modello
+    errors : list, optional
+        Lista in cui aggiungere gli errori per paziente (vedi build_patient_cohort)
+    prefilled : dict, optional
+        File già elaborati durante l'upload, per percorso assoluto
+        
+    Returns:
+    --------
+    tuple
+        (lista dei patient_id elaborati, matrice allineata con una riga per paziente)
+    """
+    # Le richieste vengono elaborate nel processo del server, senza pool
+    cohort = build_patient_cohort(data, base_dir, layout, workers=1, errors=errors, prefilled=prefilled)
+    with ins.span("alignment"):
+        matrix = cohort.matrix()
+    return cohort.patient_ids, matrix
@@ -0,0 +1,126 @@
+"""
+Test dello scoring offline (batch_score): pazienti con lo stesso ID in più categorie e ripresa dal checkpoint.
+
+Usa la coorte sintetica di benchmarks/synthetic.py con un piccolo modello addestrato al volo.
+
+Eseguibile con pytest oppure direttamente: python test_batch_score.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import batch_score  # noqa: E402
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+
+_workspace = None
+
+
+def workspace():
+    """Coorte sintetica e modello, generati una volta per processo"""
+    global _workspace
+    if _workspace is None:
+        _workspace = synthetic.write_workspace(tempfile.mkdtemp(), 4, n_genes=1000, n_mirnas=100,
+                                               isoforms_per_mirna=3, model_features=300, iterations=10)
+    return _workspace
+
+
+def write_manifest():
+    """Manifest dei pazienti sintetici, con un ID ripetuto in un'altra categoria e un paziente senza file"""
+    manifest = json.loads(json.dumps(workspace()['manifest']))
+    tumor_files = next(iter(manifest['tumor'].values()))
+    normal_id = next(iter(manifest['normal']))
+    manifest['tumor'][normal_id] = tumor_files
+    manifest['normal']['TCGA-BM-9999'] = []
+    path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    return path, normal_id
+
+
+def score(manifest_path, output, **kwargs):
+    return batch_score.run(manifest_path, workspace()['model_path'], output, chunk_size=2, **kwargs)
+
+
+def test_same_patient_id_in_two_categories():
+    manifest_path, duplicate_id = write_manifest()
+    output = os.path.join(tempfile.mkdtemp(), 'scores.csv')
+    patient_pool = pre.patient_pool
+    pools = []
+
+    def counted_pool(*args):
+        pools.append(args)
+        return patient_pool(*args)
+
+    pre.patient_pool = counted_pool
+    try:
+        summary = score(manifest_path, output, workers=2)
+    finally:
+        pre.patient_pool = patient_pool
+    # Un solo pool di processi per i tre blocchi
+    assert (summary['scored'], summary['skipped'], summary['chunks']) == (5, 1, 3) and len(pools) == 1
+
+    df = pd.read_csv(output).set_index(['category', 'patient_id'])
+    tumor_id = df.loc['tumor'].index[0]
+    # Il paziente ripetuto ha i punteggi dei file elencati nella sua categoria
+    assert df.loc[('tumor', duplicate_id), 'probability_1'] == df.loc[('tumor', tumor_id), 'probability_1']
+    assert df.loc[('normal', duplicate_id), 'probability_1'] != df.loc[('tumor', duplicate_id), 'probability_1']
+    assert df.loc[('normal', 'TCGA-BM-9999'), 'status'] == 'skipped'
+    assert df.loc[('normal', 'TCGA-BM-9999'), 'error'].startswith('gene_expr')
+
+
+def test_interrupted_scoring_resumes_from_the_checkpoint():
+    manifest_path, _ = write_manifest()
+    output_dir = tempfile.mkdtemp()
+    expected_output = os.path.join(output_dir, 'expected.csv')
+    score(manifest_path, expected_output, workers=1)
+
+    output = os.path.join(output_dir, 'scores.csv')
+    score_chunk = batch_score.score_chunk
+    calls = []
+
+    def interrupted(chunk, *args, **kwargs):
+        calls.append(chunk)
+        if len(calls) == 2:
+            # Interruzione dopo che il blocco ha già scritto parte dell'output
+            with open(output, 'a') as f:
+                f.write("riga,incompleta")
+            raise KeyboardInterrupt
+        return score_chunk(chunk, *args, **kwargs)
+
+    batch_score.score_chunk = interrupted
+    try:
+        score(manifest_path, output, workers=2)
+    except KeyboardInterrupt:
+        pass
+    else:
+        raise AssertionError("scoring non interrotto")
+    finally:
+        batch_score.score_chunk = score_chunk
+    with open(f"{output}.checkpoint.json") as f:
+        assert json.load(f)['chunks_done'] == 1
+
+    summary = score(manifest_path, output, workers=2)
+    assert (summary['scored'], summary['skipped'], summary['chunks']) == (5, 1, 3)
+    pd.testing.assert_frame_equal(pd.read_csv(output), pd.read_csv(expected_output))
+
+    # Un checkpoint di uno scoring diverso non viene riusato
+    try:
+        score(manifest_path, output, workers=1, threshold=0.9)
+    except ValueError as e:
+        assert "threshold" in str(e)
+    else:
+        raise AssertionError("checkpoint di uno scoring diverso riusato")
+
+
+if __name__ == "__main__":
+    test_same_patient_id_in_two_categories()
+    test_interrupted_scoring_resumes_from_the_checkpoint()
+    print("✅ Test dello scoring offline riusciti")
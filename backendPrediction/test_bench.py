@@ -0,0 +1,59 @@
+"""
+Test della suite di benchmark: esecuzione dei casi su dati sintetici minimi e rilevamento dei peggioramenti.
+
+Eseguibile con pytest oppure direttamente: python test_bench.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+# bench disattiva la cache dei file elaborati per tutto il processo: ripristina l'ambiente dopo l'import
+_saved_env = dict(os.environ)
+import bench  # noqa: E402
+os.environ.clear()
+os.environ.update(_saved_env)
+
+TINY_PARAMS = {'genes': 300, 'mirnas': 40, 'isoforms_per_mirna': 2, 'patients': 4,
+               'model_features': 100, 'repeat': 2}
+
+
+def test_every_case_runs_on_a_tiny_workspace():
+    work_dir = tempfile.mkdtemp(prefix="bench_test_")
+    try:
+        workspace = bench.prepare_workspace(work_dir, TINY_PARAMS)
+        for name in bench.CASES:
+            summary = bench.run_case(name, workspace, TINY_PARAMS['repeat'])
+            assert 'error' not in summary, summary.get('error')
+            assert summary['runs'] >= TINY_PARAMS['repeat'] and summary['p50_ms'] > 0
+            assert summary['peak_rss_mb'] > 0
+
+        # Con gli stessi parametri i dati già generati vengono riusati
+        model_mtime = os.stat(workspace['model_path']).st_mtime_ns
+        assert bench.prepare_workspace(work_dir, TINY_PARAMS)['manifest'] == workspace['manifest']
+        assert os.stat(workspace['model_path']).st_mtime_ns == model_mtime
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_compare_reports_only_regressions_beyond_the_tolerance():
+    baseline = {'results': {'a': {'p50_ms': 10.0, 'peak_rss_mb': 100.0},
+                            'b': {'p50_ms': 10.0, 'peak_rss_mb': 100.0},
+                            'c': {'error': 'traceback'}}}
+    results = {'a': {'p50_ms': 13.0, 'peak_rss_mb': 100.0},
+               'b': {'p50_ms': 9.0, 'peak_rss_mb': 140.0},
+               'c': {'p50_ms': 50.0, 'peak_rss_mb': 100.0},
+               'd': {'p50_ms': 50.0, 'peak_rss_mb': 100.0}}
+
+    assert bench.compare(results, baseline, 0.25) == ["a: p50_ms 10.0 -> 13.0", "b: peak_rss_mb 100.0 -> 140.0"]
+    assert bench.compare(results, baseline, 0.5) == []
+
+
+if __name__ == "__main__":
+    test_every_case_runs_on_a_tiny_workspace()
+    test_compare_reports_only_regressions_beyond_the_tolerance()
+    print("✅ Test della suite di benchmark riusciti")
@@ -0,0 +1,61 @@
+"""
+Test del formato binario delle coorti (feature_store).
+
+Eseguibile con pytest oppure direttamente: python test_feature_store.py
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import feature_store as fs
+from feature_layout import FeatureLayout
+from preprocessing import PatientCohort
+
+
+def synthetic_cohort():
+    """Coorte con NaN numerici e categorici, come quelle costruite da cohort_layout"""
+    feature_names = ["gene_ENSG00000000003.15|unstranded", "gene_ENSG00000000005.6|unstranded",
+                     "mirna_iso_hsa-mir-21_a|read_count", "mirna_iso_hsa-mir-21_a|miRNA_region",
+                     "mirna_agg_hsa-mir-21|read_count"]
+    layout = FeatureLayout(feature_names, [3], fill_value=np.nan, cat_fill_value=np.nan, cat_missing_value=np.nan)
+    num, cat = layout.new_rows(3)
+    num[:, [0, 1, 2, 4]] = [[1.5, 2.0, 10.0, 3.0], [0.0, np.nan, 4.0, 1.0], [7.0, 8.0, np.nan, np.nan]]
+    cat[:, 0] = ["mature,MIMAT0000076", np.nan, "precursor"]
+    return PatientCohort(layout, ["P1", "P2", "P3"], ["tumor", "tumor", "normal"], num, cat, [])
+
+
+def test_roundtrip_and_column_selection():
+    cohort = synthetic_cohort()
+    path = os.path.join(tempfile.mkdtemp(), "cohort")
+    schema_hash = fs.save_cohort(path, cohort)
+
+    store = fs.FeatureStore(path, schema_hash=schema_hash)
+    assert store.num.flags['F_CONTIGUOUS']
+    assert store.categories == cohort.categories
+    pd.testing.assert_frame_equal(store.select().to_dataframe(), cohort.to_dataframe())
+
+    columns = ["mirna_iso_hsa-mir-21_a|miRNA_region", "gene_ENSG00000000005.6|unstranded"]
+    pd.testing.assert_frame_equal(store.select(columns).to_dataframe(), cohort.to_dataframe()[columns])
+
+
+def test_matrix_for_matches_align():
+    cohort = synthetic_cohort()
+    path = os.path.join(tempfile.mkdtemp(), "cohort")
+    fs.save_cohort(path, cohort)
+    store = fs.FeatureStore(path)
+
+    # Layout di un modello: feature in ordine diverso, una assente dalla coorte
+    model_layout = FeatureLayout(["mirna_iso_hsa-mir-21_a|miRNA_region", "gene_ENSG00000000003.15|unstranded",
+                                  "gene_ENSG00000000999.1|unstranded", "mirna_agg_hsa-mir-21|read_count"], [0])
+    expected = model_layout.align(cohort.to_dataframe())
+    result = store.matrix_for(model_layout)
+    assert pd.DataFrame(result).astype(str).equals(pd.DataFrame(expected).astype(str))
+
+
+if __name__ == "__main__":
+    test_roundtrip_and_column_selection()
+    test_matrix_for_matches_align()
+    print("✅ Test feature store riusciti")
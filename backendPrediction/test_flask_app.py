@@ -0,0 +1,111 @@
+"""
+Test dell'endpoint /api/predict/batch: più pazienti in una sola richiesta, pazienti scartati e richieste non valide.
+
+Usa la coorte sintetica di benchmarks/synthetic.py con un piccolo modello addestrato al volo;
+l'app viene importata dopo aver impostato MODEL_PATH e UPLOAD_FOLDER su cartelle temporanee.
+
+Eseguibile con pytest oppure direttamente: python test_flask_app.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import parse_cache as pc  # noqa: E402
+import synthetic  # noqa: E402
+
+_app = None
+
+
+def app():
+    """Coorte sintetica e app Flask configurata sul suo modello, generate una volta per processo"""
+    global _app
+    if _app is None:
+        workspace = synthetic.write_workspace(tempfile.mkdtemp(), 3, n_genes=500, n_mirnas=50,
+                                              isoforms_per_mirna=2, model_features=200, iterations=20)
+        os.environ['MODEL_PATH'] = workspace['model_path']
+        os.environ['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        import flask_app
+        _app = flask_app.app, workspace
+    return _app
+
+
+def post(path, files, **form):
+    """Invia una richiesta multipart: files è {campo: [percorsi]}, con una cache dei file elaborati vuota"""
+    data = dict(form)
+    handles = []
+    for field, paths in files.items():
+        handles.extend(open(path, 'rb') for path in paths)
+        data[field] = [(handle, os.path.basename(handle.name)) for handle in handles[-len(paths):]]
+    saved = pc._cache
+    pc._cache = pc.ParseCache(tempfile.mkdtemp(), max_bytes=pc.PARSE_CACHE_MAX_BYTES)
+    try:
+        return app()[0].test_client().post(path, data=data, content_type='multipart/form-data').get_json()
+    finally:
+        pc._cache = saved
+        for handle in handles:
+            handle.close()
+
+
+def test_batch_matches_single_patient_predictions():
+    flask_app, workspace = app()
+    patients = {**workspace['manifest']['normal'], **workspace['manifest']['tumor']}
+    first, second = list(patients.values())[:2]
+    files = {'files[a]': first, 'files[b]': second[:1], 'files[c]': second[2:]}
+
+    response = post('/api/predict/batch', files, sample_type='tumor', explain='global')
+    assert response['success'] and response['sample_type'] == 'tumor' and response['count'] == 2
+    assert [item['label'] for item in response['results']] == ['a', 'b']
+    # Paziente senza file di espressione genica: scartato e riportato tra gli errori
+    assert [error['label'] for error in response['errors']] == ['c']
+    assert all(os.path.exists(path) for item in response['results'] for path in item['uploaded_files'])
+    assert all(os.path.dirname(path) == flask_app.config['UPLOAD_FOLDER']
+               for item in response['results'] for path in item['uploaded_files'])
+
+    # Stessa predizione e stesse spiegazioni della richiesta del singolo paziente
+    for item, patient_files in zip(response['results'], (first, second[:1])):
+        single = post('/api/predict', {'files': patient_files}, sample_type='tumor', explain='global')
+        assert single['success']
+        assert np.allclose(item['result']['prediction_probability'], single['result']['prediction_probability'])
+        assert item['result']['top_features'] == single['result']['top_features']
+        assert item['result']['explanation'] == 'global'
+
+    response = post('/api/predict/batch', {'files[a]': first}, sample_type='tumor', explain='none')
+    assert response['count'] == 1 and response['results'][0]['result']['top_features'] == []
+
+
+def test_invalid_batch_requests_are_rejected():
+    flask_app, workspace = app()
+    first = next(iter(workspace['manifest']['tumor'].values()))
+    second = next(iter(workspace['manifest']['normal'].values()))
+
+    response = post('/api/predict/batch', {'files[a]': first}, sample_type='tumor', explain='lime')
+    assert not response['success'] and 'lime' in response['error']
+
+    response = post('/api/predict/batch', {'files[a]': first}, sample_type='tumor', threshold='2')
+    assert not response['success'] and 'soglia' in response['error']
+
+    response = post('/api/predict/batch', {'files': first}, sample_type='tumor')
+    assert not response['success'] and 'files[<etichetta>]' in response['error']
+
+    response = post('/api/predict/batch', {'files[a]': first + second[:1]}, sample_type='tumor')
+    assert not response['success'] and 'paziente a' in response['error']
+
+    max_patients = flask_app.config['BATCH_MAX_PATIENTS']
+    flask_app.config['BATCH_MAX_PATIENTS'] = 1
+    try:
+        response = post('/api/predict/batch', {'files[a]': first, 'files[b]': second}, sample_type='tumor')
+    finally:
+        flask_app.config['BATCH_MAX_PATIENTS'] = max_patients
+    assert not response['success'] and 'Massimo 1 pazienti' in response['error']
+
+
+if __name__ == "__main__":
+    test_batch_matches_single_patient_predictions()
+    test_invalid_batch_requests_are_rejected()
+    print("✅ Test della predizione batch riusciti")
@@ -0,0 +1,81 @@
+"""
+Test dell'indice persistente gene_id -> gene_name (gene_index): costruzione, salvataggio e rilettura.
+
+Eseguibile con pytest oppure direttamente: python test_gene_index.py
+"""
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import gene_index as gi  # noqa: E402
+import prediction as pred  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def new_base_dir():
+    base_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(base_dir, 'assets', 'data'))
+    return base_dir
+
+
+def forget(base_dir):
+    """Dimentica l'indice tenuto in memoria, come in un nuovo processo"""
+    gi._indexes.pop(base_dir, None)
+    gi._missing_since.pop(base_dir, None)
+
+
+def test_index_is_built_persisted_and_reloaded():
+    base_dir = new_base_dir()
+    tsv_path = synthetic.write_gene_counts(os.path.join(base_dir, 'assets', 'data',
+                                                        'P.rna_seq.augmented_star_gene_counts.tsv'), n_genes=300)
+    # Upload compresso: stesso indice del TSV in chiaro
+    with open(tsv_path, 'rb') as f, gzip.open(f"{tsv_path}.gz", 'wb') as out:
+        shutil.copyfileobj(f, out)
+    os.remove(tsv_path)
+
+    index = gi.get_gene_index(base_dir)
+    assert len(index) == 300 and index.source == f"{tsv_path}.gz"
+    assert gi.get_gene_index(base_dir) is index
+    gene_ids = synthetic.gene_ids(300)
+    assert index.lookup([gene_ids[7], "ENSG_ASSENTE"]).tolist() == ["GENE7", "ENSG_ASSENTE"]
+    # Stessa mappatura del dizionario costruito dal TSV
+    assert index.to_dict() == pred.load_gene_mapping_from_tsv(f"{tsv_path}.gz")
+
+    # Un nuovo processo rilegge l'indice salvato senza il TSV
+    os.remove(f"{tsv_path}.gz")
+    forget(base_dir)
+    reloaded = gi.get_gene_index(base_dir)
+    assert reloaded is not index and reloaded.source == index.source
+    np.testing.assert_array_equal(reloaded.lookup(gene_ids), index.lookup(gene_ids))
+
+
+def test_tsv_without_gene_columns_is_treated_as_missing():
+    base_dir = new_base_dir()
+    data_dir = os.path.join(base_dir, 'assets', 'data')
+    with open(os.path.join(data_dir, 'P.rna_seq.augmented_star_gene_counts.tsv'), 'w') as f:
+        f.write("id\tcount\nA\t1\n")
+
+    assert gi.GeneIndex.from_tsv(os.path.join(data_dir, 'P.rna_seq.augmented_star_gene_counts.tsv')) is None
+    assert gi.get_gene_index(base_dir) is None
+    assert not os.path.exists(os.path.join(base_dir, 'assets', gi.GENE_INDEX_FILENAME))
+
+    # Dopo MISSING_RETRY_SECONDS viene usato il TSV valido arrivato nel frattempo
+    os.remove(os.path.join(data_dir, 'P.rna_seq.augmented_star_gene_counts.tsv'))
+    synthetic.write_gene_counts(os.path.join(data_dir, 'Q.rna_seq.augmented_star_gene_counts.tsv'), n_genes=50)
+    assert gi.get_gene_index(base_dir) is None
+    gi._missing_since[base_dir] -= gi.MISSING_RETRY_SECONDS
+    assert len(gi.get_gene_index(base_dir)) == 50
+
+
+if __name__ == "__main__":
+    test_index_is_built_persisted_and_reloaded()
+    test_tsv_without_gene_columns_is_treated_as_missing()
+    print("✅ Test dell'indice dei geni riusciti")
@@ -0,0 +1,73 @@
+"""
+Test della configurazione gunicorn del backend: worker e thread CatBoost dall'ambiente, metriche dei worker.
+
+Eseguibile con pytest oppure direttamente: python test_gunicorn_conf.py
+"""
+
+import json
+import multiprocessing
+import os
+import runpy
+import tempfile
+
+import instrumentation as ins
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def load_config(**env):
+    """Esegue gunicorn.conf.py con le variabili indicate (None = non impostata); restituisce config e ambiente"""
+    saved = dict(os.environ)
+    for key, value in env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    try:
+        return runpy.run_path(CONF_PATH), dict(os.environ)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def test_workers_and_catboost_threads_follow_the_environment():
+    config, env = load_config(GUNICORN_WORKERS='2', GUNICORN_THREADS=None, CATBOOST_THREAD_COUNT=None)
+    assert (config['workers'], config['threads'], config['worker_class']) == (2, 4, 'gthread')
+    assert config['preload_app']
+    # I core vengono divisi tra i worker
+    assert env['CATBOOST_THREAD_COUNT'] == str(max(1, multiprocessing.cpu_count() // 2))
+
+    _, env = load_config(GUNICORN_WORKERS='2', CATBOOST_THREAD_COUNT='3')
+    assert env['CATBOOST_THREAD_COUNT'] == '3'
+
+
+def test_worker_exit_archives_the_worker_metrics():
+    config, _ = load_config()
+    saved = ins.METRICS_DIR, ins.metrics
+    ins.METRICS_DIR, ins.metrics = tempfile.mkdtemp(), ins.Metrics()
+    try:
+        ins.metrics.observe_stage("alignment", 0.01, 0.01, 0)
+        ins.metrics.flush(force=True)
+        own = os.path.join(ins.METRICS_DIR, f"metrics_{os.getpid()}.json")
+        assert os.path.exists(own)
+
+        config['worker_exit'](None, None)
+        assert not os.path.exists(own)
+        # Il worker riavviato riparte da zero: i totali si sommano nell'archivio
+        ins.metrics = ins.Metrics()
+        ins.metrics.observe_stage("alignment", 0.01, 0.01, 0)
+        config['worker_exit'](None, None)
+        with open(os.path.join(ins.METRICS_DIR, ins.ARCHIVE_FILE)) as f:
+            assert json.load(f)['stages']['alignment']['count'] == 2
+
+        # All'avvio del server i totali ripartono da zero
+        config['on_starting'](None)
+        assert os.listdir(ins.METRICS_DIR) == ['archive.lock']
+    finally:
+        ins.METRICS_DIR, ins.metrics = saved
+
+
+if __name__ == "__main__":
+    test_workers_and_catboost_threads_follow_the_environment()
+    test_worker_exit_archives_the_worker_metrics()
+    print("✅ Test della configurazione gunicorn riusciti")
@@ -0,0 +1,209 @@
+"""
+Test dell'elaborazione in streaming degli upload (ingest) e della cache dei file elaborati.
+
+Usa la coorte sintetica di benchmarks/synthetic.py con un piccolo modello addestrato al volo.
+
+Eseguibile con pytest oppure direttamente: python test_ingest.py
+"""
+
+import contextlib
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import ingest  # noqa: E402
+import model_registry as mr  # noqa: E402
+import parse_cache as pc  # noqa: E402
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+from feature_layout import FeatureLayout  # noqa: E402
+
+FILE_TYPES = ("gene_expr", "mirna_iso", "mirna_agg")
+FILLERS = {
+    "gene_expr": pre.fill_gene_expression,
+    "mirna_iso": pre.fill_mirna_isoform,
+    "mirna_agg": pre.fill_mirna_aggregate,
+}
+
+_workspace = None
+
+
+def workspace():
+    """Coorte sintetica e modello, generati una volta per processo"""
+    global _workspace
+    if _workspace is None:
+        _workspace = synthetic.write_workspace(tempfile.mkdtemp(), 2, n_genes=3000, n_mirnas=300,
+                                               isoforms_per_mirna=3, model_features=400, iterations=10)
+    return _workspace
+
+
+def patient_files():
+    """File (gene_expr, mirna_iso, mirna_agg) del primo paziente sintetico"""
+    for patients in workspace()['manifest'].values():
+        for file_paths in patients.values():
+            return dict(zip(FILE_TYPES, file_paths))
+
+
+def model_layout():
+    layout = mr.get_model(workspace()['model_path']).layout
+    pre.prepare_layout(layout)
+    return layout
+
+
+@contextlib.contextmanager
+def parse_cache(max_bytes=pc.PARSE_CACHE_MAX_BYTES):
+    """Cache dei file elaborati in una cartella temporanea (max_bytes=0 la disabilita)"""
+    saved = pc.PARSE_CACHE_MAX_BYTES, pc._cache
+    cache_dir = tempfile.mkdtemp()
+    pc.PARSE_CACHE_MAX_BYTES = max_bytes
+    pc._cache = pc.ParseCache(cache_dir, max_bytes) if max_bytes > 0 else None
+    try:
+        yield pc._cache
+    finally:
+        pc.PARSE_CACHE_MAX_BYTES, pc._cache = saved
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def small_blocks(block_bytes=16 * 1024):
+    """Blocchi piccoli: i file vengono elaborati in più blocchi, come gli upload reali"""
+    saved = ingest.INGEST_BLOCK_BYTES
+    ingest.INGEST_BLOCK_BYTES = block_bytes
+    try:
+        yield
+    finally:
+        ingest.INGEST_BLOCK_BYTES = saved
+
+
+def gzip_copy(path):
+    target = os.path.join(tempfile.mkdtemp(), os.path.basename(path) + '.gz')
+    with open(path, 'rb') as src, gzip.open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return target
+
+
+def upload(path, file_type, layout, chunk_size=7919):
+    """Scrive il file in un UploadIngest a pezzi, come Werkzeug durante la ricezione"""
+    target = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    upload_file = ingest.UploadIngest(os.path.basename(path), file_type, layout, target)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            upload_file.write(data)
+    upload_file.seek(0)
+    return upload_file
+
+
+def applied_rows(upload_file, file_type, layout):
+    num_row, cat_row = (row[0] for row in layout.new_rows(1))
+    assert upload_file.apply(file_type, layout, num_row, cat_row)
+    return num_row, cat_row
+
+
+def filled_rows(path, file_type, layout, **hashes):
+    num_row, cat_row = (row[0] for row in layout.new_rows(1))
+    pc.cached_fill(file_type, path, FILLERS[file_type], layout, num_row, cat_row, **hashes)
+    return num_row, cat_row
+
+
+def assert_same_rows(actual, expected):
+    np.testing.assert_array_equal(actual[0], expected[0])
+    assert actual[1].astype(str).tolist() == expected[1].astype(str).tolist()
+
+
+def test_streaming_ingest_matches_file_path():
+    layout = model_layout()
+    with parse_cache(0), small_blocks():
+        for file_type, path in patient_files().items():
+            expected = filled_rows(path, file_type, layout)
+            assert np.isfinite(expected[0][layout.modality_template(pc.MODALITY_PREFIXES[file_type])[0]]).any()
+            for source in (path, gzip_copy(path)):
+                upload_file = upload(source, file_type, layout)
+                assert upload_file.error is None, upload_file.error
+                assert_same_rows(applied_rows(upload_file, file_type, layout), expected)
+                # Il file compresso viene elaborato anche dal percorso su disco
+                assert_same_rows(filled_rows(upload_file.upload_path, file_type, layout), expected)
+
+
+def test_reupload_is_read_from_the_parse_cache():
+    layout = model_layout()
+    with parse_cache() as cache, small_blocks():
+        for file_type, path in patient_files().items():
+            for source in (path, gzip_copy(path)):
+                first = upload(source, file_type, layout)
+                expected = applied_rows(first, file_type, layout)
+                # Gli hash calcolati durante l'upload sono quelli del file salvato
+                assert (first.content_hash, first.prefix_hash) == pc.file_hashes(first.upload_path)
+
+                hits = cache.hits
+                again = upload(source, file_type, layout)
+                assert cache.hits == hits + 1
+                # Nessuna riga analizzata: né il prefisso (file grandi) né la fine dell'upload (file piccoli)
+                assert again._parser.header is None
+                assert_same_rows(applied_rows(again, file_type, layout), expected)
+
+                # Il percorso su disco riusa gli hash dell'upload e la stessa voce
+                assert_same_rows(filled_rows(source, file_type, layout, content_hash=first.content_hash,
+                                             prefix_hash=first.prefix_hash), expected)
+                assert cache.hits == hits + 2
+
+
+def test_same_prefix_with_different_content_is_parsed_again():
+    layout = model_layout()
+    path = patient_files()["gene_expr"]
+    assert os.path.getsize(path) > pc.PREFIX_BYTES
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    # Stesso prefisso, valori diversi nell'ultima riga
+    fields = lines[-1].split(b'\t')
+    fields[3] = str(int(fields[3]) + 1).encode()
+    changed = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    with open(changed, 'wb') as f:
+        f.writelines(lines[:-1] + [b'\t'.join(fields)])
+
+    with parse_cache() as cache, small_blocks():
+        applied_rows(upload(path, "gene_expr", layout), "gene_expr", layout)
+        upload_file = upload(changed, "gene_expr", layout)
+        num_row, cat_row = (row[0] for row in layout.new_rows(1))
+        assert upload_file.reparse and not upload_file.apply("gene_expr", layout, num_row, cat_row)
+
+        misses = cache.misses
+        actual = filled_rows(upload_file.upload_path, "gene_expr", layout,
+                             content_hash=upload_file.content_hash, prefix_hash=upload_file.prefix_hash)
+        assert cache.misses == misses + 1
+        with parse_cache(0):
+            assert_same_rows(actual, filled_rows(changed, "gene_expr", layout))
+
+
+def test_gzip_without_gz_name_is_parsed_again_from_disk():
+    layout = model_layout()
+    # Copia di un layout uguale: i valori elaborati durante l'upload non possono essere riusati
+    other_layout = FeatureLayout(layout.feature_names, layout.cat_positions)
+    path = patient_files()["gene_expr"]
+    disguised = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    shutil.copyfile(gzip_copy(path), disguised)
+
+    with parse_cache(0), small_blocks():
+        upload_file = upload(disguised, "gene_expr", layout)
+        assert upload_file.error is None and upload_file.compression == 'gzip'
+        num_row, cat_row, errors = pre._fill_patient_row(("tumor", "TCGA-BM-0000", [upload_file.upload_path], ""),
+                                                         other_layout, {upload_file.upload_path: upload_file})
+        assert errors == []
+        expected = filled_rows(path, "gene_expr", other_layout)
+        for file_type in pre.MIRNA_MODALITIES:
+            other_layout.fill_placeholder(file_type, *expected)
+        assert_same_rows((num_row, cat_row), expected)
+
+
+if __name__ == "__main__":
+    test_streaming_ingest_matches_file_path()
+    test_reupload_is_read_from_the_parse_cache()
+    test_same_prefix_with_different_content_is_parsed_again()
+    test_gzip_without_gz_name_is_parsed_again_from_disk()
+    print("✅ Test dell'elaborazione in streaming riusciti")
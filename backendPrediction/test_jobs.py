@@ -0,0 +1,150 @@
+"""
+Test della coda persistente dei job (jobs): rimessa in coda, ciclo di vita dei risultati, runner.
+
+Eseguibile con pytest oppure direttamente: python test_jobs.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import jobs
+
+
+def new_store():
+    return jobs.JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.01)
+
+
+def test_stale_jobs_are_requeued_then_failed():
+    store = new_store()
+    job = store.submit("predict", {"n": 1})
+    assert store.get(job['id'])['position'] == 1
+
+    # Processo terminato senza heartbeat: il job torna in coda, fino a max_attempts tentativi
+    for attempt in (1, 2):
+        claimed = store.claim("worker-a")
+        assert (claimed['id'], claimed['attempts'], claimed['params']) == (job['id'], attempt, {"n": 1})
+        assert store.requeue_stale(stale_seconds=-1, max_attempts=3) == 1
+    assert store.get(job['id'])['status'] == jobs.QUEUED
+
+    store.claim("worker-a")
+    store.requeue_stale(stale_seconds=-1, max_attempts=3)
+    failed = store.get(job['id'])
+    assert failed['status'] == jobs.FAILED and failed['error'] == "Job interrotto 3 volte"
+
+    # Un job con heartbeat recente resta al suo processo, che ne salva il risultato
+    other = store.submit("predict", {})
+    store.claim("worker-b")
+    store.heartbeat("worker-b", [other['id']])
+    assert store.requeue_stale(stale_seconds=60) == 0
+    store.finish(other['id'], "worker-a", result={"ignored": True})
+    assert store.get(other['id'])['status'] == jobs.RUNNING
+    store.finish(other['id'], "worker-b", result={"ok": True})
+    assert store.get(other['id'])['status'] == jobs.DONE
+
+
+def test_results_are_deleted_when_read_or_expired():
+    store = new_store()
+    running, done, expired = (store.submit("predict", {})['id'] for _ in range(3))
+    assert store.queued([running, done, "unknown"]) == {running, done}
+    for _ in range(3):
+        store.claim("worker")
+    store.finish(done, "worker", result={"prediction": 1})
+    store.finish(expired, "worker", error="errore")
+
+    # Un job in esecuzione resta nel database dopo la lettura, uno terminato viene eliminato
+    assert store.pop_result(running)['result'] is None
+    assert store.get(running)['status'] == jobs.RUNNING
+    assert store.pop_result(done)['result'] == {"prediction": 1}
+    assert store.pop_result(done) is None
+
+    assert store.purge(ttl=60) == 0
+    assert store.purge(ttl=-1) == 1
+    assert store.get(expired) is None
+    assert store.counts() == {jobs.RUNNING: 1}
+
+    with_limit = store.submit("predict", {}, max_queued=1)
+    try:
+        store.submit("predict", {}, max_queued=1)
+    except jobs.JobQueueFull:
+        pass
+    else:
+        raise AssertionError("coda piena non segnalata")
+    assert store.get(with_limit['id'])['status'] == jobs.QUEUED
+
+
+def test_runner_runs_jobs_and_drops_contexts():
+    store = new_store()
+    contexts = []
+
+    def handler(kind, params, context):
+        contexts.append(context)
+        if params.get('fail'):
+            raise ValueError("parametri non validi")
+        return {"kind": kind, "double": params['n'] * 2}
+
+    runner = jobs.JobRunner(store, handler, workers=2, poll_interval=0.01).start()
+    try:
+        job = runner.submit("predict", {"n": 21}, context="file elaborati")
+        failing = runner.submit("predict", {"fail": True})
+        wait_for(lambda: runner.completed + runner.failed == 2)
+        assert store.pop_result(job['id'])['result'] == {"kind": "predict", "double": 42}
+        assert store.pop_result(failing['id'])['error'] == "parametri non validi"
+        assert "file elaborati" in contexts and runner._contexts == {}
+    finally:
+        runner.stop()
+
+    # Job inviato da un processo ed eseguito da un altro: il context non resta in memoria
+    sender = jobs.JobRunner(store, handler)
+    job = sender.submit("predict", {"n": 1}, context="file elaborati")
+    sender._drop_contexts()
+    assert job['id'] in sender._contexts
+    other = jobs.JobRunner(store, handler, poll_interval=0.01).start()
+    try:
+        wait_for(lambda: other.completed == 1)
+    finally:
+        other.stop()
+    sender._drop_contexts()
+    assert sender._contexts == {} and contexts[-1] is None
+
+
+def test_stopped_runner_leaves_queued_jobs_in_the_queue():
+    store = new_store()
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(kind, params, context):
+        started.set()
+        release.wait(5)
+        return {}
+
+    runner = jobs.JobRunner(store, handler, poll_interval=0.01).start()
+    first = runner.submit("predict", {})
+    assert started.wait(5)
+    stopper = threading.Thread(target=runner.stop)
+    stopper.start()
+    wait_for(runner._stop.is_set)
+    second = store.submit("predict", {})
+    release.set()
+    stopper.join(5)
+    assert not stopper.is_alive()
+
+    # Il job in corso viene completato, quello arrivato dopo lo stop resta in coda per un altro processo
+    assert store.get(first['id'])['status'] == jobs.DONE
+    assert store.get(second['id'])['status'] == jobs.QUEUED
+
+
+if __name__ == "__main__":
+    test_stale_jobs_are_requeued_then_failed()
+    test_results_are_deleted_when_read_or_expired()
+    test_runner_runs_jobs_and_drops_contexts()
+    test_stopped_runner_leaves_queued_jobs_in_the_queue()
+    print("✅ Test della coda dei job riusciti")
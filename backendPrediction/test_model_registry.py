@@ -0,0 +1,108 @@
+"""
+Test del registro dei modelli (model_registry): riuso, ricaricamento a caldo e versione precedente in caso di errore.
+
+Usa la coorte sintetica di benchmarks/synthetic.py con piccoli modelli addestrati al volo.
+
+Eseguibile con pytest oppure direttamente: python test_model_registry.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import model_registry as mr  # noqa: E402
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+
+_models = None
+
+
+def models():
+    """Due modelli diversi addestrati sulla stessa coorte sintetica, generati una volta per processo"""
+    global _models
+    if _models is None:
+        workspace = synthetic.write_workspace(tempfile.mkdtemp(), 4, n_genes=300, n_mirnas=30,
+                                              isoforms_per_mirna=2, model_features=100, iterations=5)
+        cohort_df = pre.create_patient_dataset_from_json(workspace['manifest'], '')
+        labels = [0 if patient_id in workspace['manifest']['normal'] else 1 for patient_id in cohort_df.index]
+        other_path = os.path.join(workspace['dir'], 'other.cbm')
+        synthetic.train_model(cohort_df, labels, other_path, n_features=120, iterations=8, seed=1)
+        _models = workspace['model_path'], other_path
+    return _models
+
+
+def replace_model(source, target, mtime_offset):
+    """Sostituisce il file del modello come un deploy sul volume, con un mtime diverso"""
+    mtime_ns = os.stat(target).st_mtime_ns if os.path.exists(target) else 0
+    shutil.copyfile(source, target)
+    os.utime(target, ns=(mtime_ns + mtime_offset, mtime_ns + mtime_offset))
+
+
+def test_model_is_reused_until_the_file_changes():
+    first, second = models()
+    path = os.path.join(tempfile.mkdtemp(), 'catboost.cbm')
+    replace_model(first, path, 0)
+    registry = mr.ModelRegistry(thread_count=1)
+
+    loaded = registry.get(path)
+    assert registry.get(path) is loaded
+    assert loaded.layout.n_features == 100 and loaded.sha1 == mr.file_sha1(first)
+
+    # File solo "toccato": stesso modello, metadati aggiornati
+    replace_model(first, path, 10 ** 9)
+    assert registry.get(path) is loaded and loaded.mtime_ns == os.stat(path).st_mtime_ns
+
+    # Nuovo modello sullo stesso percorso: ricaricato senza riavviare il processo
+    replace_model(second, path, 2 * 10 ** 9)
+    reloaded = registry.get(path)
+    assert reloaded is not loaded and reloaded.version != loaded.version
+    assert reloaded.layout.n_features == 120
+    assert [info['sha1'] for info in registry.stats()] == [reloaded.sha1]
+
+
+def test_previous_version_is_kept_when_the_new_file_cannot_be_loaded():
+    first, _ = models()
+    path = os.path.join(tempfile.mkdtemp(), 'catboost.cbm')
+    replace_model(first, path, 0)
+    registry = mr.ModelRegistry(thread_count=1)
+    loaded = registry.get(path)
+
+    # File in fase di scrittura (troncato): si continua con la versione caricata
+    with open(first, 'rb') as f:
+        partial = f.read()[:1024]
+    with open(path, 'wb') as f:
+        f.write(partial)
+    assert registry.get(path) is loaded
+
+    # La stessa versione non caricabile non viene riletta a ogni richiesta
+    load = registry._load
+    loads = []
+    registry._load = lambda *args: loads.append(args) or load(*args)
+    try:
+        assert registry.get(path) is loaded and registry.get(path) is loaded
+        assert loads == []
+    finally:
+        registry._load = load
+
+    # Senza una versione precedente l'errore viene sollevato
+    try:
+        mr.ModelRegistry(thread_count=1).get(path)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("modello troncato caricato")
+    assert mr.ModelRegistry().preload(path) is None
+
+    # Completata la scrittura dello stesso modello la versione in memoria resta valida
+    replace_model(first, path, 10 ** 9)
+    assert registry.get(path) is loaded and loaded.mtime_ns == os.stat(path).st_mtime_ns
+
+
+if __name__ == "__main__":
+    test_model_is_reused_until_the_file_changes()
+    test_previous_version_is_kept_when_the_new_file_cannot_be_loaded()
+    print("✅ Test del registro dei modelli riusciti")
@@ -0,0 +1,105 @@
+"""
+Test della cache su disco dei file elaborati (parse_cache): hit, miss ed eviction LRU.
+
+Eseguibile con pytest oppure direttamente: python test_parse_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import parse_cache as pc  # noqa: E402
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+from feature_layout import FeatureLayout  # noqa: E402
+
+
+def gene_files(n_files, n_genes=200):
+    data_dir = tempfile.mkdtemp()
+    return [synthetic.write_gene_counts(os.path.join(data_dir, f"P{i}.rna_seq.augmented_star_gene_counts.tsv"),
+                                        seed=i, n_genes=n_genes)
+            for i in range(n_files)]
+
+
+def gene_layout(n_genes=200):
+    ids = synthetic.gene_ids(n_genes)[::3]
+    return FeatureLayout([f"gene_{gene_id}|{column}" for gene_id in ids for column in pre.GENE_FEATURE_COLUMNS])
+
+
+def fill(cache, path, layout):
+    num_row, cat_row = (row[0] for row in layout.new_rows(1))
+    calls = []
+
+    def filler(*args):
+        calls.append(args[0])
+        return pre.fill_gene_expression(*args)
+
+    pc.cached_fill("gene_expr", path, filler, layout, num_row, cat_row)
+    return num_row, bool(calls)
+
+
+def with_cache(cache, function, *args):
+    saved = pc.PARSE_CACHE_MAX_BYTES, pc._cache
+    pc.PARSE_CACHE_MAX_BYTES, pc._cache = cache.max_bytes, cache
+    try:
+        return function(cache, *args)
+    finally:
+        pc.PARSE_CACHE_MAX_BYTES, pc._cache = saved
+
+
+def test_default_directory_does_not_depend_on_the_working_directory():
+    if 'PARSE_CACHE_DIR' not in os.environ:
+        assert pc.PARSE_CACHE_DIR == os.path.join(BACKEND_DIR, 'assets', 'parse_cache')
+
+
+def test_hit_returns_the_parsed_values():
+    path, = gene_files(1)
+    layout = gene_layout()
+    cache = pc.ParseCache(tempfile.mkdtemp(), max_bytes=10 ** 9)
+
+    first, parsed = with_cache(cache, fill, path, layout)
+    assert parsed and (cache.hits, cache.misses) == (0, 1)
+    again, parsed = with_cache(cache, fill, path, layout)
+    assert not parsed and (cache.hits, cache.misses) == (1, 1)
+    np.testing.assert_array_equal(again, first)
+    assert cache.lookup_prefix(pc.file_hashes(path)[1], layout, "gene_expr") == pc.file_sha256(path)
+
+    # Un layout diverso (altro modello) ha voci proprie
+    _, parsed = with_cache(cache, fill, path, gene_layout(150))
+    assert parsed and cache.stats()['entries'] == 2
+
+
+def test_least_recently_used_entries_are_evicted():
+    paths = gene_files(3)
+    layout = gene_layout()
+    probe = pc.ParseCache(tempfile.mkdtemp(), max_bytes=10 ** 9)
+    with_cache(probe, fill, paths[0], layout)
+    entry_bytes = probe.stats()['bytes']
+
+    # Spazio per due file (voce e riferimento dal prefisso)
+    cache = pc.ParseCache(tempfile.mkdtemp(), max_bytes=2 * entry_bytes + entry_bytes // 2)
+    for path in paths[:2]:
+        with_cache(cache, fill, path, layout)
+        # mtime distinti anche su filesystem a bassa risoluzione
+        time.sleep(0.02)
+    # Il primo file viene riletto: il meno recente diventa il secondo
+    assert not with_cache(cache, fill, paths[0], layout)[1]
+    time.sleep(0.02)
+    with_cache(cache, fill, paths[2], layout)
+
+    assert cache.evictions == 2 and cache.stats()['entries'] == 2
+    assert not with_cache(cache, fill, paths[0], layout)[1]
+    assert with_cache(cache, fill, paths[1], layout)[1]
+
+
+if __name__ == "__main__":
+    test_default_directory_does_not_depend_on_the_working_directory()
+    test_hit_returns_the_parsed_values()
+    test_least_recently_used_entries_are_evicted()
+    print("✅ Test della cache dei file elaborati riusciti")
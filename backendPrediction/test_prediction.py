@@ -0,0 +1,188 @@
+"""
+Test della predizione: allineamento al modello, soglia di decisione e top features (explain: none, global, shap).
+
+Usa la coorte sintetica di benchmarks/synthetic.py con un piccolo modello addestrato al volo.
+
+Eseguibile con pytest oppure direttamente: python test_prediction.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+import gene_index as gi  # noqa: E402
+import model_registry as mr  # noqa: E402
+import prediction as pred  # noqa: E402
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+
+_files = None
+_workspace = None
+
+
+def files():
+    """Coorte sintetica e modello addestrato sui suoi pazienti, generati una volta per processo"""
+    global _files
+    if _files is None:
+        _files = synthetic.write_workspace(tempfile.mkdtemp(), 4, n_genes=500, n_mirnas=50,
+                                           isoforms_per_mirna=2, model_features=200, iterations=20)
+    return _files
+
+
+def workspace():
+    """Modello sintetico e matrice allineata dei suoi pazienti"""
+    global _workspace
+    if _workspace is None:
+        loaded_model = mr.ModelRegistry(thread_count=1).get(files()['model_path'])
+        patient_ids, aligned = pre.create_patient_matrix_from_json(files()['manifest'], '', loaded_model.layout)
+        _workspace = loaded_model, patient_ids, aligned
+    return _workspace
+
+
+def reference_align(sample_df, model):
+    """Allineamento originale (una colonna per feature del modello, 0 se assente) usato come riferimento"""
+    columns = [sample_df[[feature]] if feature in sample_df.columns
+               else pd.DataFrame({feature: [0] * len(sample_df)}, index=sample_df.index)
+               for feature in model.feature_names_]
+    aligned_df = pre.check_and_replace_nan_in_dataframe(pd.concat(columns, axis=1))
+    for cat_idx in model.get_cat_feature_indices():
+        col_name = aligned_df.columns[cat_idx]
+        aligned_df[col_name] = aligned_df[col_name].fillna("missing").astype(str)
+    return aligned_df
+
+
+def test_alignment_plan_matches_reference_alignment():
+    loaded_model, _, _ = workspace()
+    sample_df = pre.create_patient_dataset_from_json(files()['manifest'], '')
+    # Feature del modello assenti dal sample (0 o "0") e colonne sconosciute al modello
+    sample_df = sample_df.drop(columns=loaded_model.layout.feature_names[::3])
+    sample_df['gene_ENSG_ASSENTE|unstranded'] = 1.0
+
+    aligned = pred.align_features_with_model(sample_df, loaded_model)
+    expected = reference_align(sample_df, loaded_model.model)
+    assert aligned.shape == expected.shape
+    for position in range(aligned.shape[1]):
+        if loaded_model.layout.is_cat[position]:
+            assert aligned[:, position].tolist() == expected.iloc[:, position].tolist()
+        else:
+            np.testing.assert_array_equal(aligned[:, position].astype(np.float32),
+                                          expected.iloc[:, position].to_numpy(dtype=np.float32))
+    np.testing.assert_allclose(loaded_model.model.predict_proba(pred.make_pool(loaded_model, aligned)),
+                               loaded_model.model.predict_proba(expected))
+
+
+def test_explain_modes_share_the_prediction():
+    loaded_model, patient_ids, aligned = workspace()
+    results = {explain: pred.predict_batch(aligned, loaded_model, top_features=5, explain=explain,
+                                           patient_ids=patient_ids)
+               for explain in pred.EXPLAIN_MODES}
+    for explain, explained in results.items():
+        assert [result['patient_id'] for result in explained] == patient_ids
+        assert [result['prediction'] for result in explained] == [result['prediction'] for result in results['none']]
+        assert all(result['explanation'] == explain for result in explained)
+    assert all(result['top_features'].empty for result in results['none'])
+
+    try:
+        pred.predict_batch(aligned, loaded_model, explain='lime')
+    except ValueError as e:
+        assert "lime" in str(e)
+    else:
+        raise AssertionError("explain non valido accettato")
+
+
+def test_global_explanation_uses_the_model_ranking():
+    loaded_model, _, aligned = workspace()
+    importance = loaded_model.model.get_feature_importance()
+    expected = np.asarray(loaded_model.layout.feature_names)[np.argsort(-importance, kind='stable')[:5]]
+
+    for row, result in zip(aligned, pred.predict_batch(aligned, loaded_model, top_features=5)):
+        top = result['top_features']
+        assert top['feature'].tolist() == expected.tolist()
+        positions = [loaded_model.layout.feature_names.index(name) for name in top['feature']]
+        # Valori del sample con la precisione della matrice float32
+        assert top['sample_value'].tolist() == [float(str(np.float32(value))) for value in row[positions]]
+
+
+def test_shap_explanation_is_per_sample_and_cached():
+    loaded_model, _, aligned = workspace()
+    loaded_model.shap_cache.clear()
+    shap_values = loaded_model.model.get_feature_importance(
+        Pool(aligned, cat_features=loaded_model.layout.cat_positions.tolist() or None,
+             feature_names=loaded_model.layout.feature_names), type='ShapValues')
+
+    results = pred.predict_batch(aligned, loaded_model, top_features=5, explain='shap')
+    assert len(loaded_model.shap_cache) == len(aligned)
+    for values, result in zip(shap_values, results):
+        contributions = values[:-1]
+        top = result['top_features']
+        # I contributi più grandi in valore assoluto, in ordine decrescente
+        assert np.allclose(np.abs(top['importance']), np.sort(np.abs(contributions))[::-1][:5])
+        positions = [loaded_model.layout.feature_names.index(name) for name in top['feature']]
+        assert np.allclose(top['importance'], contributions[positions])
+        assert np.isclose(result['shap_expected_value'], values[-1])
+
+    # Gli stessi sample vengono serviti dalla cache, con le stesse spiegazioni
+    again = pred.predict_batch(aligned, loaded_model, top_features=5, explain='shap')
+    for result, cached in zip(results, again):
+        assert result['top_features'].equals(cached['top_features'])
+    assert len(loaded_model.shap_cache) == len(aligned)
+
+
+def test_decide_classes_uses_the_threshold_for_binary_models():
+    binary = np.array([[0.6, 0.4], [0.4, 0.6], [0.5, 0.5]])
+    assert pred.decide_classes(binary).tolist() == [0, 1, 1]
+    assert pred.decide_classes(binary, 0.7).tolist() == [0, 0, 0]
+    assert pred.decide_classes(binary, 0.4).tolist() == [1, 1, 1]
+    # Multiclasse: la classe più probabile, la soglia non si applica
+    multiclass = np.array([[0.2, 0.5, 0.3], [0.6, 0.1, 0.3]])
+    assert pred.decide_classes(multiclass, 0.9).tolist() == [1, 0]
+
+    # Con la soglia di default stesse classi di model.predict, probabilità di predict_proba
+    loaded_model, _, aligned = workspace()
+    pool = pred.make_pool(loaded_model, aligned)
+    results = pred.predict_batch(aligned, loaded_model, explain='none')
+    assert [result['prediction'] for result in results] == loaded_model.model.predict(pool).ravel().tolist()
+    np.testing.assert_array_equal([result['prediction_probability'] for result in results],
+                                  loaded_model.model.predict_proba(pool))
+    probabilities = loaded_model.model.predict_proba(pool)[:, 1]
+    threshold = float(np.median(probabilities))
+    results = pred.predict_batch(aligned, loaded_model, explain='none', threshold=threshold)
+    assert [result['predicted_class'] for result in results] == (probabilities >= threshold).astype(int).tolist()
+    for result in results:
+        assert result['confidence'] == result['prediction_probability'][result['predicted_class']]
+
+
+def test_ranking_is_kept_only_with_gene_names():
+    loaded_model, _, _ = workspace()
+    base_dir = tempfile.mkdtemp()
+
+    # Senza TSV dei geni la classifica usa gli ID delle feature e non viene conservata
+    ranking = pred.get_top_feature_ranking(loaded_model, 10, base_dir)
+    assert ranking['gene_name'].tolist() == ranking['feature'].tolist()
+    assert (10, base_dir) not in loaded_model.rankings
+
+    os.makedirs(os.path.join(base_dir, 'assets', 'data'))
+    synthetic.write_gene_counts(os.path.join(base_dir, 'assets', 'data', 'P.rna_seq.augmented_star_gene_counts.tsv'),
+                                n_genes=500)
+    gi._missing_since.pop(base_dir, None)
+    ranking = pred.get_top_feature_ranking(loaded_model, 10, base_dir)
+    gene_features = ranking['feature'].str.startswith('gene_')
+    assert gene_features.any() and ranking.loc[gene_features, 'gene_name'].str.startswith('GENE').all()
+    assert pred.get_top_feature_ranking(loaded_model, 10, base_dir) is ranking
+
+
+if __name__ == "__main__":
+    test_alignment_plan_matches_reference_alignment()
+    test_explain_modes_share_the_prediction()
+    test_global_explanation_uses_the_model_ranking()
+    test_shap_explanation_is_per_sample_and_cached()
+    test_decide_classes_uses_the_threshold_for_binary_models()
+    test_ranking_is_kept_only_with_gene_names()
+    print("✅ Test della predizione riusciti")
@@ -0,0 +1,267 @@
+"""
+Test di regressione per il parsing dei file di isoforme miRNA.
+
+Eseguibile con pytest oppure direttamente: python test_preprocessing.py
+"""
+
+import glob
+import gzip
+import os
+import string
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+import preprocessing as pre  # noqa: E402
+import synthetic  # noqa: E402
+from feature_layout import FeatureLayout, isoform_suffix_ordinals, isoform_suffix_table  # noqa: E402
+
+DATA_DIR = os.path.join(BACKEND_DIR, "assets", "data")
+
+
+def reference_process_mirna_isoform(file_path, prefix="mirna_iso"):
+    """Implementazione originale (suffissi con lambda riga per riga) usata come riferimento"""
+    df = pd.read_csv(file_path, sep='\t', comment='#')
+    feature_columns = ["read_count", "reads_per_million_miRNA_mapped", "miRNA_region"]
+    if "isoform_coords" in df.columns:
+        id_col = "miRNA_ID"
+        coord_col = "isoform_coords"
+    else:
+        id_col = next((col for col in df.columns if "miRNA" in col or "mirna" in col), "miRNA_ID")
+        coord_col = next((col for col in df.columns if "coord" in col), "isoform_coords")
+    required_cols = [id_col, coord_col] + [col for col in feature_columns if col in df.columns]
+    df = df[required_cols].dropna()
+    df['unique_suffix'] = (
+        df.groupby(id_col).cumcount().apply(lambda x: string.ascii_lowercase[x % 26] + (str(x // 26) if x >= 26 else ""))
+    )
+    df['unique_id'] = df[id_col] + "_" + df['unique_suffix']
+    row_data = {}
+    for feature in feature_columns:
+        if feature in df.columns:
+            feature_series = df.set_index('unique_id')[feature]
+            feature_series.index = [f"{prefix}_{id}|{feature}" for id in feature_series.index]
+            row_data.update(feature_series.to_dict())
+    return row_data
+
+
+def write_synthetic_isoform_file(path):
+    """Scrive un file di isoforme con più di 26 isoforme per miRNA, righe NA e miRNA ripetuti"""
+    rng = np.random.default_rng(0)
+    mirna_ids = ["hsa-let-7a-1"] * 60 + ["hsa-mir-21"] * 5 + ["hsa-mir-155"] * 30 + ["hsa-let-7a-1"] * 3
+    n = len(mirna_ids)
+    df = pd.DataFrame({
+        "miRNA_ID": mirna_ids,
+        "isoform_coords": [f"hg38:chr1:{i}-{i + 22}:+" for i in range(n)],
+        "read_count": rng.integers(0, 500, n),
+        "reads_per_million_miRNA_mapped": rng.random(n) * 100,
+        "cross-mapped": ["N"] * n,
+        "miRNA_region": rng.choice(["mature,MIMAT0000062", "precursor", "stemloop"], n),
+    })
+    df.loc[[3, 40], "miRNA_region"] = np.nan
+    df.to_csv(path, sep='\t', index=False)
+
+
+def isoform_files():
+    """File di isoforme reali presenti in assets/data, più uno sintetico"""
+    tmp_dir = tempfile.mkdtemp()
+    synthetic = os.path.join(tmp_dir, "synthetic.mirbase21.isoforms.quantification.txt")
+    write_synthetic_isoform_file(synthetic)
+    return [synthetic] + sorted(glob.glob(os.path.join(DATA_DIR, "*isoforms.quantification.txt")))[:3]
+
+
+def test_suffix_table_matches_reference():
+    table = isoform_suffix_table(26 * 5)
+    expected = [string.ascii_lowercase[x % 26] + (str(x // 26) if x >= 26 else "") for x in range(26 * 5)]
+    assert table.tolist() == expected
+    assert isoform_suffix_ordinals(expected).tolist() == list(range(26 * 5))
+    assert isoform_suffix_ordinals(["a0", "A", "", "ab"]).tolist() == [-1, -1, -1, -1]
+
+
+def test_process_mirna_isoform_identical_output():
+    for path in isoform_files():
+        expected = reference_process_mirna_isoform(path)
+        result = pre.process_mirna_isoform(path)
+        assert list(result.keys()) == list(expected.keys()), path
+        assert result == expected, path
+
+
+def test_fill_mirna_isoform_matches_dict_parser():
+    for path in isoform_files():
+        row_data = reference_process_mirna_isoform(path)
+        # Layout con tutte le feature del file più alcune assenti, categoriche per miRNA_region
+        feature_names = list(row_data.keys()) + ["mirna_iso_hsa-mir-1_a|read_count",
+                                                 "mirna_iso_hsa-mir-1_a|miRNA_region",
+                                                 "gene_ENSG00000000003.15|unstranded"]
+        cat_indices = [i for i, name in enumerate(feature_names) if name.endswith("|miRNA_region")]
+        layout = FeatureLayout(feature_names, cat_indices)
+
+        num, cat = layout.new_rows(2)
+        layout.scatter_dict(row_data, num[0], cat[0])
+        matched = pre.fill_mirna_isoform(path, layout, num[1], cat[1])
+
+        assert matched == len(row_data) // 3, path
+        np.testing.assert_array_equal(num[0], num[1])
+        assert cat[0].tolist() == cat[1].tolist(), path
+
+
+def test_fill_gene_expression_matches_dict_parser():
+    path = synthetic.write_gene_counts(os.path.join(tempfile.mkdtemp(), "P.rna_seq.augmented_star_gene_counts.tsv"),
+                                       n_genes=500)
+    # Gene ripetuto con valori diversi: vale la prima occorrenza
+    with open(path) as f:
+        lines = f.readlines()
+    duplicate = lines[10].split("\t")
+    duplicate[3] = "123456"
+    with open(path, "a") as f:
+        f.write("\t".join(duplicate))
+    gzipped = os.path.join(tempfile.mkdtemp(), os.path.basename(path) + ".gz")
+    with open(path, "rb") as src, gzip.open(gzipped, "wb") as dst:
+        dst.write(src.read())
+
+    row_data = pre.process_gene_expression(path)
+    feature_names = list(row_data)[::7] + ["gene_ENSG_ASSENTE|unstranded", "gene_N_unmapped|unstranded",
+                                           "mirna_agg_hsa-mir-1|read_count"]
+    layout = FeatureLayout(feature_names)
+    num, cat = layout.new_rows(3)
+    layout.scatter_dict(row_data, num[0], cat[0])
+
+    chunksize = pre.GENE_READ_CHUNKSIZE
+    # Blocchi piccoli: il gene ripetuto e il suo duplicato sono in blocchi diversi
+    pre.GENE_READ_CHUNKSIZE = 64
+    try:
+        matched = pre.fill_gene_expression(path, layout, num[1], cat[1])
+        pre.fill_gene_expression(gzipped, layout, num[2], cat[2])
+    finally:
+        pre.GENE_READ_CHUNKSIZE = chunksize
+
+    assert matched > 0
+    np.testing.assert_array_equal(num[1], num[0])
+    np.testing.assert_array_equal(num[2], num[0])
+    assert num[0][-3:].tolist() == [0, 0, 0]
+
+    header_only = os.path.join(tempfile.mkdtemp(), "Q.rna_seq.augmented_star_gene_counts.tsv")
+    with open(header_only, "w") as f:
+        f.write("gene_id\tunstranded\n")
+    try:
+        pre.fill_gene_expression(header_only, layout, num[0], cat[0])
+    except ValueError as e:
+        assert "tpm_unstranded" in str(e)
+    else:
+        raise AssertionError("colonne mancanti non segnalate")
+
+
+def test_fill_placeholder_uses_model_features():
+    feature_names = ["gene_ENSG00000000003.15|unstranded",
+                     "mirna_iso_hsa-mir-21_a|read_count", "mirna_iso_hsa-mir-21_a|miRNA_region",
+                     "mirna_agg_hsa-mir-21|read_count"]
+    layout = FeatureLayout(feature_names, [2])
+    num, cat = layout.new_rows(1)
+
+    assert layout.fill_placeholder("mirna_iso", num[0], cat[0]) == 2
+    row = layout.assemble(num, cat)[0]
+    assert row[0] == 0 and np.isnan(row[1]) and row[2] == "missing" and row[3] == 0
+
+
+def test_cohort_missing_mirna_uses_layout_templates():
+    data_dir = tempfile.mkdtemp()
+    data = synthetic.write_cohort(data_dir, 2, n_genes=50, n_mirnas=10)
+    complete, incomplete = data["tumor"]["TCGA-BM-0001"], data["normal"]["TCGA-BM-0000"]
+    data["normal"]["TCGA-BM-0000"] = incomplete[:1]
+    # Nessun file campione da leggere: le colonne mancanti non dipendono dalla cartella di lavoro
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        df = pre.create_patient_dataset_from_json(data, "")
+        # Con il layout di un modello valgono le sue feature e i suoi template
+        model_layout = FeatureLayout(["mirna_iso_hsa-mir-1_a|miRNA_region", "mirna_agg_hsa-mir-1|read_count",
+                                      df.columns[0]], [0])
+        model_df = pre.create_patient_dataset_from_json(data, "", layout=model_layout)
+    finally:
+        os.chdir(cwd)
+
+    mirna_columns = [name for name in df.columns if name.startswith("mirna_")]
+    expected = set(pre._modality_feature_names("mirna_iso", complete[1])[0].tolist())
+    assert expected <= set(mirna_columns)
+    assert df.loc["TCGA-BM-0000", mirna_columns].isna().all()
+    assert df.loc["TCGA-BM-0001", mirna_columns].notna().any()
+    assert list(model_df.columns) == model_layout.feature_names
+    row = model_df.loc["TCGA-BM-0000"].tolist()
+    assert row[0] == "missing" and np.isnan(row[1]) and not np.isnan(row[2])
+
+
+def test_align_marks_missing_mirna_modalities():
+    data = synthetic.write_cohort(tempfile.mkdtemp(), 2, n_genes=50, n_mirnas=10)
+    # Nessun paziente ha file miRNA: la coorte senza layout non ha colonne miRNA
+    data = {category: {patient_id: files[:1] for patient_id, files in patients.items()}
+            for category, patients in data.items()}
+    df = pre.create_patient_dataset_from_json(data, "")
+    assert not df.columns.str.startswith("mirna_").any()
+
+    model_layout = FeatureLayout(["mirna_iso_hsa-mir-1_a|miRNA_region", "mirna_agg_hsa-mir-1|read_count",
+                                  df.columns[0], "gene_ENSG_ASSENTE|unstranded"], [0])
+    aligned = model_layout.align(df, pre.MIRNA_MODALITIES)
+    # Come con fill_placeholder: miRNA mancanti, geni assenti dal sample a 0
+    for row in aligned:
+        assert row[0] == "missing" and np.isnan(row[1]) and not np.isnan(row[2]) and row[3] == 0
+    assert (model_layout.align(df)[:, 1] == 0).all()
+
+
+def test_cohort_matrix_matches_aligned_dataset_without_mirna():
+    data = synthetic.write_cohort(tempfile.mkdtemp(), 3, n_genes=50, n_mirnas=10)
+    columns = pre.create_patient_dataset_from_json(data, "").columns
+    # Layout di un modello con parte delle feature di ogni modalità e una feature assente dai file
+    feature_names = list(columns[::5]) + ["mirna_agg_hsa-mir-9999|read_count"]
+    model_layout = FeatureLayout(feature_names, [i for i, name in enumerate(feature_names)
+                                                if name.endswith("|miRNA_region")])
+    assert model_layout.has_cat_features
+
+    # Coorte senza file miRNA: stessa matrice in place e dal dataset allineato al modello
+    data = {category: {patient_id: files[:1] for patient_id, files in patients.items()}
+            for category, patients in data.items()}
+    cohort = pre.build_patient_cohort(data, "", model_layout)
+    df = pre.create_patient_dataset_from_json(data, "")
+    assert cohort.patient_ids == df.index.tolist()
+    expected = model_layout.align(df, pre.MIRNA_MODALITIES)
+    pd.testing.assert_frame_equal(pd.DataFrame(cohort.matrix()), pd.DataFrame(expected))
+    assert pd.isna(cohort.matrix()[:, -1]).all()
+
+
+def test_parallel_dataset_matches_serial():
+    data = synthetic.write_cohort(tempfile.mkdtemp(), 5, n_genes=80, n_mirnas=15)
+    # Un paziente senza espressione genica (scartato) e uno con un file miRNA inesistente
+    data["normal"]["TCGA-BM-9998"] = data["tumor"]["TCGA-BM-0001"][1:]
+    data["tumor"]["TCGA-BM-9999"] = data["tumor"]["TCGA-BM-0003"][:2] + ["assente.mirbase21.mirnas.quantification.txt"]
+
+    serial_errors, parallel_errors = [], []
+    serial = pre.create_patient_dataset_from_json(data, "", workers=1, errors=serial_errors)
+    parallel = pre.create_patient_dataset_from_json(data, "", workers=3, chunksize=1, errors=parallel_errors)
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert serial.index.tolist() == [patient_id for patients in data.values() for patient_id in patients
+                                     if patient_id != "TCGA-BM-9998"]
+    assert parallel_errors == serial_errors and len(serial_errors) == 2
+
+    # Stesso risultato con il layout di un modello, anche con un pool condiviso
+    layout = FeatureLayout(list(serial.columns[::4]), [i for i, name in enumerate(serial.columns[::4])
+                                                       if name.endswith("|miRNA_region")])
+    expected = pre.build_patient_cohort(data, "", layout, workers=1).matrix()
+    with pre.patient_pool(2, layout) as executor:
+        shared = pre.build_patient_cohort(data, "", layout, workers=2, executor=executor).matrix()
+    pd.testing.assert_frame_equal(pd.DataFrame(shared), pd.DataFrame(expected))
+
+
+if __name__ == "__main__":
+    test_suffix_table_matches_reference()
+    test_process_mirna_isoform_identical_output()
+    test_fill_mirna_isoform_matches_dict_parser()
+    test_fill_gene_expression_matches_dict_parser()
+    test_fill_placeholder_uses_model_features()
+    test_cohort_missing_mirna_uses_layout_templates()
+    test_align_marks_missing_mirna_modalities()
+    test_cohort_matrix_matches_aligned_dataset_without_mirna()
+    test_parallel_dataset_matches_serial()
+    print("✅ Test preprocessing riusciti")
@@ -11,6 +11,15 @@ import time
 import logging
 from functools import wraps
 import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import circuit_breaker
+import efetch_parser
+import pubmed_cache
+import rabbithole_ledger
+import rate_limiter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,15 +36,132 @@ app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', './uploads')
 if app.config['SECRET_KEY'] == 'dev-secret-key-change-in-production' and os.getenv('FLASK_ENV') == 'production':
     logger.warning("⚠️  ATTENZIONE: Stai usando la SECRET_KEY di default in produzione! Cambiala nel file .env")
 
+# NCBI E-utilities budget: 3 requests/second per host, 10 with an API key
+NCBI_API_KEY = os.getenv('NCBI_API_KEY', '')
+NCBI_REQUESTS_PER_SECOND = float(os.getenv('NCBI_REQUESTS_PER_SECOND', 10 if NCBI_API_KEY else 3))
+# State file of the token bucket shared by all the frontend workers
+NCBI_RATE_LIMIT_PATH = os.getenv('NCBI_RATE_LIMIT_PATH', rate_limiter.default_path('ncbi_eutils'))
+# efetch batches in flight at the same time (the rate limit still applies)
+PUBMED_FETCH_WORKERS = int(os.getenv('PUBMED_FETCH_WORKERS', 4))
+# Retries of a request answered with 429/5xx or failed to connect, with exponential backoff
+PUBMED_MAX_RETRIES = int(os.getenv('PUBMED_MAX_RETRIES', 4))
+PUBMED_MAX_BACKOFF = float(os.getenv('PUBMED_MAX_BACKOFF', 30))
+
+# Documents posted to Cheshire Cat's rabbithole at the same time
+RABBITHOLE_UPLOAD_WORKERS = int(os.getenv('RABBITHOLE_UPLOAD_WORKERS', 4))
+# Cheshire Cat health: seconds between background probes, timeout of a probe,
+# consecutive failures that open the circuit and seconds before a trial request
+CHESHIRE_HEALTH_INTERVAL = float(os.getenv('CHESHIRE_HEALTH_INTERVAL', 15))
+CHESHIRE_PROBE_TIMEOUT = float(os.getenv('CHESHIRE_PROBE_TIMEOUT', 5))
+CHESHIRE_FAILURE_THRESHOLD = int(os.getenv('CHESHIRE_FAILURE_THRESHOLD', 3))
+CHESHIRE_RESET_TIMEOUT = float(os.getenv('CHESHIRE_RESET_TIMEOUT', 30))
+
+def retry_after_seconds(response):
+    """Delay requested by a Retry-After header (seconds or HTTP date), None if absent or invalid"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def summarize_uploads(results):
+    """
+    Counts of a rabbithole upload from the per-document results.
+
+    Returns:
+        tuple: (documents available to the Cat, uploaded now or already ingested;
+        PMIDs that failed to upload)
+    """
+    available = sum(1 for result in results if result['status'] in ('uploaded', 'already_ingested'))
+    failed_uploads = [result['pmid'] for result in results if result['status'] == 'failed']
+    return available, failed_uploads
+
+
 class PubMedClient:
-    def __init__(self):
-        self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+    def __init__(self, base_url=None, cache=None, limiter=None, fetch_workers=PUBMED_FETCH_WORKERS,
+                 max_retries=PUBMED_MAX_RETRIES, api_key=NCBI_API_KEY):
+        if base_url is None:
+            base_url = os.getenv('PUBMED_BASE_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/')
+        self.base_url = base_url.rstrip('/') + '/'
         self.search_url = f"{self.base_url}esearch.fcgi"
         self.fetch_url = f"{self.base_url}efetch.fcgi"
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Gene-Research-App/1.0 (mailto:your-email@example.com)'
         })
+        # Enough pooled connections for the concurrent efetch batches
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, fetch_workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Optional pubmed_cache.PubMedCache shared by the workers
+        self.cache = cache
+        # Every E-utilities request takes a token from the bucket shared by the workers
+        if limiter is None:
+            limiter = rate_limiter.TokenBucket(NCBI_REQUESTS_PER_SECOND, path=NCBI_RATE_LIMIT_PATH)
+        self.limiter = limiter
+        self.fetch_workers = max(1, fetch_workers)
+        self.max_retries = max_retries
+        self.api_key = api_key
+    
+    def _get(self, url, params, timeout, stream=False):
+        """
+        GET to E-utilities under the rate limit.
+        
+        429 and 5xx responses and connection errors are retried with exponential
+        backoff (or after the Retry-After delay); a 429 also pauses the other workers.
+        With stream=True the body is left unread and the caller must close the response.
+        """
+        if self.api_key:
+            params = {**params, 'api_key': self.api_key}
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout, stream=stream)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(PUBMED_MAX_BACKOFF, 2 ** attempt)
+                logger.warning(f"PubMed connection error, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+            
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                # Returns the connection to the pool before retrying
+                response.close()
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = 2 ** attempt
+                delay = min(PUBMED_MAX_BACKOFF, delay)
+                if response.status_code == 429:
+                    self.limiter.penalize(delay)
+                else:
+                    time.sleep(delay)
+                logger.warning(f"PubMed returned {response.status_code}, retrying in {delay:.1f}s "
+                               f"(attempt {attempt + 1}/{self.max_retries})")
+                continue
+            
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                response.close()
+                raise
+            return response
+    
+    def _cache_call(self, method, *args):
+        """Call a cache method; cache failures are logged and treated as misses"""
+        if self.cache is None:
+            return None
+        try:
+            return getattr(self.cache, method)(*args)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"PubMed cache unavailable ({method}): {e}")
+            return None
     
     def validate_gene_name(self, gene_name):
         """Validate gene name format"""
@@ -60,10 +186,14 @@ class PubMedClient:
             'sort': 'relevance'
         }
         
+        cached = self._cache_call('get_search', params['term'], max_results)
+        if cached is not None:
+            logger.info(f"Found {len(cached)} cached articles for {gene_name}")
+            return cached
+        
         try:
             logger.info(f"Searching PubMed for gene: {gene_name}")
-            response = self.session.get(self.search_url, params=params, timeout=30)
-            response.raise_for_status()
+            response = self._get(self.search_url, params, timeout=30)
             
             root = ET.fromstring(response.content)
             
@@ -75,12 +205,13 @@ class PubMedClient:
                     logger.warning(f"PubMed search warning: {error_msg.text}")
             
             id_list = root.find('IdList')
+            pmids = []
             if id_list is not None:
                 pmids = [id_elem.text for id_elem in id_list.findall('Id')]
                 logger.info(f"Found {len(pmids)} articles for {gene_name}")
-                return pmids
             
-            return []
+            self._cache_call('put_search', params['term'], max_results, pmids)
+            return pmids
         except requests.exceptions.Timeout:
             logger.error("PubMed search timeout")
             raise Exception("PubMed search timed out. Please try again.")
@@ -96,171 +227,197 @@ class PubMedClient:
         if not pmids:
             return []
         
-        # Process in batches to avoid overwhelming the API
+        # Articles parsed by a previous request are not fetched again
+        cached = self._cache_call('get_articles', pmids) or {}
+        requested = pmids
+        pmids = [pmid for pmid in pmids if pmid not in cached]
+        if cached:
+            logger.info(f"{len(cached)}/{len(requested)} articles served from cache")
+        
+        # Batches of 20 PMIDs, fetched concurrently: the shared token bucket
+        # keeps the request rate within the NCBI budget
         batch_size = 20
+        batches = [pmids[i:i + batch_size] for i in range(0, len(pmids), batch_size)]
         all_articles = []
         
-        for i in range(0, len(pmids), batch_size):
-            batch_pmids = pmids[i:i+batch_size]
-            logger.info(f"Fetching batch {i//batch_size + 1}/{(len(pmids)-1)//batch_size + 1}")
-            
-            params = {
-                'db': 'pubmed',
-                'id': ','.join(batch_pmids),
-                'retmode': 'xml'
-            }
-            
-            try:
-                response = self.session.get(self.fetch_url, params=params, timeout=60)
-                response.raise_for_status()
-                
-                root = ET.fromstring(response.content)
-                articles = self._parse_articles(root)
-                all_articles.extend(articles)
-                
-                # Be respectful to NCBI servers
-                if i + batch_size < len(pmids):
-                    time.sleep(1)
-                    
-            except Exception as e:
-                logger.error(f"Error fetching batch {i//batch_size + 1}: {e}")
-                continue
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(batches))) as executor:
+                # Results are collected in batch order
+                for articles in executor.map(self._fetch_batch, range(len(batches)), batches,
+                                             [len(batches)] * len(batches)):
+                    all_articles.extend(articles)
         
         logger.info(f"Successfully fetched {len(all_articles)} articles")
-        return all_articles
-    
-    def _parse_articles(self, root):
-        """Parse articles from XML response"""
-        articles = []
+        self._cache_call('put_articles', all_articles)
         
-        for article in root.findall('.//PubmedArticle'):
-            try:
-                # Extract title
-                title_elem = article.find('.//ArticleTitle')
-                title = self._clean_text(title_elem.text if title_elem is not None else "No title")
-                
-                # Extract abstract - handle multiple abstract sections
-                abstract_texts = []
-                for abstract_elem in article.findall('.//Abstract/AbstractText'):
-                    if abstract_elem.text:
-                        # Check if it has a label attribute
-                        label = abstract_elem.get('Label', '')
-                        text = self._clean_text(abstract_elem.text)
-                        if label:
-                            abstract_texts.append(f"{label}: {text}")
-                        else:
-                            abstract_texts.append(text)
-                
-                abstract = ' '.join(abstract_texts) if abstract_texts else "No abstract available"
-                
-                # Extract PMID
-                pmid_elem = article.find('.//PMID')
-                pmid = pmid_elem.text if pmid_elem is not None else "No PMID"
-                
-                # Extract publication date
-                pub_date = article.find('.//PubDate')
-                year = "Unknown"
-                if pub_date is not None:
-                    year_elem = pub_date.find('Year')
-                    if year_elem is not None:
-                        year = year_elem.text
-                
-                # Extract authors
-                authors = []
-                for author in article.findall('.//Author'):
-                    last_name = author.find('LastName')
-                    first_name = author.find('ForeName')
-                    if last_name is not None:
-                        author_name = last_name.text
-                        if first_name is not None:
-                            author_name += f", {first_name.text}"
-                        authors.append(author_name)
-                
-                # Extract journal
-                journal_elem = article.find('.//Journal/Title')
-                journal = journal_elem.text if journal_elem is not None else "Unknown Journal"
-                
-                articles.append({
-                    'pmid': pmid,
-                    'title': title,
-                    'abstract': abstract,
-                    'year': year,
-                    'authors': authors[:5],  # Limit to first 5 authors
-                    'journal': journal
-                })
-            except Exception as e:
-                logger.error(f"Error parsing individual article: {e}")
-                continue
-        
-        return articles
+        if not cached:
+            return all_articles
+        # Cached and fetched articles in the order of the requested PMIDs
+        by_pmid = {**cached, **{article['pmid']: article for article in all_articles}}
+        return [by_pmid[pmid] for pmid in dict.fromkeys(requested) if pmid in by_pmid]
     
-    def _clean_text(self, text):
-        """Clean and normalize text"""
-        if not text:
-            return ""
-        # Remove extra whitespace and normalize
-        return ' '.join(text.split())
+    def _fetch_batch(self, index, batch_pmids, n_batches):
+        """Fetch and parse one efetch batch; errors are logged and give no articles"""
+        logger.info(f"Fetching batch {index + 1}/{n_batches}")
+        params = {
+            'db': 'pubmed',
+            'id': ','.join(batch_pmids),
+            'retmode': 'xml'
+        }
+        try:
+            # Articles are parsed while the response arrives, without building the whole tree
+            with self._get(self.fetch_url, params, timeout=60, stream=True) as response:
+                response.raw.decode_content = True
+                return efetch_parser.parse_articles(response.raw)
+        except Exception as e:
+            logger.error(f"Error fetching batch {index + 1}: {e}")
+            return []
 
 class CheshireCatClient:
-    def __init__(self, base_url=None):
+    def __init__(self, base_url=None, ledger=None, upload_workers=RABBITHOLE_UPLOAD_WORKERS, breaker=None):
         if base_url is None:
             base_url = os.getenv('CHESHIRE_CAT_URL', 'http://localhost:1865')
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Gene-Research-App/1.0'        })
+        # Enough pooled connections for the concurrent uploads
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, upload_workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Optional rabbithole_ledger.IngestLedger of the documents already ingested
+        self.ledger = ledger
+        self.upload_workers = max(1, upload_workers)
+        # Cached health state: calls fail fast while Cheshire Cat is down
+        if breaker is None:
+            breaker = circuit_breaker.CircuitBreaker(
+                self.probe, name='Cheshire Cat', failure_threshold=CHESHIRE_FAILURE_THRESHOLD,
+                reset_timeout=CHESHIRE_RESET_TIMEOUT, interval=CHESHIRE_HEALTH_INTERVAL)
+        self.breaker = breaker
     
-    def test_connection(self):
-        """Test connection to Cheshire Cat"""
+    def probe(self):
+        """Request to Cheshire Cat's root, used by the circuit breaker's health probe"""
         try:
-            response = self.session.get(f"{self.base_url}/", timeout=10)
+            response = self.session.get(f"{self.base_url}/", timeout=CHESHIRE_PROBE_TIMEOUT)
             return response.status_code == 200
-        except:
+        except requests.exceptions.RequestException:
             return False
     
+    def test_connection(self):
+        """Cached health of Cheshire Cat (no request: see the circuit breaker)"""
+        return self.breaker.is_available()
+    
+    def _record_outcome(self, error=None):
+        """
+        Reports a call to the breaker: only connection errors and timeouts are failures.
+        
+        Any HTTP response, even a 5xx, means the Cat is reachable: the error belongs
+        to that request (e.g. one document the rabbithole could not ingest).
+        """
+        if error is None:
+            self.breaker.record_success()
+        elif isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            self.breaker.record_failure()
+    
+    def _ledger_call(self, method, *args):
+        """Call a ledger method; ledger failures are logged and treated as nothing ingested"""
+        if self.ledger is None:
+            return None
+        try:
+            return getattr(self.ledger, method)(*args)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Rabbithole ledger unavailable ({method}): {e}")
+            return None
+    
     def upload_documents(self, documents):
-        """Upload documents to Cheshire Cat with better error handling"""
-        if not self.test_connection():
-            raise Exception(f"Cannot connect to Cheshire Cat at {self.base_url}. Please ensure it's running and accessible.")
+        """
+        Upload documents to Cheshire Cat.
         
-        uploaded_count = 0
-        failed_uploads = []
+        Returns:
+            tuple: (documents available to the Cat, PMIDs that failed to upload)
+        """
+        return summarize_uploads(self.ingest_documents(documents))
+    
+    def ingest_documents(self, documents):
+        """
+        Upload documents to the rabbithole, at most upload_workers at a time.
         
-        for i, doc in enumerate(documents):
-            try:
-                # Create well-formatted content
-                content = self._format_document(doc)
-                
-                # Upload to Cheshire Cat
-                files = {
-                    'file': (f"pubmed_{doc['pmid']}.txt", content, 'text/plain')
-                }
-                
-                response = self.session.post(
-                    f"{self.base_url}/rabbithole/",
-                    files=files,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    uploaded_count += 1
-                    logger.info(f"Uploaded document {i+1}/{len(documents)}: PMID {doc['pmid']}")
-                else:
-                    failed_uploads.append(doc['pmid'])
-                    logger.warning(f"Failed to upload PMID {doc['pmid']}: {response.status_code}")
-                
-                # Rate limiting to be respectful
-                if i < len(documents) - 1:
-                    time.sleep(0.2)
-                
-            except Exception as e:
-                failed_uploads.append(doc['pmid'])
-                logger.error(f"Error uploading document PMID {doc['pmid']}: {e}")
+        Documents whose content is already in the ledger for this Cat, or that
+        repeat an earlier document of the same batch, are not uploaded again.
+        
+        Returns:
+            list: One result per document, in order, with 'pmid', 'content_hash' and
+            'status': 'uploaded', 'already_ingested', 'duplicate' or 'failed' (with 'error')
+        """
+        if not self.breaker.allow_request():
+            raise circuit_breaker.CircuitOpenError(
+                f"Cannot connect to Cheshire Cat at {self.base_url}. Please ensure it's running and accessible.")
+        
+        contents = [self._format_document(doc) for doc in documents]
+        hashes = [rabbithole_ledger.content_hash(content) for content in contents]
+        ingested = self._ledger_call('ingested', self.base_url, hashes) or set()
+        
+        results = []
+        pending = []
+        seen = set()
+        for i, (doc, digest) in enumerate(zip(documents, hashes)):
+            result = {'pmid': doc['pmid'], 'content_hash': digest}
+            if digest in ingested:
+                result['status'] = 'already_ingested'
+            elif digest in seen:
+                result['status'] = 'duplicate'
+            else:
+                seen.add(digest)
+                pending.append(i)
+            results.append(result)
         
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.upload_workers, len(pending))) as executor:
+                errors = executor.map(lambda i: self._post_document(documents[i]['pmid'], contents[i]), pending)
+                for i, error in zip(pending, errors):
+                    if error is None:
+                        results[i]['status'] = 'uploaded'
+                    else:
+                        results[i].update(status='failed', error=error)
+        
+        self._ledger_call('record', self.base_url,
+                          [(result['content_hash'], result['pmid']) for result in results
+                           if result['status'] == 'uploaded'])
+        
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        logger.info(f"Rabbithole upload of {len(documents)} documents: {counts}")
+        failed_uploads = [result['pmid'] for result in results if result['status'] == 'failed']
         if failed_uploads:
             logger.warning(f"Failed to upload {len(failed_uploads)} documents: {failed_uploads}")
         
-        return uploaded_count, failed_uploads
+        return results
+    
+    def _post_document(self, pmid, content):
+        """Post one document to the rabbithole; returns None on success, otherwise the error"""
+        # The remaining documents of a batch are not sent once the circuit opens
+        if self.breaker.state == circuit_breaker.OPEN:
+            return "Cheshire Cat unavailable (circuit open)"
+        try:
+            files = {
+                'file': (f"pubmed_{pmid}.txt", content, 'text/plain')
+            }
+            response = self.session.post(
+                f"{self.base_url}/rabbithole/",
+                files=files,
+                timeout=30
+            )
+            self._record_outcome()
+            if response.status_code == 200:
+                logger.info(f"Uploaded document PMID {pmid}")
+                return None
+            logger.warning(f"Failed to upload PMID {pmid}: {response.status_code}")
+            return f"Cheshire Cat returned status code {response.status_code}"
+        except Exception as e:
+            self._record_outcome(e)
+            logger.error(f"Error uploading document PMID {pmid}: {e}")
+            return str(e)
     
     def _format_document(self, doc):
         """Format document content for better processing"""
@@ -278,7 +435,7 @@ class CheshireCatClient:
     
     def ask_question(self, question):
         """Ask a question to Cheshire Cat with better error handling"""
-        if not self.test_connection():
+        if not self.breaker.allow_request():
             return "Error: Cannot connect to Cheshire Cat. Please ensure it's running."
         
         try:
@@ -292,6 +449,7 @@ class CheshireCatClient:
                 json=payload,
                 timeout=1800  # 30 minutes timeout
             )
+            self._record_outcome()
             
             if response.status_code == 200:
                 result = response.json()
@@ -300,9 +458,11 @@ class CheshireCatClient:
                 logger.error(f"Cheshire Cat API error: {response.status_code}")
                 return f"Error: Cheshire Cat returned status code {response.status_code}"
                 
-        except requests.exceptions.Timeout:
+        except requests.exceptions.Timeout as e:
+            self._record_outcome(e)
             return "Error: Request to Cheshire Cat timed out. Please try again."
         except Exception as e:
+            self._record_outcome(e)
             logger.error(f"Error communicating with Cheshire Cat: {e}")
             return f"Error communicating with Cheshire Cat: {str(e)}"
 
@@ -335,8 +495,8 @@ def rate_limit(max_requests=10, window=60):
     return decorator
 
 # Initialize clients
-pubmed_client = PubMedClient()
-cheshire_client = CheshireCatClient()
+pubmed_client = PubMedClient(cache=pubmed_cache.get_cache())
+cheshire_client = CheshireCatClient(ledger=rabbithole_ledger.get_ledger())
 
 @app.route('/')
 def index():
@@ -349,6 +509,7 @@ def health_check():
     return jsonify({
         'status': 'healthy' if cheshire_status else 'degraded',
         'cheshire_cat': 'connected' if cheshire_status else 'disconnected',
+        'cheshire_cat_circuit': cheshire_client.breaker.snapshot(),
         'timestamp': datetime.now().isoformat()
     })
 
@@ -380,7 +541,8 @@ def search_gene():
             return jsonify({'error': 'Failed to fetch abstracts from PubMed'}), 500
         
         # Upload to Cheshire Cat
-        uploaded_count, failed_uploads = cheshire_client.upload_documents(articles)
+        uploads = cheshire_client.ingest_documents(articles)
+        uploaded_count, failed_uploads = summarize_uploads(uploads)
         
         return jsonify({
             'success': True,
@@ -388,6 +550,7 @@ def search_gene():
             'total_articles': len(articles),
             'uploaded_count': uploaded_count,
             'failed_count': len(failed_uploads),
+            'uploads': uploads,
             'articles': articles
         })
         
@@ -445,7 +608,8 @@ def send_prediction():
 
         # 3. Load the articles into Cheshire Cat
         logger.info(f"Uploading {len(articles)} articles to Cheshire Cat...")
-        uploaded_count, failed_uploads = cheshire_client.upload_documents(articles)
+        uploads = cheshire_client.ingest_documents(articles)
+        uploaded_count, failed_uploads = summarize_uploads(uploads)
         
         if uploaded_count == 0:
             return jsonify({
@@ -468,6 +632,7 @@ def send_prediction():
             "gene_analyzed": gene_name,
             "articles_found": len(articles),
             "articles_uploaded": uploaded_count,
+            "uploads": uploads,
             "question_asked": question,
             "cheshire_cat_answer": answer,
             "files_received": file_info
@@ -595,6 +760,56 @@ def internal_error(error):
     logger.error(f"Internal server error: {error}")
     return jsonify({'error': 'Internal server error'}), 500
 
+def collect_prediction_files():
+    """
+    Raccoglie i file caricati (file1-file3) nel formato atteso da requests
+    
+    Returns:
+        tuple: (files_to_send, uploaded_files_info)
+    """
+    files_to_send = []
+    uploaded_files_info = []
+    
+    for file_key in ['file1', 'file2', 'file3']:
+        file = request.files.get(file_key)
+        if file and file.filename:
+            files_to_send.append(('files', (file.filename, file.stream, file.content_type)))
+            uploaded_files_info.append({
+                'key': file_key,
+                'filename': file.filename,
+                'content_type': file.content_type
+            })
+            logger.info(f"File received: {file.filename}")
+    
+    return files_to_send, uploaded_files_info
+
+def format_backend_prediction(backend_result, uploaded_files_info):
+    """Formatta la risposta di /api/predict del backend per il frontend"""
+    result = backend_result['result']
+    formatted_result = {
+        'prediction_id': f"pred_{backend_result['patient_id']}",
+        'status': 'COMPLETED',
+        'patient_id': backend_result['patient_id'],
+        'sample_type': backend_result['sample_type'],
+        'files_processed': len(uploaded_files_info),
+        'uploaded_files': uploaded_files_info,
+        'ml_prediction': {
+            'predicted_class': result['predicted_class'],
+            'confidence': result['confidence'],
+            'prediction_probability': result['prediction_probability'],
+            'interpretation': 'Normal' if result['predicted_class'] == 0 else 'Tumor'
+        },
+        'top_features': result['top_features'][:5],  # Solo top 5 per display
+        'sample_info': result['sample_info'],
+        'analysis_summary': f"Based on the uploaded genomic data, the ML model predicts this sample as {'Normal' if result['predicted_class'] == 0 else 'Tumor'} with {result['confidence']:.2%} confidence."
+    }
+    
+    # Aggiungi top_features_with_gene_names se disponibile
+    if 'top_features_with_gene_names' in result:
+        formatted_result['top_features_with_gene_names'] = result['top_features_with_gene_names'][:5]
+    
+    return formatted_result
+
 @app.route('/api/predict', methods=['POST'])
 @rate_limit(max_requests=5, window=60)  # 5 predictions per minute
 def api_predict():
@@ -606,20 +821,8 @@ def api_predict():
         if 'file1' not in request.files and 'file2' not in request.files and 'file3' not in request.files:
             return jsonify({'error': 'No files were uploaded.'}), 400
         
-        files_to_send = []
-        uploaded_files_info = []
-        
         # Raccogli i file caricati
-        for file_key in ['file1', 'file2', 'file3']:
-            file = request.files.get(file_key)
-            if file and file.filename:
-                files_to_send.append(('files', (file.filename, file.stream, file.content_type)))
-                uploaded_files_info.append({
-                    'key': file_key,
-                    'filename': file.filename,
-                    'content_type': file.content_type
-                })
-                logger.info(f"File received: {file.filename}")
+        files_to_send, uploaded_files_info = collect_prediction_files()
         
         if not files_to_send:
             return jsonify({'error': 'No valid files were uploaded.'}), 400
@@ -641,30 +844,8 @@ def api_predict():
             backend_result = response.json()
             
             if backend_result.get('success'):
-                # Estrai i risultati
-                result = backend_result['result']
-                  # Formatta la risposta per il frontend
-                formatted_result = {
-                    'prediction_id': f"pred_{backend_result['patient_id']}",
-                    'status': 'COMPLETED',
-                    'patient_id': backend_result['patient_id'],
-                    'sample_type': backend_result['sample_type'],
-                    'files_processed': len(uploaded_files_info),
-                    'uploaded_files': uploaded_files_info,
-                    'ml_prediction': {
-                        'predicted_class': result['predicted_class'],
-                        'confidence': result['confidence'],
-                        'prediction_probability': result['prediction_probability'],
-                        'interpretation': 'Normal' if result['predicted_class'] == 0 else 'Tumor'
-                    },
-                    'top_features': result['top_features'][:5],  # Solo top 5 per display
-                    'sample_info': result['sample_info'],
-                    'analysis_summary': f"Based on the uploaded genomic data, the ML model predicts this sample as {'Normal' if result['predicted_class'] == 0 else 'Tumor'} with {result['confidence']:.2%} confidence."
-                }
-                
-                # Aggiungi top_features_with_gene_names se disponibile
-                if 'top_features_with_gene_names' in result:
-                    formatted_result['top_features_with_gene_names'] = result['top_features_with_gene_names'][:5]
+                # Formatta la risposta per il frontend
+                formatted_result = format_backend_prediction(backend_result, uploaded_files_info)
                 
                 logger.info(f"Prediction completed successfully for patient {backend_result['patient_id']}")
                 return jsonify({'success': True, 'result': formatted_result})
@@ -685,6 +866,121 @@ def api_predict():
         logger.error(f"Error in api_predict: {e}")
         return jsonify({'error': 'An unexpected error occurred during prediction.'}), 500
 
+# Timeout per l'invio dei file al backend (la predizione prosegue in un job asincrono)
+BACKEND_UPLOAD_TIMEOUT = int(os.getenv('BACKEND_UPLOAD_TIMEOUT', 600))
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+@app.route('/api/predict/jobs', methods=['POST'])
+@rate_limit(max_requests=5, window=60)  # 5 predictions per minute
+def api_submit_prediction_job():
+    """
+    Invia i file al backend come job di predizione asincrono e restituisce subito il job_id
+    """
+    try:
+        files_to_send, uploaded_files_info = collect_prediction_files()
+        
+        if not files_to_send:
+            return jsonify({'error': 'No files were uploaded.'}), 400
+        
+        backend_url = os.getenv('BACKEND_API_URL', 'http://localhost:5001')
+        jobs_endpoint = f"{backend_url}/api/jobs"
+        
+        logger.info(f"Submitting prediction job with {len(files_to_send)} files to: {jobs_endpoint}")
+        response = requests.post(
+            jobs_endpoint,
+            files=files_to_send,
+            data={'sample_type': 'tumor'},  # Default to tumor sample
+            timeout=BACKEND_UPLOAD_TIMEOUT
+        )
+        backend_result = response.json()
+        
+        if response.status_code == 202 and backend_result.get('success'):
+            logger.info(f"Prediction job {backend_result['job_id']} queued")
+            return jsonify({
+                'success': True,
+                'job_id': backend_result['job_id'],
+                'status': backend_result['status'],
+                'position': backend_result.get('position'),
+                'uploaded_files': uploaded_files_info
+            }), 202
+        
+        logger.error(f"Backend job submission failed with status {response.status_code}: {backend_result.get('error')}")
+        status_code = 503 if response.status_code == 503 else 500
+        return jsonify({'error': f"Prediction failed: {backend_result.get('error', 'Unknown error')}"}), status_code
+        
+    except requests.exceptions.Timeout:
+        logger.error("Backend upload timeout")
+        return jsonify({'error': 'Upload to the prediction service timed out. Please try again.'}), 504
+    except requests.exceptions.ConnectionError:
+        logger.error("Cannot connect to backend service")
+        return jsonify({'error': 'Cannot connect to prediction service. Please ensure backend is running.'}), 503
+    except Exception as e:
+        logger.error(f"Error in api_submit_prediction_job: {e}")
+        return jsonify({'error': 'An unexpected error occurred during prediction.'}), 500
+
+@app.route('/api/predict/jobs/<job_id>', methods=['GET'])
+@rate_limit(max_requests=120, window=60)  # Polling ogni 0.5 secondi al massimo
+def api_prediction_job_status(job_id):
+    """Stato di un job di predizione (queued, running, done, failed)"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({'error': 'Invalid job id'}), 400
+    
+    try:
+        backend_url = os.getenv('BACKEND_API_URL', 'http://localhost:5001')
+        response = requests.get(f"{backend_url}/api/jobs/{job_id}", timeout=10)
+        backend_result = response.json()
+        
+        if response.status_code != 200:
+            return jsonify({'error': backend_result.get('error', 'Unknown error')}), response.status_code
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': backend_result['status'],
+            'position': backend_result.get('position'),
+            'error': backend_result.get('error')
+        })
+        
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error polling prediction job {job_id}: {e}")
+        return jsonify({'error': 'Cannot reach prediction service.'}), 503
+
+@app.route('/api/predict/jobs/<job_id>/result', methods=['GET'])
+@rate_limit(max_requests=120, window=60)
+def api_prediction_job_result(job_id):
+    """
+    Risultato di un job di predizione, nello stesso formato di /api/predict.
+    
+    Il backend elimina il risultato dopo la lettura; 202 se il job non è ancora terminato.
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        return jsonify({'error': 'Invalid job id'}), 400
+    
+    try:
+        backend_url = os.getenv('BACKEND_API_URL', 'http://localhost:5001')
+        response = requests.get(f"{backend_url}/api/jobs/{job_id}/result", timeout=30)
+        backend_result = response.json()
+        
+        if response.status_code == 202:
+            return jsonify({'success': True, 'job_id': job_id, 'status': backend_result['status']}), 202
+        if response.status_code != 200:
+            return jsonify({'error': backend_result.get('error', 'Unknown error')}), response.status_code
+        if not backend_result.get('success'):
+            logger.error(f"Prediction job {job_id} failed: {backend_result.get('error', 'Unknown error')}")
+            return jsonify({'error': f"Prediction failed: {backend_result.get('error', 'Unknown error')}"}), 500
+        
+        # I dettagli dei file caricati sono già noti al browser (risposta dell'invio del job)
+        formatted_result = format_backend_prediction(backend_result, [])
+        formatted_result['files_processed'] = len(backend_result['uploaded_files'])
+        
+        logger.info(f"Prediction job {job_id} completed for patient {backend_result['patient_id']}")
+        return jsonify({'success': True, 'result': formatted_result})
+        
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error fetching prediction job {job_id}: {e}")
+        return jsonify({'error': 'Cannot reach prediction service.'}), 503
+
 @app.route('/test_backend', methods=['GET'])
 def test_backend():
     """Endpoint per testare la connettività con il backend"""
@@ -761,7 +1057,8 @@ def gene_analysis():
 
         # 2. Carica gli articoli in Cheshire Cat
         logger.info(f"Uploading {len(articles)} articles to Cheshire Cat...")
-        uploaded_count, failed_uploads = cheshire_client.upload_documents(articles)
+        uploads = cheshire_client.ingest_documents(articles)
+        uploaded_count, failed_uploads = summarize_uploads(uploads)
         
         if uploaded_count == 0:
             return jsonify({
@@ -785,6 +1082,7 @@ def gene_analysis():
             "articles_found": len(articles),
             "articles_uploaded": uploaded_count,
             "failed_uploads": len(failed_uploads),
+            "uploads": uploads,
             "question_asked": question,
             "ai_analysis": answer,
             "articles_preview": articles[:3]  # Prime 3 per preview
@@ -798,9 +1096,10 @@ def gene_analysis():
 
 if __name__ == '__main__':
     # Check Cheshire Cat connection on startup
-    if cheshire_client.test_connection():
+    if cheshire_client.breaker.probe_now():
         logger.info(f"✅ Cheshire Cat connection successful at {cheshire_client.base_url}")
     else:
         logger.warning(f"⚠️  Cannot connect to Cheshire Cat at {cheshire_client.base_url}. Please ensure it's running and accessible.")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server only; in production: gunicorn -c gunicorn.conf.py app:app
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') == '1', host='0.0.0.0', port=5000)
@@ -0,0 +1,124 @@
+"""
+Benchmark of the efetch parsers: streaming (iterparse) against the full tree.
+
+The articles of the efetch fixtures (fixtures/*.xml) are repeated with new
+PMIDs to build responses of the requested sizes: 20 articles is the batch
+fetched by the app, larger sizes show how memory grows with the batch. For each
+size and parser the script reports p50/p99 latency, throughput and peak of the
+memory allocated while parsing (tracemalloc, measured in a separate run), and
+checks that both parsers return the same articles.
+
+Usage (from the frontend folder):
+    python benchmarks/bench_efetch.py
+    python benchmarks/bench_efetch.py --sizes 20 200 2000 --repeat 50 --output results.json
+"""
+
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, FRONTEND_DIR)
+
+import efetch_parser  # noqa: E402
+
+FIXTURES = os.path.join(FRONTEND_DIR, "fixtures", "*.xml")
+
+
+def load_articles(pattern=FIXTURES):
+    """Serialized PubmedArticle elements of the fixtures"""
+    articles = []
+    for path in sorted(glob.glob(pattern)):
+        for article in ET.parse(path).getroot().findall('PubmedArticle'):
+            articles.append(ET.tostring(article, encoding='unicode'))
+    if not articles:
+        raise SystemExit(f"No PubmedArticle found in {pattern}")
+    return articles
+
+
+def build_response(articles, size):
+    """efetch response with `size` articles, each with its own PMID"""
+    parts = ['<?xml version="1.0" ?>\n<PubmedArticleSet>\n']
+    for i in range(size):
+        article = articles[i % len(articles)]
+        # Only the first PMID (the one of the citation) is renumbered
+        start = article.index('<PMID')
+        start = article.index('>', start) + 1
+        end = article.index('</PMID>', start)
+        parts.append(article[:start] + str(40000000 + i) + article[end:])
+    parts.append('</PubmedArticleSet>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def parse_tree(data):
+    return efetch_parser.parse_articles_tree(ET.fromstring(data))
+
+
+def parse_stream(data):
+    return efetch_parser.parse_articles(io.BytesIO(data))
+
+
+PARSERS = {'tree': parse_tree, 'stream': parse_stream}
+
+
+def measure(parser, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parser(data)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    tracemalloc.start()
+    parser(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50 = statistics.median(timings)
+    return {
+        'p50_ms': p50 * 1000,
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        'mb_per_s': len(data) / 1e6 / p50,
+        'peak_alloc_mb': peak / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 2000], help="Articles per response")
+    parser.add_argument('--repeat', type=int, default=30, help="Timed runs per size and parser")
+    parser.add_argument('--fixtures', default=FIXTURES, help="Glob of the efetch fixtures")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # The fixtures contain an article skipped on purpose: its error log is not part of the benchmark
+    logging.disable(logging.ERROR)
+    articles = load_articles(args.fixtures)
+    results = []
+    print(f"{'articles':>8} {'MB':>6} {'parser':>7} {'p50 ms':>9} {'p99 ms':>9} {'MB/s':>7} {'peak MB':>8}")
+    for size in args.sizes:
+        data = build_response(articles, size)
+        if parse_tree(data) != parse_stream(data):
+            raise SystemExit(f"The parsers disagree on a response of {size} articles")
+        for name, parse in PARSERS.items():
+            result = {'articles': size, 'bytes': len(data), 'parser': name, **measure(parse, data, args.repeat)}
+            results.append(result)
+            print(f"{size:>8} {len(data) / 1e6:>6.2f} {name:>7} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                  f"{result['mb_per_s']:>7.1f} {result['peak_alloc_mb']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
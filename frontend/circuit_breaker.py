@@ -0,0 +1,163 @@
+"""
+Circuit breaker with cached health state for an external service (Cheshire Cat).
+
+The breaker is closed while the service answers. After `failure_threshold`
+consecutive failures (of requests or of the health probe) it opens: callers
+fail fast, without waiting for connection timeouts. After `reset_timeout`
+seconds it becomes half-open and lets one trial through (a request or the
+probe); success closes it again, failure opens it for another period.
+
+A background thread probes the service every `interval` seconds, so that the
+health state is known without a probe in front of every call. The thread is
+started on first use in each process (gunicorn forks the workers after the
+app is loaded) and the state is per process.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Health state of a service, updated by the outcome of its calls and by a periodic probe.
+
+    Args:
+        probe (callable): Returns True if the service is reachable
+        name (str): Service name used in the logs
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout (float): Seconds the breaker stays open before a trial
+        interval (float): Seconds between background probes (0 = no background probe)
+    """
+
+    def __init__(self, probe, name='service', failure_threshold=3, reset_timeout=30.0, interval=15.0):
+        self.probe = probe
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self._last_probe = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def _ensure_probe_thread(self):
+        if self.interval <= 0 or (self._thread_pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            # A thread started before fork does not exist in the child
+            self._thread = threading.Thread(target=self._probe_loop, name=f"{self.name}-health", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _probe_loop(self):
+        while not self._stop.is_set():
+            self.probe_now()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        """Stops the background probe"""
+        self._stop.set()
+
+    def probe_now(self):
+        """
+        Probes the service and records the outcome.
+
+        While the breaker is open the probe waits for reset_timeout, like any trial.
+
+        Returns:
+            bool: True if the service answered
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+        try:
+            healthy = bool(self.probe())
+        except Exception as e:
+            logger.debug(f"{self.name} probe failed: {e}")
+            healthy = False
+        self._last_probe = time.time()
+        if healthy:
+            self.record_success()
+        else:
+            self.record_failure()
+        return healthy
+
+    def allow_request(self):
+        """
+        Whether a call may be sent now: always when closed, never while open,
+        one trial at a time when half-open.
+        """
+        self._ensure_probe_thread()
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                logger.info(f"{self.name} circuit half-open, sending a trial request")
+            # A trial that never reported back does not block the breaker forever
+            if self._trial_started is not None and now - self._trial_started < self.reset_timeout:
+                return False
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"{self.name} circuit closed, service available again")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started = None
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                logger.warning(f"{self.name} circuit open after {self._failures} consecutive failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            elif self._state == OPEN:
+                self._opened_at = time.monotonic()
+
+    def is_available(self):
+        """Cached health: False while the breaker is open, without calling the service"""
+        self._ensure_probe_thread()
+        with self._lock:
+            return self._state != OPEN
+
+    def snapshot(self):
+        """State for the health endpoint"""
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'last_probe': datetime.fromtimestamp(self._last_probe).isoformat() if self._last_probe else None,
+            }
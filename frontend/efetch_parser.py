@@ -0,0 +1,208 @@
+"""
+Parsers of the PubMed efetch XML (PubmedArticleSet) into article dicts.
+
+`parse_articles` reads the response incrementally with iterparse: each field
+is taken when its element is closed, in a single pass, and elements are
+cleared as soon as they are no longer needed, so that only the article being
+read is kept in memory. `parse_articles_tree` is the previous implementation
+on a fully built tree, kept as the reference for tests and benchmarks: both
+return the same articles for the same document.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# Children read by their parent when it is closed (not cleared at their own end)
+_KEPT = frozenset({'AbstractText', 'Year', 'LastName', 'ForeName', 'Title'})
+_MISSING = object()
+
+
+def clean_text(text):
+    """Clean and normalize text"""
+    if not text:
+        return ""
+    # Remove extra whitespace and normalize
+    return ' '.join(text.split())
+
+
+class _Article:
+    """Fields of the PubmedArticle being read"""
+
+    __slots__ = ('title', 'abstract', 'pmid', 'year', 'authors', 'journal', 'error')
+
+    def __init__(self):
+        self.title = _MISSING
+        self.abstract = []
+        self.pmid = _MISSING
+        self.year = _MISSING
+        self.authors = []
+        self.journal = _MISSING
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'pmid': "No PMID" if self.pmid is _MISSING else self.pmid,
+            'title': clean_text("No title" if self.title is _MISSING else self.title),
+            'abstract': ' '.join(self.abstract) if self.abstract else "No abstract available",
+            'year': "Unknown" if self.year is _MISSING else self.year,
+            'authors': self.authors[:5],  # Limit to first 5 authors
+            'journal': "Unknown Journal" if self.journal is _MISSING else self.journal,
+        }
+
+
+def _author_name(last_name, first_name):
+    author_name = last_name.text
+    if first_name is not None:
+        author_name += f", {first_name.text}"
+    return author_name
+
+
+def _abstract_section(abstract_elem):
+    label = abstract_elem.get('Label', '')
+    text = clean_text(abstract_elem.text)
+    return f"{label}: {text}" if label else text
+
+
+def iter_articles(source):
+    """
+    Articles of an efetch response, yielded as soon as each one is read.
+
+    Args:
+        source: File-like object (e.g. the raw HTTP response) or path of the XML
+
+    Raises:
+        ET.ParseError: If the document is not well formed (the articles
+            already yielded remain valid)
+    """
+    root = None
+    article = None
+    depth = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            # As with findall('.//PubmedArticle'), the root itself is not an article
+            if tag == 'PubmedArticle' and depth > 1:
+                article = _Article()
+            continue
+        depth -= 1
+
+        if article is not None:
+            # First element in document order, as find('.//...') on the article
+            if tag == 'ArticleTitle':
+                if article.title is _MISSING:
+                    article.title = elem.text
+            elif tag == 'PMID':
+                if article.pmid is _MISSING:
+                    article.pmid = elem.text
+            elif tag == 'PubDate':
+                if article.year is _MISSING:
+                    year_elem = elem.find('Year')
+                    article.year = year_elem.text if year_elem is not None else "Unknown"
+            elif tag == 'Journal':
+                title_elem = elem.find('Title')
+                if article.journal is _MISSING and title_elem is not None:
+                    article.journal = title_elem.text
+            elif tag == 'Abstract':
+                article.abstract.extend(_abstract_section(section) for section in elem.findall('AbstractText')
+                                        if section.text)
+            elif tag == 'Author':
+                last_name = elem.find('LastName')
+                if last_name is not None and article.error is None:
+                    try:
+                        article.authors.append(_author_name(last_name, elem.find('ForeName')))
+                    except Exception as e:
+                        # As in parse_articles_tree, the whole article is skipped
+                        article.error = e
+            elif tag == 'PubmedArticle':
+                if article.error is not None:
+                    logger.error(f"Error parsing individual article: {article.error}")
+                else:
+                    yield article.to_dict()
+                article = None
+
+        if tag not in _KEPT:
+            elem.clear()
+            if depth == 1:
+                # Drops the cleared articles from the PubmedArticleSet
+                root.clear()
+
+
+def parse_articles(source):
+    """
+    Parse the articles of an efetch response while it is read.
+
+    Returns:
+        list: Article dicts (pmid, title, abstract, year, authors, journal)
+    """
+    return list(iter_articles(source))
+
+
+def parse_articles_tree(root):
+    """Parse articles from an XML tree (the whole response parsed with ET.fromstring)"""
+    articles = []
+
+    for article in root.findall('.//PubmedArticle'):
+        try:
+            # Extract title
+            title_elem = article.find('.//ArticleTitle')
+            title = clean_text(title_elem.text if title_elem is not None else "No title")
+
+            # Extract abstract - handle multiple abstract sections
+            abstract_texts = []
+            for abstract_elem in article.findall('.//Abstract/AbstractText'):
+                if abstract_elem.text:
+                    # Check if it has a label attribute
+                    label = abstract_elem.get('Label', '')
+                    text = clean_text(abstract_elem.text)
+                    if label:
+                        abstract_texts.append(f"{label}: {text}")
+                    else:
+                        abstract_texts.append(text)
+
+            abstract = ' '.join(abstract_texts) if abstract_texts else "No abstract available"
+
+            # Extract PMID
+            pmid_elem = article.find('.//PMID')
+            pmid = pmid_elem.text if pmid_elem is not None else "No PMID"
+
+            # Extract publication date
+            pub_date = article.find('.//PubDate')
+            year = "Unknown"
+            if pub_date is not None:
+                year_elem = pub_date.find('Year')
+                if year_elem is not None:
+                    year = year_elem.text
+
+            # Extract authors
+            authors = []
+            for author in article.findall('.//Author'):
+                last_name = author.find('LastName')
+                first_name = author.find('ForeName')
+                if last_name is not None:
+                    author_name = last_name.text
+                    if first_name is not None:
+                        author_name += f", {first_name.text}"
+                    authors.append(author_name)
+
+            # Extract journal
+            journal_elem = article.find('.//Journal/Title')
+            journal = journal_elem.text if journal_elem is not None else "Unknown Journal"
+
+            articles.append({
+                'pmid': pmid,
+                'title': title,
+                'abstract': abstract,
+                'year': year,
+                'authors': authors[:5],  # Limit to first 5 authors
+                'journal': journal
+            })
+        except Exception as e:
+            logger.error(f"Error parsing individual article: {e}")
+            continue
+
+    return articles
@@ -0,0 +1,31 @@
+"""
+Gunicorn configuration for the frontend.
+
+Usage: gunicorn -c gunicorn.conf.py app:app
+
+The frontend is I/O bound (PubMed, Cheshire Cat and backend calls), so each
+worker serves several requests concurrently with threads. Note that the
+in-memory rate limiter in app.py keeps separate counters per worker.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Worker processes and threads per worker: one worker per core by default
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = True
+
+# Recycle workers after N requests (with jitter so they do not restart together)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# With gthread the timeout checks that the worker is alive, it does not limit request duration
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,228 @@
+"""
+Persistent cache of PubMed lookups, shared by the frontend workers.
+
+Two kinds of entries are stored in a local SQLite database:
+- esearch results (list of PMIDs), keyed by query term and max_results;
+- parsed articles (the dicts returned by efetch_parser.parse_articles), keyed by PMID.
+
+Entries expire after a TTL (shorter for searches, whose results change as new
+papers are indexed) and the total size is bounded: when it grows past
+PUBMED_CACHE_MAX_BYTES the least recently used entries are evicted. The
+database uses WAL mode so that lookups from one worker do not wait for writes
+from another.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PUBMED_CACHE_PATH = os.getenv('PUBMED_CACHE_PATH', os.path.join('cache', 'pubmed_cache.sqlite3'))
+# Seconds before a cached search or article is fetched again from NCBI
+PUBMED_CACHE_SEARCH_TTL = int(os.getenv('PUBMED_CACHE_SEARCH_TTL', 24 * 3600))
+PUBMED_CACHE_ARTICLE_TTL = int(os.getenv('PUBMED_CACHE_ARTICLE_TTL', 30 * 24 * 3600))
+# Size bound of the stored entries (0 disables the cache)
+PUBMED_CACHE_MAX_BYTES = int(os.getenv('PUBMED_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# After an eviction the cache is brought down to this fraction of the bound
+EVICTION_TARGET = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    term TEXT NOT NULL,
+    max_results INTEGER NOT NULL,
+    pmids TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (term, max_results)
+);
+CREATE TABLE IF NOT EXISTS articles (
+    pmid TEXT PRIMARY KEY,
+    article TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_accessed ON searches (accessed_at);
+CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed_at);
+"""
+
+# SQLite limits the number of parameters of a statement
+_MAX_PARAMS = 500
+
+
+class PubMedCache:
+    """
+    SQLite cache of esearch results and parsed articles.
+
+    The database is created on first use, so that importing the app does not
+    touch the filesystem.
+    """
+
+    def __init__(self, path=PUBMED_CACHE_PATH, search_ttl=PUBMED_CACHE_SEARCH_TTL,
+                 article_ttl=PUBMED_CACHE_ARTICLE_TTL, max_bytes=PUBMED_CACHE_MAX_BYTES):
+        self.path = path
+        self.search_ttl = search_ttl
+        self.article_ttl = article_ttl
+        self.max_bytes = max_bytes
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                    try:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Connection(conn)
+
+    def get_search(self, term, max_results):
+        """Cached PMIDs for a search, or None if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT pmids, created_at FROM searches WHERE term = ? AND max_results = ?",
+                               (term, max_results)).fetchone()
+            if row is None or now - row[1] > self.search_ttl:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE searches SET accessed_at = ? WHERE term = ? AND max_results = ?",
+                         (now, term, max_results))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put_search(self, term, max_results, pmids):
+        data = json.dumps(pmids)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO searches (term, max_results, pmids, size, created_at, accessed_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (term, max_results, data, len(data) + len(term), now, now))
+        self._evict_if_needed()
+
+    def get_articles(self, pmids):
+        """
+        Cached articles for the given PMIDs.
+
+        Returns:
+            dict: PMID -> article, only for PMIDs cached and not expired
+        """
+        now = time.time()
+        found = {}
+        pmids = list(dict.fromkeys(pmids))
+        with self._connect() as conn:
+            for start in range(0, len(pmids), _MAX_PARAMS):
+                chunk = pmids[start:start + _MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(f"SELECT pmid, article FROM articles WHERE pmid IN ({placeholders}) "
+                                    f"AND created_at >= ?", (*chunk, now - self.article_ttl)).fetchall()
+                found.update((pmid, json.loads(article)) for pmid, article in rows)
+                if rows:
+                    conn.execute(f"UPDATE articles SET accessed_at = ? WHERE pmid IN "
+                                 f"({','.join('?' * len(rows))})", (now, *(row[0] for row in rows)))
+        self.hits += len(found)
+        self.misses += len(pmids) - len(found)
+        return found
+
+    def put_articles(self, articles):
+        now = time.time()
+        rows = []
+        for article in articles:
+            data = json.dumps(article)
+            rows.append((str(article['pmid']), data, len(data), now, now))
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO articles (pmid, article, size, created_at, accessed_at) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+        self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """Drops expired entries, then the least recently used ones until the cache fits in max_bytes"""
+        with self._connect() as conn:
+            total = self._total_bytes(conn)
+            if total <= self.max_bytes:
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM searches WHERE created_at < ?", (now - self.search_ttl,))
+            conn.execute("DELETE FROM articles WHERE created_at < ?", (now - self.article_ttl,))
+            total = self._total_bytes(conn)
+            target = self.max_bytes * EVICTION_TARGET
+            if total > target:
+                # Oldest accesses first, across both tables
+                rows = conn.execute(
+                    "SELECT 'searches', rowid, size, accessed_at FROM searches "
+                    "UNION ALL SELECT 'articles', rowid, size, accessed_at FROM articles "
+                    "ORDER BY accessed_at").fetchall()
+                evicted = {'searches': [], 'articles': []}
+                for table, rowid, size, _ in rows:
+                    if total <= target:
+                        break
+                    evicted[table].append(rowid)
+                    total -= size
+                for table, rowids in evicted.items():
+                    for start in range(0, len(rowids), _MAX_PARAMS):
+                        chunk = rowids[start:start + _MAX_PARAMS]
+                        conn.execute(f"DELETE FROM {table} WHERE rowid IN ({','.join('?' * len(chunk))})", chunk)
+                self.evictions += len(evicted['searches']) + len(evicted['articles'])
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _total_bytes(conn):
+        return conn.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM searches) + "
+                            "(SELECT COALESCE(SUM(size), 0) FROM articles)").fetchone()[0]
+
+    def stats(self):
+        """Entries, size and hit counters (the counters are per worker)"""
+        with self._connect() as conn:
+            searches = conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+            articles = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+            size = self._total_bytes(conn)
+        return {
+            'path': self.path,
+            'searches': searches,
+            'articles': articles,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class _Connection:
+    """SQLite connection closed when leaving the with block (sqlite3 alone does not close it)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+def get_cache():
+    """Process cache configured from the environment, None if disabled"""
+    if PUBMED_CACHE_MAX_BYTES <= 0:
+        return None
+    return PubMedCache()
@@ -0,0 +1,120 @@
+"""
+Ledger of the documents already ingested by Cheshire Cat's rabbithole.
+
+Every document uploaded successfully is recorded in a local SQLite database,
+keyed by the Cheshire Cat URL and the SHA-256 of the uploaded content: a gene
+analysed again finds its abstracts in the ledger and they are not embedded a
+second time, while an article whose text changed has a new hash and is
+uploaded again. Entries expire after RABBITHOLE_LEDGER_TTL, so that documents
+lost by the Cat (e.g. memory wiped) are eventually uploaded again; delete the
+database to force it immediately.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from pubmed_cache import _Connection
+
+RABBITHOLE_LEDGER_PATH = os.getenv('RABBITHOLE_LEDGER_PATH', os.path.join('cache', 'rabbithole_ledger.sqlite3'))
+# Seconds after which an ingested document is uploaded again (0 disables the ledger)
+RABBITHOLE_LEDGER_TTL = int(os.getenv('RABBITHOLE_LEDGER_TTL', 30 * 24 * 3600))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested (
+    base_url TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    pmid TEXT NOT NULL,
+    ingested_at REAL NOT NULL,
+    PRIMARY KEY (base_url, content_hash)
+);
+"""
+
+# SQLite limits the number of parameters of a statement
+_MAX_PARAMS = 500
+
+
+def content_hash(content):
+    """SHA-256 of the uploaded text"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class IngestLedger:
+    """
+    SQLite ledger of (Cheshire Cat URL, content hash) pairs already ingested.
+
+    The database is created on first use, so that importing the app does not
+    touch the filesystem.
+    """
+
+    def __init__(self, path=RABBITHOLE_LEDGER_PATH, ttl=RABBITHOLE_LEDGER_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                    try:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Connection(conn)
+
+    def ingested(self, base_url, hashes):
+        """
+        Hashes already ingested by the Cat at base_url.
+
+        Returns:
+            set: The given hashes recorded and not expired
+        """
+        hashes = list(dict.fromkeys(hashes))
+        found = set()
+        with self._connect() as conn:
+            for start in range(0, len(hashes), _MAX_PARAMS):
+                chunk = hashes[start:start + _MAX_PARAMS]
+                rows = conn.execute(f"SELECT content_hash FROM ingested WHERE base_url = ? AND content_hash IN "
+                                    f"({','.join('?' * len(chunk))}) AND ingested_at >= ?",
+                                    (base_url, *chunk, time.time() - self.ttl)).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def record(self, base_url, entries):
+        """
+        Records documents uploaded successfully.
+
+        Args:
+            base_url (str): Cheshire Cat URL
+            entries (list): (content hash, PMID) pairs
+        """
+        now = time.time()
+        rows = [(base_url, digest, str(pmid), now) for digest, pmid in entries]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO ingested (base_url, content_hash, pmid, ingested_at) "
+                             "VALUES (?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM ingested WHERE ingested_at < ?", (now - self.ttl,))
+
+    def forget(self, base_url):
+        """Drops the entries of a Cat (e.g. after its memory was wiped)"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM ingested WHERE base_url = ?", (base_url,))
+
+
+def get_ledger():
+    """Process ledger configured from the environment, None if disabled"""
+    if RABBITHOLE_LEDGER_TTL <= 0:
+        return None
+    return IngestLedger()
@@ -0,0 +1,121 @@
+"""
+Token bucket shared by the threads and worker processes of the frontend.
+
+The bucket state (available tokens and time of the last refill) lives in a
+small file locked with fcntl, so that every gunicorn worker draws from the
+same budget: NCBI limits requests per second per host or API key, not per
+process. Without a path the bucket is local to the process.
+"""
+
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Tokens (float) and time of the last refill (float)
+_STATE = struct.Struct('dd')
+
+
+class TokenBucket:
+    """
+    Rate limiter with `rate` tokens per second and at most `burst` tokens saved up.
+
+    Args:
+        rate (float): Requests allowed per second
+        burst (float): Requests that can be made back to back after an idle period
+        path (str): State file shared between processes (None = this process only)
+    """
+
+    def __init__(self, rate, burst=1.0, path=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+        self._state = (self.burst, time.time())
+        self.waited = 0.0
+
+    def _open(self):
+        if self._fd is None or self._fd_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # A descriptor inherited through fork would share the lock with the parent
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    def _update(self, change):
+        """
+        Applies change(tokens) -> tokens to the refilled bucket under the locks.
+
+        Returns:
+            float: Tokens left after the change
+        """
+        with self._lock:
+            now = time.time()
+            if self.path is None:
+                tokens, last = self._state
+                tokens = change(min(self.burst, tokens + (now - last) * self.rate))
+                self._state = (tokens, now)
+                return tokens
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, _STATE.size, 0)
+                tokens, last = _STATE.unpack(data) if len(data) == _STATE.size else (self.burst, now)
+                # A clock going backwards must not create tokens
+                tokens = change(min(self.burst, tokens + max(0.0, now - last) * self.rate))
+                os.pwrite(fd, _STATE.pack(tokens, now), 0)
+                return tokens
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available.
+
+        Returns:
+            float: 0 if the token was taken, otherwise seconds until one is available
+        """
+        wait = [0.0]
+
+        def take(tokens):
+            if tokens >= 1.0:
+                return tokens - 1.0
+            wait[0] = (1.0 - tokens) / self.rate
+            return tokens
+
+        self._update(take)
+        return wait[0]
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a token.
+
+        Returns:
+            bool: False if no token became available within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            self.waited += wait
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Empties the bucket so that nobody sends requests for the next `seconds` (e.g. after a 429)"""
+        self._update(lambda tokens: min(tokens, -seconds * self.rate))
+
+
+def default_path(name):
+    """State file in the temporary directory, shared by the workers of the same host"""
+    return os.path.join(tempfile.gettempdir(), f"{name}.bucket")
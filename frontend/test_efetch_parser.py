@@ -0,0 +1,69 @@
+"""
+Tests of the streaming efetch parser against the parser on the full tree.
+
+Run with pytest or directly: python test_efetch_parser.py
+"""
+
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import efetch_parser
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "efetch_batch.xml")
+
+
+class ChunkedResponse(io.RawIOBase):
+    """File-like body returned a few bytes per read, as a response still arriving"""
+
+    def __init__(self, data, chunk_size=7):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunk = self.data[self.position:self.position + self.chunk_size]
+        self.position += len(chunk)
+        return chunk
+
+
+def test_stream_and_tree_parsers_agree_on_fixture():
+    with open(FIXTURE, 'rb') as f:
+        data = f.read()
+    expected = efetch_parser.parse_articles_tree(ET.fromstring(data))
+    articles = efetch_parser.parse_articles(ChunkedResponse(data))
+    assert articles == expected
+    # The book article is ignored and the article with an empty LastName is skipped
+    assert [article['pmid'] for article in articles] == ['38100001', '38100002', '38100003', '38100004']
+    first = articles[0]
+    assert first['year'] == '2024'
+    assert first['journal'] == 'Breast cancer research : BCR'
+    assert first['authors'] == ['Rossi, Anna', 'Bianchi, Marco', 'Okafor, Chidi', 'Nakamura, Yuki', 'Schmidt, Lena']
+    assert first['abstract'].startswith('BACKGROUND: RUNX1 is frequently mutated in luminal breast tumours.')
+    assert articles[1]['year'] == 'Unknown'
+    assert articles[2]['abstract'] == 'No abstract available'
+
+
+def test_articles_are_yielded_before_the_end_of_the_response():
+    with open(FIXTURE, 'rb') as f:
+        data = f.read()
+    # Truncated response: the articles read before the error are still returned
+    response = ChunkedResponse(data[:data.index(b'<PubmedArticle>', data.index(b'38100002'))] + b'<Broken')
+    articles = efetch_parser.iter_articles(response)
+    assert next(articles)['pmid'] == '38100001'
+    assert next(articles)['pmid'] == '38100002'
+    try:
+        next(articles)
+    except ET.ParseError:
+        pass
+    else:
+        raise AssertionError("truncated response parsed without errors")
+
+
+if __name__ == "__main__":
+    test_stream_and_tree_parsers_agree_on_fixture()
+    test_articles_are_yielded_before_the_end_of_the_response()
+    print("✅ efetch parser tests passed")
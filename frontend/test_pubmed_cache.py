@@ -0,0 +1,134 @@
+"""
+Tests of the PubMed cache against a local stand-in for NCBI E-utilities.
+
+Run with pytest or directly: python test_pubmed_cache.py
+"""
+
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pubmed_cache
+import rate_limiter
+from app import PubMedClient
+
+
+class EutilsStandIn(BaseHTTPRequestHandler):
+    """
+    Answers esearch with PMIDs 1..retmax and efetch with one article per requested PMID.
+
+    The (status, headers) pairs in `failures` are returned first, one per request.
+    """
+
+    requests_seen = []
+    failures = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        EutilsStandIn.requests_seen.append((url.path, params))
+        if EutilsStandIn.failures:
+            status, headers = EutilsStandIn.failures.pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path.endswith('esearch.fcgi'):
+            ids = ''.join(f"<Id>{i}</Id>" for i in range(1, int(params['retmax'][0]) + 1))
+            body = f"<eSearchResult><Count>{params['retmax'][0]}</Count><IdList>{ids}</IdList></eSearchResult>"
+        else:
+            articles = ''.join(
+                f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article>"
+                f"<Journal><Title>Journal {pmid}</Title><JournalIssue><PubDate><Year>2020</Year></PubDate>"
+                f"</JournalIssue></Journal><ArticleTitle>Title {pmid}</ArticleTitle>"
+                f"<Abstract><AbstractText Label=\"BACKGROUND\">Abstract of {pmid}</AbstractText></Abstract>"
+                f"<AuthorList><Author><LastName>Rossi</LastName><ForeName>Anna</ForeName></Author></AuthorList>"
+                f"</Article></MedlineCitation></PubmedArticle>"
+                for pmid in params['id'][0].split(','))
+            body = f"<PubmedArticleSet>{articles}</PubmedArticleSet>"
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(failures=()):
+    EutilsStandIn.requests_seen = []
+    EutilsStandIn.failures = list(failures)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EutilsStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/entrez/eutils/"
+
+
+def new_client(base_url, cache=None, rate=1000, **kwargs):
+    """Client for the stand-in, with its own token bucket"""
+    return PubMedClient(base_url=base_url, cache=cache, limiter=rate_limiter.TokenBucket(rate), **kwargs)
+
+
+def new_cache(**kwargs):
+    return pubmed_cache.PubMedCache(os.path.join(tempfile.mkdtemp(), "pubmed.sqlite3"), **kwargs)
+
+
+def test_repeat_lookups_are_served_from_cache():
+    server, base_url = start_stand_in()
+    try:
+        client = new_client(base_url, new_cache())
+        pmids = client.search_gene("RUNX1", max_results=3)
+        articles = client.fetch_abstracts(pmids)
+        assert pmids == ['1', '2', '3']
+        assert [article['title'] for article in articles] == ['Title 1', 'Title 2', 'Title 3']
+        network_calls = len(EutilsStandIn.requests_seen)
+
+        # A second client (another worker) reads the same database without network calls
+        other = new_client(base_url, pubmed_cache.PubMedCache(client.cache.path))
+        assert other.search_gene("RUNX1", max_results=3) == pmids
+        assert other.fetch_abstracts(pmids) == articles
+        assert len(EutilsStandIn.requests_seen) == network_calls
+
+        # Only the PMIDs not cached yet are fetched, the result follows the requested order
+        more = client.fetch_abstracts(['4', '2', '5'])
+        assert [article['pmid'] for article in more] == ['4', '2', '5']
+        assert EutilsStandIn.requests_seen[-1][1]['id'] == ['4,5']
+    finally:
+        server.shutdown()
+
+
+def test_expired_entries_are_fetched_again():
+    server, base_url = start_stand_in()
+    try:
+        client = new_client(base_url, new_cache(search_ttl=-1, article_ttl=-1))
+        client.fetch_abstracts(client.search_gene("BRCA1", max_results=2))
+        client.fetch_abstracts(client.search_gene("BRCA1", max_results=2))
+        assert [path.rsplit('/', 1)[-1] for path, _ in EutilsStandIn.requests_seen] == \
+            ['esearch.fcgi', 'efetch.fcgi'] * 2
+    finally:
+        server.shutdown()
+
+
+def test_eviction_keeps_recently_used_entries():
+    article = {'pmid': '0', 'title': 'x' * 400, 'abstract': '', 'year': '2020', 'authors': [], 'journal': 'J'}
+    cache = new_cache(max_bytes=1500)
+    for pmid in range(5):
+        cache.put_articles([{**article, 'pmid': str(pmid)}])
+        # Article 0 is read after every insertion and stays the most recently used
+        assert '0' in cache.get_articles(['0'])
+    stats = cache.stats()
+    assert stats['bytes'] <= 1500
+    assert stats['evictions'] > 0
+    assert '0' in cache.get_articles([str(pmid) for pmid in range(5)])
+
+
+if __name__ == "__main__":
+    test_repeat_lookups_are_served_from_cache()
+    test_expired_entries_are_fetched_again()
+    test_eviction_keeps_recently_used_entries()
+    print("✅ PubMed cache tests passed")
@@ -0,0 +1,74 @@
+"""
+Tests of the PubMed fetch engine: shared token bucket, concurrent efetch batches and retries.
+
+Run with pytest or directly: python test_pubmed_client.py
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import rate_limiter
+from test_pubmed_cache import EutilsStandIn, new_client, start_stand_in
+
+
+def _take_tokens(path, count):
+    bucket = rate_limiter.TokenBucket(20, path=path)
+    for _ in range(count):
+        bucket.acquire()
+
+
+def test_token_bucket_is_shared_between_processes():
+    path = os.path.join(tempfile.mkdtemp(), "eutils.bucket")
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_take_tokens, args=(path, 10)) for _ in range(2)]
+    started = time.monotonic()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    # 20 tokens at 20/s with a burst of 1: at least 19 refills
+    assert time.monotonic() - started >= 0.9
+
+
+def test_batches_are_fetched_concurrently_within_the_rate_limit():
+    server, base_url = start_stand_in()
+    try:
+        client = new_client(base_url, rate=10, fetch_workers=4)
+        pmids = [str(pmid) for pmid in range(1, 101)]
+        started = time.monotonic()
+        articles = client.fetch_abstracts(pmids)
+        elapsed = time.monotonic() - started
+        assert [article['pmid'] for article in articles] == pmids
+        # 5 batches at 10 requests/s: bounded by the rate limit, not by a 1s pause per batch
+        assert 0.35 <= elapsed < 2.0
+    finally:
+        server.shutdown()
+
+
+def test_retries_honour_retry_after():
+    server, base_url = start_stand_in(failures=[(429, {'Retry-After': '1'}), (503, {})])
+    try:
+        client = new_client(base_url, max_retries=3)
+        started = time.monotonic()
+        assert client.search_gene("TP53", max_results=2) == ['1', '2']
+        assert time.monotonic() - started >= 1.0
+        assert len(EutilsStandIn.requests_seen) == 3
+    finally:
+        server.shutdown()
+
+    # Once the retries are exhausted the batch fails and gives no articles
+    server, base_url = start_stand_in(failures=[(500, {})] * 2)
+    try:
+        client = new_client(base_url, max_retries=1)
+        assert client.fetch_abstracts(['1', '2']) == []
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_token_bucket_is_shared_between_processes()
+    test_batches_are_fetched_concurrently_within_the_rate_limit()
+    test_retries_honour_retry_after()
+    print("✅ PubMed client tests passed")
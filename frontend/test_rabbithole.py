@@ -0,0 +1,194 @@
+"""
+Tests of the Cheshire Cat client (rabbithole uploads, circuit breaker) against a local stand-in.
+
+Run with pytest or directly: python test_rabbithole.py
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import circuit_breaker
+import rabbithole_ledger
+from app import CheshireCatClient
+
+
+class CatStandIn(BaseHTTPRequestHandler):
+    """
+    Answers GET / and /message and accepts rabbithole uploads after a short delay.
+
+    Uploads of the PMIDs in `failing` are answered with 500, questions with `message_status`;
+    while `down` every connection is closed without an answer.
+    """
+
+    uploads = []
+    failing = set()
+    message_status = 200
+    down = False
+    requests_seen = 0
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        CatStandIn.requests_seen += 1
+        if CatStandIn.down:
+            self.close_connection = True
+            return
+        self._reply(200, b'{"status": "We\'re all mad here, dear!"}')
+
+    def do_POST(self):
+        CatStandIn.requests_seen += 1
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if CatStandIn.down:
+            self.close_connection = True
+            return
+        if self.path == '/message':
+            self._reply(CatStandIn.message_status, b'{"content": "RUNX1 is a transcription factor."}')
+            return
+        pmid = re.search(rb'filename="pubmed_([^"]+)\.txt"', body).group(1).decode()
+        with CatStandIn.lock:
+            CatStandIn.in_flight += 1
+            CatStandIn.max_in_flight = max(CatStandIn.max_in_flight, CatStandIn.in_flight)
+        # Time spent ingesting the document
+        time.sleep(0.05)
+        with CatStandIn.lock:
+            CatStandIn.in_flight -= 1
+            CatStandIn.uploads.append(pmid)
+        self._reply(500 if pmid in CatStandIn.failing else 200, b'{}')
+
+    def _reply(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(failing=()):
+    CatStandIn.uploads = []
+    CatStandIn.failing = set(failing)
+    CatStandIn.message_status = 200
+    CatStandIn.down = False
+    CatStandIn.requests_seen = 0
+    CatStandIn.in_flight = 0
+    CatStandIn.max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CatStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def new_client(base_url, **kwargs):
+    """Client without background probe: the breaker only follows the calls of the test"""
+    client = CheshireCatClient(base_url, **kwargs)
+    client.breaker.interval = 0
+    return client
+
+
+def new_ledger():
+    return rabbithole_ledger.IngestLedger(os.path.join(tempfile.mkdtemp(), "ledger.sqlite3"))
+
+
+def article(pmid, abstract="Abstract"):
+    return {'pmid': pmid, 'title': f"Title {pmid}", 'abstract': abstract, 'year': '2020',
+            'authors': ['Rossi, Anna'], 'journal': 'Journal'}
+
+
+def test_documents_already_ingested_are_not_uploaded_again():
+    server, base_url = start_stand_in()
+    try:
+        ledger = new_ledger()
+        client = new_client(base_url, ledger=ledger, upload_workers=4)
+        articles = [article(str(pmid)) for pmid in range(8)] + [article('3')]
+        results = client.ingest_documents(articles)
+        assert [result['status'] for result in results] == ['uploaded'] * 8 + ['duplicate']
+        assert sorted(CatStandIn.uploads) == [str(pmid) for pmid in range(8)]
+        assert 1 < CatStandIn.max_in_flight <= 4
+
+        # Another worker with the same ledger skips them; a changed abstract is uploaded again
+        other = new_client(base_url, ledger=rabbithole_ledger.IngestLedger(ledger.path))
+        results = other.ingest_documents([article('1'), article('2', abstract="Revised abstract")])
+        assert [result['status'] for result in results] == ['already_ingested', 'uploaded']
+        assert CatStandIn.uploads[8:] == ['2']
+        assert other.upload_documents([article('1')]) == (1, [])
+
+        # A different Cat has its own entries
+        assert new_client(base_url + '/', ledger=ledger).base_url == base_url
+        assert ledger.ingested('http://other-cat:80', [results[0]['content_hash']]) == set()
+    finally:
+        server.shutdown()
+
+
+def test_failed_uploads_are_reported_and_retried():
+    server, base_url = start_stand_in(failing={'2'})
+    try:
+        client = new_client(base_url, ledger=new_ledger(), upload_workers=2)
+        client.breaker.failure_threshold = 1
+        results = client.ingest_documents([article('1'), article('2')])
+        assert [result['status'] for result in results] == ['uploaded', 'failed']
+        assert results[1]['error'] == "Cheshire Cat returned status code 500"
+        assert client.upload_documents([article('1'), article('2')]) == (1, ['2'])
+        assert CatStandIn.uploads.count('2') == 2
+
+        # The Cat answered: a document it could not ingest (or any 5xx) does not open the circuit
+        CatStandIn.message_status = 503
+        assert client.ask_question("RUNX1?") == "Error: Cheshire Cat returned status code 503"
+        assert client.breaker.state == circuit_breaker.CLOSED
+    finally:
+        server.shutdown()
+
+
+def test_circuit_opens_when_the_cat_is_down_and_recovers():
+    server, base_url = start_stand_in()
+    try:
+        client = new_client(base_url)
+        breaker = client.breaker = circuit_breaker.CircuitBreaker(client.probe, failure_threshold=2,
+                                                                  reset_timeout=0.2, interval=0)
+        CatStandIn.down = True
+        assert client.ask_question("RUNX1?").startswith("Error communicating with Cheshire Cat")
+        assert breaker.state == circuit_breaker.CLOSED
+        assert client.ask_question("RUNX1?").startswith("Error communicating with Cheshire Cat")
+        assert breaker.state == circuit_breaker.OPEN and not client.test_connection()
+
+        # While open, calls fail fast without reaching the Cat
+        seen = CatStandIn.requests_seen
+        assert client.ask_question("RUNX1?").startswith("Error: Cannot connect to Cheshire Cat")
+        try:
+            client.ingest_documents([article('1')])
+        except circuit_breaker.CircuitOpenError:
+            pass
+        else:
+            raise AssertionError("upload sent with the circuit open")
+        assert CatStandIn.requests_seen == seen
+
+        # After reset_timeout one trial goes through and closes the circuit
+        CatStandIn.down = False
+        time.sleep(0.25)
+        assert client.ask_question("RUNX1?") == "RUNX1 is a transcription factor."
+        assert breaker.state == circuit_breaker.CLOSED
+
+        # The background probe opens the circuit with no calls at all
+        CatStandIn.down = True
+        breaker.interval = 0.02
+        assert client.test_connection()
+        deadline = time.monotonic() + 5
+        while breaker.state != circuit_breaker.OPEN and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert not client.test_connection()
+        assert breaker.snapshot()['last_probe'] is not None
+        breaker.stop()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_documents_already_ingested_are_not_uploaded_again()
+    test_failed_uploads_are_reported_and_retried()
+    test_circuit_opens_when_the_cat_is_down_and_recovers()
+    print("✅ Cheshire Cat client tests passed")